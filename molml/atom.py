@@ -6,21 +6,23 @@ based on the atoms in the molecule. This means that every molecule will
 result in an array of values (n_atoms, n_features).
 """
 from builtins import range
+from itertools import product
 
 import numpy
-from scipy.spatial.distance import cdist
+import scipy.sparse
 
-from .base import BaseFeature, SetMergeMixin, EncodedFeature
-from .utils import get_depth_threshold_mask_connections, get_coulomb_matrix
-from .utils import get_element_pairs, cosine_decay, get_angles
-from .utils import get_index_mapping
+from .base import BaseFeature, SetMergeMixin, SparseMixin, EncodedFeature
+from .utils import get_coulomb_matrix
+from .utils import get_element_pairs, cosine_decay
+from .utils import FeatureLayout
+from .utils import get_pair_triplets
 
 
 __all__ = ("Shell", "LocalEncodedBond", "LocalEncodedAngle",
            "LocalCoulombMatrix", "BehlerParrinello")
 
 
-class Shell(SetMergeMixin, BaseFeature):
+class Shell(SetMergeMixin, SparseMixin, BaseFeature):
     """
     A feature that counts the number of elements in a distance shell from the
     starting atom. This is similar to the features developed in Qu et. al.
@@ -48,6 +50,10 @@ class Shell(SetMergeMixin, BaseFeature):
         Specifies whether or not to include an extra UNKNOWN count in the
         feature vector.
 
+    sparse : boolean, default=False
+        Specifies whether or not to return a scipy.sparse.csr_matrix for each
+        molecule from transform instead of dense arrays.
+
     Attributes
     ----------
     _elements : set
@@ -63,11 +69,12 @@ class Shell(SetMergeMixin, BaseFeature):
     LABELS = ("_elements", )
 
     def __init__(self, input_type='list', n_jobs=1, depth=1,
-                 use_coordination=False, add_unknown=False):
+                 use_coordination=False, add_unknown=False, sparse=False):
         super(Shell, self).__init__(input_type=input_type, n_jobs=n_jobs)
         self.depth = depth
         self.use_coordination = use_coordination
         self.add_unknown = add_unknown
+        self.sparse = sparse
         self._elements = None
 
     def _loop_depth(self, start, connections):
@@ -137,6 +144,9 @@ class Shell(SetMergeMixin, BaseFeature):
             counts[ele] += 1
         return counts
 
+    def _compile_layouts(self):
+        return {"_elements": FeatureLayout(self._elements)}
+
     def _para_fit(self, X):
         """
         A single instance of the fit procedure.
@@ -186,23 +196,103 @@ class Shell(SetMergeMixin, BaseFeature):
             If the transformer has not been fit.
         """
         self.check_fit()
+
+        rows, columns, values, shape = self._get_tally_columns(X)
+        vectors = [[0] * shape[1] for _ in range(shape[0])]
+        for row, column, value in zip(rows, columns, values):
+            vectors[row][column] = value
+        return vectors
+
+    def _para_transform_sparse(self, X):
+        """
+        A single instance of the transform procedure with sparse output.
+
+        Parameters
+        ----------
+        X : object
+            An object to use for the transform
+
+        Returns
+        -------
+        value : scipy.sparse.csr_matrix, shape=(n_atoms, n_features)
+            The features extracted from the molecule
+
+        Raises
+        ------
+        ValueError
+            If the transformer has not been fit.
+        """
+        self.check_fit()
+
+        rows, columns, values, shape = self._get_tally_columns(X)
+        return scipy.sparse.csr_matrix((values, (rows, columns)),
+                                       shape=shape)
+
+    def _get_tally_columns(self, X):
+        """
+        Get the nonzero features of all the atoms in a molecule.
+
+        Parameters
+        ----------
+        X : object
+            An object to use for the transform
+
+        Returns
+        -------
+        rows : list
+            The atom of each value
+
+        columns : list
+            The feature column of each value
+
+        values : list
+            The nonzero feature values
+
+        shape : tuple
+            The number of atoms and the number of features
+        """
         data = self.convert_input(X)
+        element_columns = self._get_columns()
+        n_features = len(element_columns) + bool(self.add_unknown)
 
-        vectors = []
-        order = sorted(self._elements)
+        rows = []
+        columns = []
+        values = []
         for atom in range(len(data.elements)):
             limits = self._loop_depth(atom, data.connections)
             tallies = self._tally_limits(limits, data.elements,
                                          data.connections)
-            vec = [tallies.get(x, 0) for x in order]
-            if self.add_unknown:
-                unknown = 0
-                for key, value in tallies.items():
-                    if key not in self._elements:
-                        unknown += value
-                vec.append(unknown)
-            vectors.append(vec)
-        return vectors
+            unknown = 0
+            for key, value in tallies.items():
+                column = element_columns.get(key)
+                if column is None:
+                    unknown += value
+                    continue
+                rows.append(atom)
+                columns.append(column)
+                values.append(value)
+            if self.add_unknown and unknown:
+                rows.append(atom)
+                columns.append(n_features - 1)
+                values.append(unknown)
+        return rows, columns, values, (len(data.elements), n_features)
+
+    def _stack_sparse(self, results):
+        """
+        Combine the sparse results of each value.
+
+        Parameters
+        ----------
+        results : list
+            The results of _para_transform_sparse for all of the values.
+
+        Returns
+        -------
+        matrices : list of scipy.sparse.csr_matrix
+            The transformed features of each molecule, with shape
+            (n_atoms, n_features).
+        """
+        return list(results)
 
 
 class LocalEncodedBond(SetMergeMixin, EncodedFeature):
@@ -295,6 +385,11 @@ class LocalEncodedBond(SetMergeMixin, EncodedFeature):
         self.form = form
         self.add_unknown = add_unknown
 
+    def _compile_layouts(self):
+        layout = FeatureLayout(self._elements, form=self.form,
+                               add_unknown=self.add_unknown)
+        return {"_elements": layout}
+
     def _para_fit(self, X):
         """
         A single instance of the fit procedure.
@@ -316,20 +411,18 @@ class LocalEncodedBond(SetMergeMixin, EncodedFeature):
         # This is just a cheap way to approximate the actual value
         return set(data.elements)
 
-    def _iterator(self, data, get_index, both=None):
-        mat = get_depth_threshold_mask_connections(data.connections,
-                                                   min_depth=self.min_depth,
-                                                   max_depth=self.max_depth)
-        distances = cdist(data.coords, data.coords)
-        for i, ele1 in enumerate(data.elements):
-            for j, ele2 in enumerate(data.elements):
-                if i == j or not mat[i, j]:
-                    continue
-                try:
-                    idx = i, get_index(ele2)
-                except KeyError:
-                    idx = None
-                yield idx, distances[i, j], 1.
+    def _iterator(self, data, layout):
+        mat = data.get_depth_mask(min_depth=self.min_depth,
+                                  max_depth=self.max_depth)
+        distances = data.distances
+        codes = layout.encode(data)
+        table, valid = layout.get_code_table(1)
+
+        n = len(codes)
+        i, j = numpy.where(~numpy.eye(n, dtype=bool))
+        keep = mat[i, j] & valid[codes[j]]
+        i, j = i[keep], j[keep]
+        return i, table[codes[j]], distances[i, j], numpy.ones(len(i))
 
     def _para_transform(self, X, y=None):
         """
@@ -355,10 +448,10 @@ class LocalEncodedBond(SetMergeMixin, EncodedFeature):
         """
         self.check_fit()
         data = self.convert_input(X)
-        get_index, length, _ = get_index_mapping(self._elements, self.form,
-                                                 self.add_unknown)
-        iterator = self._iterator(data, get_index)
-        return self.encode_atom_values(iterator, len(data.elements), length)
+        layout = self._get_layouts()["_elements"]
+        atom_idxs, idxs, values, scalings = self._iterator(data, layout)
+        return self.encode_atom_array(atom_idxs, idxs, values, scalings,
+                                      len(data.elements), layout.length)
 
 
 class LocalEncodedAngle(SetMergeMixin, EncodedFeature):
@@ -443,6 +536,11 @@ class LocalEncodedAngle(SetMergeMixin, EncodedFeature):
     def f_c(self, R):
         return cosine_decay(R, r_cut=self.r_cut)
 
+    def _compile_layouts(self):
+        layout = FeatureLayout(self._pairs, form=self.form,
+                               add_unknown=self.add_unknown)
+        return {"_pairs": layout}
+
     def _para_fit(self, X):
         """
         A single instance of the fit procedure.
@@ -464,35 +562,28 @@ class LocalEncodedAngle(SetMergeMixin, EncodedFeature):
         # This is just a cheap way to approximate the actual value
         return get_element_pairs(data.elements)
 
-    def _iterator(self, data, get_index, both):
-        mat = get_depth_threshold_mask_connections(data.connections,
-                                                   min_depth=self.min_depth,
-                                                   max_depth=self.max_depth)
-
-        distances = cdist(data.coords, data.coords)
-        f_c = self.f_c(distances)
-        angles = get_angles(data.coords)
-        for i, ele1 in enumerate(data.elements):
-            for j, ele2 in enumerate(data.elements):
-                if i == j or not mat[i, j]:
-                    continue
-                if not f_c[i, j]:
-                    continue
-                for k, ele3 in enumerate(data.elements):
-                    if j == k or not mat[j, k]:
-                        continue
-                    if i > k and not both:
-                        continue
-                    if not f_c[i, k] or not f_c[j, k]:
-                        continue
-
-                    eles = ele1, ele3
-                    try:
-                        idx = j, get_index(eles)
-                    except KeyError:
-                        idx = None
-                    F = f_c[i, j] * f_c[j, k] * f_c[i, k]
-                    yield idx, angles[i, j, k], F
+    def _iterator(self, data, layout):
+        mat = data.get_depth_mask(min_depth=self.min_depth,
+                                  max_depth=self.max_depth)
+        distances = data.distances
+        i, j, k = data.get_cutoff_triplets(self.r_cut)
+        angles = data.get_triplet_angles(self.r_cut)
+        f_c_ij = self.f_c(distances[i, j])
+        f_c_jk = self.f_c(distances[j, k])
+        f_c_ik = self.f_c(distances[i, k])
+        keep = (f_c_ij != 0) & (f_c_jk != 0) & (f_c_ik != 0)
+        keep &= mat[i, j] & mat[j, k]
+        if not layout.both:
+            keep &= i <= k
+
+        codes = layout.encode(data)
+        table, valid = layout.get_code_table(2)
+        keep &= valid[codes[i], codes[k]]
+
+        i, j, k = i[keep], j[keep], k[keep]
+        F = f_c_ij[keep] * f_c_jk[keep] * f_c_ik[keep]
+        idxs = table[codes[i], codes[k]]
+        return j, idxs, angles[keep], F
 
     def _para_transform(self, X, y=None):
         """
@@ -518,11 +609,10 @@ class LocalEncodedAngle(SetMergeMixin, EncodedFeature):
         """
         self.check_fit()
         data = self.convert_input(X)
-        get_index, length, both = get_index_mapping(self._pairs, self.form,
-                                                    self.add_unknown)
-
-        iterator = self._iterator(data, get_index, both)
-        return self.encode_atom_values(iterator, len(data.elements), length)
+        layout = self._get_layouts()["_pairs"]
+        atom_idxs, idxs, values, scalings = self._iterator(data, layout)
+        return self.encode_atom_array(atom_idxs, idxs, values, scalings,
+                                      len(data.elements), layout.length)
 
 
 class LocalCoulombMatrix(BaseFeature):
@@ -611,7 +701,7 @@ class LocalCoulombMatrix(BaseFeature):
             The features extracted from the molecule
         """
         data = self.convert_input(X)
-        dist = cdist(data.coords, data.coords)
+        dist = data.distances
 
         numbers = numpy.array(data.numbers)
         coords = numpy.array(data.coords)
@@ -661,18 +751,18 @@ class BehlerParrinello(SetMergeMixin, BaseFeature):
         The maximum distance allowed for atoms to be considered local to the
         "central atom".
 
-    r_s : float, default=1.0
+    r_s : float or list of floats, default=1.0
         An offset parameter for computing gaussian values between pairwise
         distances.
 
-    eta : float, default=1.0
+    eta : float or list of floats, default=1.0
         A decay parameter for the gaussian distances.
 
-    lambda_ : float, default=1.0
+    lambda_ : float or list of floats, default=1.0
         This value sets the orientation of the cosine function for the angles.
         It should only take values in {-1., 1.}.
 
-    zeta : float, default=1.0
+    zeta : float or list of floats, default=1.0
         A decay parameter for the angular terms.
 
     Attributes
@@ -683,6 +773,15 @@ class BehlerParrinello(SetMergeMixin, BaseFeature):
     _element_pairs : set
         A set of all the element pairs in the molecules.
 
+    Notes
+    -----
+    If lists of parameters are given, then the symmetry functions are
+    evaluated for all the parameter sets at the same time. The radial
+    functions use every combination of (eta, r_s), and the angular functions
+    use every combination of (eta, lambda_, zeta). The resulting blocks are
+    stacked with all the radial blocks first, in the order given by
+    get_radial_parameters and get_angular_parameters.
+
     References
     ----------
     Behler, J; Parrinello, M. Generalized Neural-Network Representation of
@@ -703,6 +802,12 @@ class BehlerParrinello(SetMergeMixin, BaseFeature):
         self._elements = None
         self._element_pairs = None
 
+    def _compile_layouts(self):
+        return {
+            "_elements": FeatureLayout(self._elements),
+            "_element_pairs": FeatureLayout(self._element_pairs, form=2),
+        }
+
     def _para_fit(self, X):
         """
         A single instance of the fit procedure.
@@ -732,6 +837,44 @@ class BehlerParrinello(SetMergeMixin, BaseFeature):
     def f_c(self, R):
         return cosine_decay(R, r_cut=self.r_cut)
 
+    def get_radial_parameters(self):
+        """
+        Get all the parameter sets used for the radial symmetry functions.
+
+        Returns
+        -------
+        eta : array, shape=(n_sets, )
+            The eta value of each set.
+
+        r_s : array, shape=(n_sets, )
+            The r_s value of each set.
+        """
+        values = product(numpy.atleast_1d(self.eta),
+                         numpy.atleast_1d(self.r_s))
+        eta, r_s = numpy.array(list(values), dtype=float).T
+        return eta, r_s
+
+    def get_angular_parameters(self):
+        """
+        Get all the parameter sets used for the angular symmetry functions.
+
+        Returns
+        -------
+        eta : array, shape=(n_sets, )
+            The eta value of each set.
+
+        lambda_ : array, shape=(n_sets, )
+            The lambda_ value of each set.
+
+        zeta : array, shape=(n_sets, )
+            The zeta value of each set.
+        """
+        values = product(numpy.atleast_1d(self.eta),
+                         numpy.atleast_1d(self.lambda_),
+                         numpy.atleast_1d(self.zeta))
+        eta, lambda_, zeta = numpy.array(list(values), dtype=float).T
+        return eta, lambda_, zeta
+
     def g_1(self, R, elements):
         r"""
         A radial symmetry function.
@@ -747,20 +890,24 @@ class BehlerParrinello(SetMergeMixin, BaseFeature):
 
         Returns
         -------
-        total : array, shape=(N_atoms, N_elements)
+        total : array, shape=(N_atoms, N_radial_sets * N_elements)
             The atom-wise g_1 evaluations.
         """
-        values = numpy.exp(-self.eta * (R - self.r_s) ** 2) * self.f_c(R)
-        numpy.fill_diagonal(values, 0)
-
-        elements = numpy.array(elements)
-
-        totals = []
-        for ele in sorted(self._elements):
-            idxs = numpy.where(elements == ele)[0]
-            total = values[:, idxs].sum(1)
-            totals.append(total)
-        return numpy.array(totals).T
+        eta, r_s = self.get_radial_parameters()
+        values = numpy.exp(-eta[:, None, None] * (R - r_s[:, None, None]) ** 2)
+        values *= self.f_c(R)
+        idxs = numpy.arange(R.shape[0])
+        values[:, idxs, idxs] = 0
+
+        # Sum the values of each element with a one-hot matrix
+        layout = self._get_layouts()["_elements"]
+        codes = layout.encode_elements(elements)
+        table, valid = layout.get_code_table(1)
+        onehot = numpy.zeros((len(codes), len(layout.keys)))
+        atoms = numpy.where(valid[codes])[0]
+        onehot[atoms, table[codes[atoms]]] = 1
+        totals = values.dot(onehot)
+        return numpy.hstack(totals)
 
     def g_2(self, Theta, R, elements):
         r"""
@@ -774,7 +921,8 @@ class BehlerParrinello(SetMergeMixin, BaseFeature):
                         f_c(R_{ij}) f_c(R_{ik}) f_c(R_{jk})
 
 
-        This function needs to be optimized.
+        Only the triplets where all three distances are within the cutoff are
+        evaluated.
 
         Parameters
         ----------
@@ -789,54 +937,52 @@ class BehlerParrinello(SetMergeMixin, BaseFeature):
 
         Returns
         -------
-        total : array, shape=(N_atoms, len(self._element_pairs))
+        total : array, shape=(N_atoms,
+                              N_angular_sets * len(self._element_pairs))
             The atom-wise g_2 evaluations.
         """
+        eta, lambda_, zeta = self.get_angular_parameters()
         F_c_R = self.f_c(R)
+        R2 = R ** 2
 
-        R2 = self.eta * R ** 2
-        new_Theta = (1 - self.lambda_ * numpy.cos(Theta)) ** self.zeta
-
-        get_index, length, _ = get_index_mapping(self._element_pairs,
-                                                 2,
-                                                 False)
+        layout = self._get_layouts()["_element_pairs"]
+        length = layout.length
+        codes = layout.encode_elements(elements)
+        table, valid = layout.get_code_table(2)
 
+        # Triplets centered on i where j and k are both within the cutoff
         n = R.shape[0]
-        values = numpy.zeros((n, length))
-        for i in range(n):
-            for j in range(n):
-                if i == j or not F_c_R[i, j]:
-                    continue
-                ele1 = elements[j]
-
-                for k in range(n):
-                    if k == i or j == k:
-                        continue
-                    if not F_c_R[i, k] or not F_c_R[j, k]:
-                        continue
-                    ele2 = elements[k]
-                    eles = ele1, ele2
-
-                    exp_term = numpy.exp(-(R2[i, j] + R2[i, k] + R2[j, k]))
-                    angular_term = new_Theta[i, j, k]
-                    radial_cuts = F_c_R[i, j] * F_c_R[i, k] * F_c_R[j, k]
-                    temp = angular_term * exp_term * radial_cuts
-                    try:
-                        values[i, get_index(eles)] += temp
-                    except KeyError:
-                        pass
-        return 2 ** (1 - self.zeta) * values
+        pairs = numpy.argwhere(numpy.triu(F_c_R != 0, k=1))
+        j, i, k = get_pair_triplets(pairs, n)
+        keep = (j != k) & (F_c_R[j, k] != 0) & valid[codes[j], codes[k]]
+        i, j, k = i[keep], j[keep], k[keep]
+        order = numpy.lexsort((k, j, i))
+        i, j, k = i[order], j[order], k[order]
+
+        # The geometry is shared between all of the parameter sets
+        cos_theta = numpy.cos(Theta[i, j, k])
+        R2_sum = R2[i, j] + R2[i, k] + R2[j, k]
+        radial_cuts = F_c_R[i, j] * F_c_R[i, k] * F_c_R[j, k]
+
+        angular_term = 1 - lambda_[:, None] * cos_theta
+        angular_term **= zeta[:, None]
+        exp_term = numpy.exp(-eta[:, None] * R2_sum)
+        temp = angular_term * exp_term * radial_cuts
+        temp *= 2 ** (1 - zeta[:, None])
+
+        values = numpy.zeros((n, length, len(eta)))
+        numpy.add.at(values, (i, table[codes[j], codes[k]]), temp.T)
+        return values.transpose(0, 2, 1).reshape(n, -1)
 
     def calculate_Theta(self, R_vecs):
-        """
+        r"""
         Compute the angular term for all triples of atoms.
 
         .. math::
 
             \Theta_{ijk} = (R_{ij} . R_{ik}) / (|R_{ij}| |R_{ik}|)
 
-        Right now this is a fairly naive implementation so this could be
-        optimized quite a bit.
+        All the triples with repeated atoms are set to 0.
 
         Parameters
         ----------
@@ -848,20 +994,18 @@ class BehlerParrinello(SetMergeMixin, BaseFeature):
         Theta : array, shape=(N_atoms, N_atoms, N_atoms)
             The angular term for all the atoms given.
         """
+        R_vecs = numpy.asarray(R_vecs, dtype=float)
         n = R_vecs.shape[0]
-        Theta = numpy.zeros((n, n, n))
-        for i, Ri in enumerate(R_vecs):
-            for j, Rj in enumerate(R_vecs):
-                if i == j:
-                    continue
-                Rij = Ri - Rj
-                normRij = numpy.linalg.norm(Rij)
-                for k, Rk in enumerate(R_vecs):
-                    if i == k or j == k:
-                        continue
-                    Rik = Ri - Rk
-                    normRik = numpy.linalg.norm(Rik)
-                    Theta[i, j, k] = numpy.dot(Rij, Rik) / (normRij * normRik)
+        diffs = R_vecs[:, None] - R_vecs
+        norms = numpy.linalg.norm(diffs, axis=2)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            Theta = numpy.einsum('ijx,ikx->ijk', diffs, diffs)
+            Theta /= norms[:, :, None] * norms[:, None, :]
+
+        idxs = numpy.arange(n)
+        Theta[idxs, idxs, :] = 0
+        Theta[idxs, :, idxs] = 0
+        Theta[:, idxs, idxs] = 0
         return Theta
 
     def _para_transform(self, X):
@@ -890,9 +1034,8 @@ class BehlerParrinello(SetMergeMixin, BaseFeature):
 
         data = self.convert_input(X)
 
-        coords = numpy.array(data.coords)
-        R = cdist(coords, coords)
-        Theta = self.calculate_Theta(coords)
+        R = data.distances
+        Theta = self.calculate_Theta(data.coords)
 
         g1 = self.g_1(R, data.elements)
         g2 = self.g_2(Theta, R, data.elements)
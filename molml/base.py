@@ -4,17 +4,45 @@ A collection of all the base transformer constructions.
 This module is a collection of all the base classes and mixins for use with
 the other transformers.
 """
+import copy
 import inspect
+import itertools
 import multiprocessing
-from functools import reduce
+from functools import partial, reduce
 import json
 
+import dill
 import numpy
-from pathos.multiprocessing import ProcessingPool as Pool
+from pathos.helpers import mp
+import scipy.sparse
 
 from .utils import get_smoothing_function, get_spacing_function
-from .utils import LazyValues
+from .utils import LazyValues, _to_tuple
 from .io import read_file_data
+from .cache import get_transformer_hash, get_molecule_hash
+
+
+# getargspec was removed in Python 3.11
+_getargspec = getattr(inspect, "getfullargspec", None) or inspect.getargspec
+
+
+# The maximum number of grid values to create at once when encoding
+ENCODE_BLOCK_SIZE = 2 ** 20
+
+
+def _unpack_encode_items(iterator):
+    """
+    Convert an iterable of (idx, value, scaling) items into arrays.
+
+    Items with an idx of None are skipped.
+    """
+    items = [x for x in iterator if x[0] is not None]
+    if not items:
+        return (numpy.zeros(0, dtype=int), numpy.zeros(0),
+                numpy.zeros(0))
+    idxs, values, scalings = zip(*items)
+    return (numpy.array(idxs, dtype=int), numpy.array(values, dtype=float),
+            numpy.array(scalings, dtype=float))
 
 
 def _func_star(args):
@@ -31,6 +59,164 @@ def _func_star(args):
     return f(*args)
 
 
+# The most recently loaded mapped function in this (worker) process
+_WORKER_FUNCTION = {}
+_MAP_COUNTER = itertools.count()
+
+
+def _map_chunk(args):
+    """
+    Apply a serialized function to a chunk of values.
+
+    This is run inside of the worker processes. The serialized function is
+    sent with every chunk, but it is only deserialized the first time a worker
+    sees it, so that the transformer it is bound to is not reloaded for every
+    chunk of the same map call.
+    """
+    key, payload, chunk = args
+    if key not in _WORKER_FUNCTION:
+        _WORKER_FUNCTION.clear()
+        _WORKER_FUNCTION[key] = dill.loads(payload)
+    f = _WORKER_FUNCTION[key]
+    return [f(x) for x in chunk]
+
+
+class WorkerPool(object):
+    """
+    A persistent pool of worker processes.
+
+    The processes are only started when the pool is first used, and they stay
+    alive until the pool is closed. This allows the same processes to be
+    reused across calls, and shared between multiple transformers. The pool
+    can also be used as a context manager, in which case it will be closed
+    when the block exits.
+
+    Parameters
+    ----------
+    n_jobs : int, default=-1
+        Specifies the number of processes to create. Positive numbers specify
+        a specifc amount, and numbers less than 1 will use the number of cores
+        the computer has.
+
+    chunksize : int, default=None
+        The number of values to send to a worker in each task. If this is
+        None, then the values are split into roughly 4 chunks per process.
+    """
+    def __init__(self, n_jobs=-1, chunksize=None):
+        if n_jobs < 1:
+            n_jobs = multiprocessing.cpu_count()
+        self.n_jobs = n_jobs
+        self.chunksize = chunksize
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._pool is None
+
+    def get_chunksize(self, n):
+        """
+        Get the number of values to send in each task.
+
+        Parameters
+        ----------
+        n : int
+            The total number of values being mapped.
+
+        Returns
+        -------
+        chunksize : int
+            The number of values per task.
+        """
+        if self.chunksize is not None:
+            return max(int(self.chunksize), 1)
+        chunksize, extra = divmod(n, self.n_jobs * 4)
+        return max(chunksize + bool(extra), 1)
+
+    def map(self, f, seq, chunksize=None):
+        """
+        Map a function over a sequence using the worker processes.
+
+        The values are sent to the workers in chunks. The function (along
+        with any transformer it is bound to) is serialized once per call, and
+        those bytes are sent along with every chunk. Each worker only
+        deserializes them the first time it sees the call.
+
+        Parameters
+        ----------
+        f : callable
+            A function to map to all the values in 'seq'
+
+        seq : iterable
+            An iterable of values to process with 'f'
+
+        chunksize : int, default=None
+            The number of values to send to a worker in each task. If this is
+            None, then the value from the pool is used.
+
+        Returns
+        -------
+        results : list, shape=[len(seq)]
+            The evaluated values
+        """
+        seq = list(seq)
+        if not seq:
+            return []
+        if chunksize is None:
+            chunksize = self.get_chunksize(len(seq))
+        if self._pool is None:
+            self._pool = mp.Pool(self.n_jobs)
+
+        key = next(_MAP_COUNTER)
+        payload = dill.dumps(f)
+        tasks = [(key, payload, seq[i:i + chunksize])
+                 for i in range(0, len(seq), chunksize)]
+        results = self._pool.map(_map_chunk, tasks, chunksize=1)
+        return [x for chunk in results for x in chunk]
+
+    def close(self):
+        """
+        Shutdown all the worker processes.
+
+        The pool may still be used after closing, but new processes will be
+        started when it is.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+_DEFAULT_POOLS = {}
+
+
+def get_default_pool(n_jobs):
+    """
+    Get the shared pool for a given number of processes.
+
+    Parameters
+    ----------
+    n_jobs : int
+        The number of processes in the pool. Numbers less than 1 will use the
+        number of cores the computer has.
+
+    Returns
+    -------
+    pool : WorkerPool
+        The pool that is shared by all transformers with this value of n_jobs.
+    """
+    if n_jobs < 1:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs not in _DEFAULT_POOLS:
+        _DEFAULT_POOLS[n_jobs] = WorkerPool(n_jobs=n_jobs)
+    return _DEFAULT_POOLS[n_jobs]
+
+
 class BaseFeature(object):
     """
     A base class for all the features.
@@ -50,12 +236,27 @@ class BaseFeature(object):
         features. Positive numbers specify a specifc amount, and numbers less
         than 1 will use the number of cores the computer has.
     """
+    # An explicitly set WorkerPool (see set_pool)
+    _pool = None
+    # An optional FeatureCache for the transformed values (see set_cache)
+    _feature_cache = None
+    # The default number of values to process at once in transform_iter
+    BATCH_SIZE = 1024
+    # The compiled layouts of the fit attributes (see _get_layouts)
+    _layouts = None
+
     def __init__(self, input_type='list', n_jobs=1):
         self.input_type = input_type
         self.n_jobs = n_jobs
 
+    def __getstate__(self):
+        # Worker pools can not be sent to other processes
+        state = self.__dict__.copy()
+        state.pop("_pool", None)
+        return state
+
     def _get_param_strings(self):
-        argspec = inspect.getargspec(type(self).__init__)
+        argspec = _getargspec(type(self).__init__)
         # Delete the only non-keyword argument
         args = [x for x in argspec.args if x != "self"]
         values = [getattr(self, x) for x in args]
@@ -82,6 +283,8 @@ class BaseFeature(object):
                 setattr(self, key, value)
             except AttributeError:
                 continue
+        # The layouts may depend on the parameters
+        self._layouts = None
 
     def get_params(self):
         """
@@ -92,7 +295,7 @@ class BaseFeature(object):
             params : dict
                 A dictonary of all the feature parameters.
         """
-        argspec = inspect.getargspec(type(self).__init__)
+        argspec = _getargspec(type(self).__init__)
         # Delete the only non-keyword argument
         args = [x for x in argspec.args if x != "self"]
         values = [getattr(self, x) for x in args]
@@ -165,7 +368,13 @@ class BaseFeature(object):
 
         If input_type is a callable, then it is assumed that the callable
         returns a LazyValues object.
+
+        If X is already a LazyValues object, then it is used directly for any
+        input_type. This allows one prepared object (and all of the geometry
+        values it has cached) to be shared by several transformers.
         """
+        if isinstance(X, LazyValues):
+            return X
         connections = None
         if self.input_type == "list":
             try:
@@ -200,7 +409,9 @@ class BaseFeature(object):
         if self.LABELS is None:
             return tuple()
 
-        values = [tuple(sorted(getattr(self, x))) for x in self.LABELS]
+        # The labels are lists after loading with load_json
+        values = [tuple(sorted(_to_tuple(y) for y in getattr(self, x)))
+                  for x in self.LABELS]
         return sum(values, tuple())
 
     def check_fit(self):
@@ -220,6 +431,42 @@ class BaseFeature(object):
             if getattr(self, key) is None:
                 raise ValueError(msg % type(self).__name__)
 
+    def _compile_layouts(self):
+        """
+        Compile the layouts of the fit attributes.
+
+        Returns
+        -------
+        layouts : dict, str->FeatureLayout
+            The layout of each fit attribute that has one.
+        """
+        return {}
+
+    def _get_layouts(self):
+        """
+        Get the compiled layouts of the fit attributes.
+
+        The layouts are only compiled once for each fit. If the transformer
+        has not been fit yet, then there are no layouts.
+
+        Returns
+        -------
+        layouts : dict, str->FeatureLayout
+            The layout of each fit attribute that has one.
+        """
+        try:
+            self.check_fit()
+        except ValueError:
+            return {}
+        layouts = self._layouts
+        if layouts is None or any(x.source is not getattr(self, key)
+                                  for key, x in layouts.items()):
+            layouts = self._compile_layouts()
+            for key, layout in layouts.items():
+                layout.source = getattr(self, key)
+            self._layouts = layouts
+        return layouts
+
     @classmethod
     def get_citation(self):
         try:
@@ -240,7 +487,105 @@ class BaseFeature(object):
         except ValueError:
             return "MolML https://github.com/crcollins/molml"
 
-    def map(self, f, seq):
+    def set_pool(self, pool):
+        """
+        Set a persistent pool of processes to use for map and reduce.
+
+        When a pool is set, it will be used for all parallel operations
+        regardless of the value of n_jobs. This allows a single pool to be
+        shared between multiple transformers.
+
+        Parameters
+        ----------
+        pool : WorkerPool or None
+            The pool to use. If None, the shared pool for n_jobs is used.
+
+        Returns
+        -------
+        self : object
+            Returns the instance itself.
+        """
+        self._pool = pool
+        return self
+
+    def get_pool(self):
+        """
+        Get the pool of processes to use for map and reduce.
+
+        Returns
+        -------
+        pool : WorkerPool or None
+            The pool to use, or None if the operations should be done in
+            serial.
+        """
+        if self._pool is not None:
+            return self._pool
+        if self.n_jobs == 1:
+            return None
+        return get_default_pool(self.n_jobs)
+
+    def set_cache(self, cache):
+        """
+        Set an on-disk cache to use for the transformed values.
+
+        The features of each value are stored with a key from the
+        parameters and fit of the transformer, and the elements, coordinates,
+        connections, and unit cell of the molecule. Repeated transforms of
+        the same molecules are then loaded instead of being recomputed.
+
+        Parameters
+        ----------
+        cache : FeatureCache or None
+            The cache to use. If None, then no cache is used.
+
+        Returns
+        -------
+        self : object
+            Returns the instance itself.
+        """
+        self._feature_cache = cache
+        return self
+
+    def get_cache(self):
+        """
+        Get the on-disk cache used for the transformed values.
+
+        Returns
+        -------
+        cache : FeatureCache or None
+            The cache, or None if there is not one.
+        """
+        return self._feature_cache
+
+    def _para_transform_cached(self, prefix, X):
+        """
+        Transform a single value using the cache if it has been set.
+
+        Parameters
+        ----------
+        prefix : str or None
+            The hash of the transformer (see get_transformer_hash)
+
+        X : object
+            An object to use for the transform
+
+        Returns
+        -------
+        value : array-like
+            The features extracted from the molecule
+        """
+        cache = self.get_cache()
+        if cache is None:
+            return self._para_transform(X)
+        data = self.convert_input(X)
+        key = prefix + get_molecule_hash(data)
+        value = cache.get(key)
+        if value is None:
+            value = numpy.asarray(self._para_transform(data))
+            cache.set(key, value)
+        return value
+
+    def map(self, f, seq, chunksize=None):
         """
         Parallel implementation of map.
 
@@ -252,23 +597,19 @@ class BaseFeature(object):
         seq : iterable
             An iterable of values to process with 'f'
 
+        chunksize : int, default=None
+            The number of values to send to a worker in each task. If this is
+            None, then the value from the pool is used.
+
         Returns
         -------
         results : list, shape=[len(seq)]
             The evaluated values
         """
-        if self.n_jobs < 1:
-            n_jobs = multiprocessing.cpu_count()
-        elif self.n_jobs == 1:
+        pool = self.get_pool()
+        if pool is None:
             return list(map(f, seq))
-        else:
-            n_jobs = self.n_jobs
-
-        pool = Pool(n_jobs)
-        results = list(pool.map(f, seq))
-        # Closing/joining is not really allowed because pathos sees pools as
-        # lasting for the duration of the program.
-        return results
+        return pool.map(f, seq, chunksize=chunksize)
 
     def reduce(self, f, seq):
         """
@@ -289,7 +630,7 @@ class BaseFeature(object):
         results : object
             A single reduced object based on 'seq' and 'f'
         """
-        if self.n_jobs == 1:
+        if self.get_pool() is None:
             return reduce(f, seq)
 
         while len(seq) > 1:
@@ -318,6 +659,144 @@ class BaseFeature(object):
         """
         raise NotImplementedError
 
+    def partial_fit(self, X, y=None):
+        """
+        Update the fit of the model with more values.
+
+        The fit of the new values is merged into the current fit, so calling
+        this over several batches gives the same result as calling `fit` on
+        all of them at once. If the model has not been fit yet, then this is
+        the same as `fit`. After each call, `_new_labels` has the labels of
+        any features that were added to the feature layout.
+
+        Parameters
+        ----------
+        X : list, shape=(n_samples, )
+            A list of objects to use to fit.
+
+        Returns
+        -------
+        self : object
+            Returns the instance itself.
+
+        Raises
+        ------
+        NotImplementedError
+            If the fit of this transformer can not be merged.
+        """
+        if self.ATTRIBUTES is None:
+            # There are no fit values to merge
+            self.fit(X, y)
+            self._new_labels = tuple()
+            return self
+        if not hasattr(self, "_combine_fit"):
+            raise NotImplementedError
+        return self._update_fit(self._map_fit(X))
+
+    def _update_fit(self, summaries):
+        """
+        Merge fit summaries into the current fit, if there is one.
+
+        Parameters
+        ----------
+        summaries : list
+            The fit summaries of the new values.
+
+        Returns
+        -------
+        self : object
+            Returns the instance itself.
+        """
+        try:
+            self.check_fit()
+        except ValueError:
+            old_labels = set()
+        else:
+            old_labels = set(self.get_labels())
+            summaries = [self._get_fit_summary()] + list(summaries)
+        self._combine_fit_summaries(summaries)
+        self._new_labels = tuple(x for x in self.get_labels()
+                                 if x not in old_labels)
+        return self
+
+    def _get_fit_summary(self):
+        """
+        Get the current fit in a form that can be merged with other fits.
+
+        By default, this has the same form as a result of _para_fit.
+
+        Returns
+        -------
+        value : object
+            The values of the fit attributes. If there is more than one
+            attribute, then this is a tuple of them.
+        """
+        values = tuple(getattr(self, x) for x in self.ATTRIBUTES)
+        if len(values) == 1:
+            return values[0]
+        return values
+
+    def _combine_fit_summaries(self, summaries):
+        """
+        Set the fit attributes from several fit summaries.
+
+        Parameters
+        ----------
+        summaries : list
+            The results of _get_fit_summary for a set of fits.
+
+        Returns
+        -------
+        self : object
+            Returns the instance itself.
+        """
+        return self._combine_fit(summaries)
+
+    def _fit_chunk(self, X):
+        """
+        Fit a chunk of the values and summarize the result.
+
+        This is run inside of the worker processes, so that only one summary
+        is sent back per chunk instead of one result per value. The fit is
+        done on a copy, so the current fit is not changed.
+
+        Parameters
+        ----------
+        X : list
+            The values to fit
+
+        Returns
+        -------
+        value : object
+            The summary of the fit of the chunk.
+        """
+        temp = copy.copy(self)
+        temp._combine_fit([temp._para_fit(x) for x in X])
+        return temp._get_fit_summary()
+
+    def _map_fit(self, X):
+        """
+        Fit the values with one chunk per process and summarize the fits.
+
+        Parameters
+        ----------
+        X : list, shape=(n_samples, )
+            A list of objects to use to fit.
+
+        Returns
+        -------
+        summaries : list
+            The fit summaries of each chunk.
+        """
+        X = list(X)
+        pool = self.get_pool()
+        if pool is None or len(X) < 2:
+            return [self._fit_chunk(X)]
+        size, extra = divmod(len(X), pool.n_jobs)
+        size += bool(extra)
+        chunks = [X[i:i + size] for i in range(0, len(X), size)]
+        return pool.map(self._fit_chunk, chunks, chunksize=1)
+
     def _para_transform(self, X):
         """
         A single instance of the transform procedure.
@@ -337,7 +816,116 @@ class BaseFeature(object):
         """
         raise NotImplementedError
 
-    def transform(self, X, y=None):
+    def _para_transform_batch(self, X):
+        """
+        Transform a chunk of values in a single process.
+
+        Parameters
+        ----------
+        X : list
+            The objects to use for the transform
+
+        Returns
+        -------
+        value : array, shape=(len(X), n_features)
+            The features extracted from the values
+        """
+        return numpy.array([self._para_transform(x) for x in X])
+
+    def _para_transform_rows(self, args):
+        """
+        Transform a chunk of values and write them into a memory map.
+
+        This is run in the worker processes, so that the features do not
+        have to be sent back to the main process.
+        """
+        filename, dtype, shape, offset, start, prefix, X = args
+        out = numpy.memmap(filename, dtype=dtype, mode='r+', shape=shape,
+                           offset=offset)
+        out[start:start + len(X)] = self._para_transform_chunk(prefix, X)
+        out.flush()
+
+    def _para_transform_chunk(self, prefix, X):
+        """
+        Transform a chunk of values using the cache if it has been set.
+
+        Parameters
+        ----------
+        prefix : str or None
+            The hash of the transformer (see get_transformer_hash), or None
+            if there is no cache.
+
+        X : list
+            The objects to use for the transform
+
+        Returns
+        -------
+        value : array, shape=(len(X), n_features)
+            The features extracted from the values
+        """
+        if prefix is None:
+            return self._para_transform_batch(X)
+        return numpy.array([self._para_transform_cached(prefix, x)
+                            for x in X])
+
+    def _transform_into(self, X, out):
+        """
+        Transform the values and write the features into out.
+
+        Parameters
+        ----------
+        X : list, shape=(n_samples, )
+            A list of objects to use to transform
+
+        out : str or array, shape=(n_samples, n_features)
+            A filename to create a memory map at, or an array to write to.
+
+        Returns
+        -------
+        out : array, shape=(n_samples, n_features)
+            The array with the transformed features
+        """
+        X = list(X)
+        self._get_layouts()
+        prefix = None
+        if self.get_cache() is not None:
+            self.check_fit()
+            prefix = get_transformer_hash(self)
+        start = 0
+        if isinstance(out, str) and not X:
+            # A memory map can not be empty, so just an empty file is made
+            open(out, 'wb').close()
+            return numpy.zeros((0, 0))
+        if isinstance(out, str):
+            # The width is not known until a value has been transformed
+            first = numpy.asarray(self._para_transform_chunk(prefix, X[:1]),
+                                  dtype=float)
+            out = numpy.memmap(out, dtype=float, mode='w+',
+                               shape=(len(X), ) + first.shape[1:])
+            out[:len(first)] = first
+            start = len(first)
+        if len(out) != len(X):
+            msg = "out has %d rows, but there are %d values to transform."
+            raise ValueError(msg % (len(out), len(X)))
+
+        pool = self.get_pool()
+        filename = getattr(out, "filename", None)
+        if pool is not None and filename is not None:
+            # Workers write directly into the shared memory map
+            out.flush()
+            size = min(pool.get_chunksize(len(X)), self.BATCH_SIZE)
+            tasks = [(filename, out.dtype, out.shape, out.offset, i, prefix,
+                      X[i:i + size]) for i in range(start, len(X), size)]
+            self.map(self._para_transform_rows, tasks, chunksize=1)
+        else:
+            for values in self.transform_iter(X[start:]):
+                out[start:start + len(values)] = values
+                start += len(values)
+        if filename is not None:
+            out.flush()
+        return out
+
+    def transform(self, X, y=None, out=None):
         """
         Framework for a potentially parallel transform.
 
@@ -346,14 +934,90 @@ class BaseFeature(object):
         X : list, shape=(n_samples, )
             A list of objects to use to transform
 
+        out : str or array, shape=(n_samples, n_features), default=None
+            If this is given, the features are written directly into it
+            instead of building a new array. This can be a preallocated array
+            (or numpy.memmap), or a filename to create a float64
+            numpy.memmap at. When a memory map is used with multiple
+            processes, the workers write their rows into it directly. This
+            only works for features with one vector per value. The feature
+            cache (see set_cache) is used in the same way as without `out`.
+            If X is empty and a filename is given, then an empty file is
+            written and an empty array is returned.
+
         Returns
         -------
         array : array, shape=(n_samples, n_features)
             The transformed features
         """
-        results = self.map(self._para_transform, X)
+        if out is not None:
+            return self._transform_into(X, out)
+        # Compile the layouts before they are sent to the workers
+        self._get_layouts()
+        if self.get_cache() is None:
+            results = self.map(self._para_transform, X)
+        else:
+            self.check_fit()
+            prefix = get_transformer_hash(self)
+            f = partial(self._para_transform_cached, prefix)
+            results = self.map(f, X)
         return numpy.array(results)
 
+    def transform_iter(self, X, batch_size=None):
+        """
+        Transform the values in chunks while streaming through them.
+
+        This accepts any iterable (such as a generator of filenames) and only
+        ever holds one chunk of values and their features in memory. The
+        chunks are transformed using the normal transform, so they are still
+        processed in parallel.
+
+        Parameters
+        ----------
+        X : iterable
+            The objects to use to transform
+
+        batch_size : int, default=None
+            The number of values in each chunk. If this is None, then
+            BATCH_SIZE is used.
+
+        Yields
+        ------
+        array : array, shape=(batch_size, n_features)
+            The transformed features of a chunk of values. For features with
+            one row per atom, the rows of all the molecules in the chunk are
+            stacked in order, so the shape is (n_atoms, n_features).
+        """
+        if batch_size is None:
+            batch_size = self.BATCH_SIZE
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive.")
+        X = iter(X)
+        while True:
+            batch = list(itertools.islice(X, batch_size))
+            if not batch:
+                return
+            yield self._stack_batch(self.transform(batch))
+
+    def _stack_batch(self, results):
+        """
+        Convert the transformed features of a chunk into a single array.
+
+        Parameters
+        ----------
+        results : array
+            The result of transform for the chunk
+
+        Returns
+        -------
+        array : array, shape=(n_rows, n_features)
+            The features as floats, with the rows of all the atoms stacked
+            for features with one row per atom.
+        """
+        if results.dtype == object or results.ndim > 2:
+            results = numpy.concatenate(list(results))
+        return numpy.asarray(results, dtype=float)
+
     def fit_transform(self, X, y=None):
         """
         A naive default implementation of fitting and transforming.
@@ -389,6 +1053,10 @@ class BaseFeature(object):
         full_name = self.__module__ + '.' + self.__class__.__name__
         params = {}
         for key, value in self.get_params().items():
+            if isinstance(value, (list, tuple)) and value and \
+                    all(hasattr(x, "to_json") for x in value):
+                params[key] = [x.to_json() for x in value]
+                continue
             try:
                 params[key] = value.to_json()
             except AttributeError:
@@ -399,8 +1067,24 @@ class BaseFeature(object):
                 "parameters": params,
                 "attributes": attributes,
         }
+        layouts = self._get_layouts()
+        if layouts:
+            data["layouts"] = {key: value.to_json()
+                               for key, value in layouts.items()}
         return data
 
+    def _load_attributes(self, attributes):
+        """
+        Set the fit attributes from the output of to_json.
+
+        Parameters
+        ----------
+        attributes : dict, str->object
+            The json values of the fit attributes.
+        """
+        for key, value in attributes.items():
+            setattr(self, key, value)
+
     def save_json(self, f):
         """
         Save the model data in a json file
@@ -440,19 +1124,151 @@ class SetMergeMixin(object):
         self : object
             Returns the instance itself.
         """
-        res = self.map(self._para_fit, X)
+        return self._combine_fit_summaries(self._map_fit(X))
+
+    def _combine_fit(self, res):
+        """
+        Set the fit attributes from the results of _para_fit.
+
+        Parameters
+        ----------
+        res : list
+            The results of _para_fit for all of the values.
+
+        Returns
+        -------
+        self : object
+            Returns the instance itself.
+        """
         if len(self.ATTRIBUTES) > 1:
-            temp = self.reduce(lambda x, y: tuple(set(xx) | set(yy)
-                                                  for xx, yy in zip(x, y)),
-                               res)
+            temp = reduce(lambda x, y: tuple(set(xx) | set(yy)
+                                             for xx, yy in zip(x, y)),
+                          res)
             for attr, vals in zip(self.ATTRIBUTES, temp):
                 setattr(self, attr, set(vals))
         else:
-            vals = self.reduce(lambda x, y: set(x) | set(y), res)
+            vals = reduce(lambda x, y: set(x) | set(y), res)
             setattr(self, self.ATTRIBUTES[0], set(vals))
         return self
 
 
+class SparseMixin(object):
+    """
+    A simple mixin to allow transforms to give scipy.sparse output.
+
+    For this to work, the subclasses need to have a `sparse` parameter, a
+    single `LABELS` attribute with the fit keys (and a layout for it), and a
+    `_para_transform_sparse` method that returns a csr_matrix.
+    """
+    def _get_columns(self):
+        """
+        Get the feature column of each fit key.
+
+        Returns
+        -------
+        columns : dict, key->int
+            The index of the column of each key in the sorted keys.
+        """
+        return self._get_layouts()[self.LABELS[0]].columns
+
+    def _stack_sparse(self, results):
+        """
+        Combine the sparse results of each value.
+
+        Parameters
+        ----------
+        results : list
+            The results of _para_transform_sparse for all of the values.
+
+        Returns
+        -------
+        matrix : scipy.sparse.csr_matrix, shape=(n_samples, n_features)
+            The transformed features
+        """
+        return scipy.sparse.vstack(results, format="csr")
+
+    def transform(self, X, y=None, out=None):
+        """
+        Framework for a potentially parallel transform.
+
+        Parameters
+        ----------
+        X : list, shape=(n_samples, )
+            A list of objects to use to transform
+
+        out : str or array, shape=(n_samples, n_features), default=None
+            If this is given, the features are written directly into it. This
+            can not be used with sparse output.
+
+        Returns
+        -------
+        array : array or csr_matrix, shape=(n_samples, n_features)
+            The transformed features
+
+        Raises
+        ------
+        ValueError
+            If `out` is given with sparse output.
+        """
+        if not self.sparse:
+            return super(SparseMixin, self).transform(X, y=y, out=out)
+        if out is not None:
+            raise ValueError("`out` can not be used with sparse output.")
+        self.check_fit()
+        # Compile the layouts before they are sent to the workers
+        self._get_layouts()
+        return self._stack_sparse(self.map(self._para_transform_sparse, X))
+
+    def _stack_batch(self, results):
+        if not self.sparse:
+            return super(SparseMixin, self)._stack_batch(results)
+        if isinstance(results, list):
+            results = scipy.sparse.vstack(results, format="csr")
+        return results.astype(float)
+
+
+class BatchMixin(object):
+    """
+    A simple mixin to transform the values in batches.
+
+    For this to work, the subclasses need to define `_para_transform_batch`
+    so that it transforms a whole list of values at once. The batches are at
+    most `BATCH_SIZE` values, and with a pool of processes they are split by
+    the chunk size of the pool so that every process gets some of them.
+    """
+    def transform(self, X, y=None, out=None):
+        """
+        Transform the values in batches.
+
+        Parameters
+        ----------
+        X : list, shape=(n_samples, )
+            A list of objects to use to transform
+
+        out : str or array, shape=(n_samples, n_features), default=None
+            If this is given, the features are written directly into it. See
+            BaseFeature.transform for details.
+
+        Returns
+        -------
+        array : array, shape=(n_samples, n_features)
+            The transformed features
+        """
+        if out is not None or self.get_cache() is not None:
+            return super(BatchMixin, self).transform(X, out=out)
+        X = list(X)
+        size = self.BATCH_SIZE
+        pool = self.get_pool()
+        if pool is not None:
+            # Make sure that all of the processes get some of the values
+            size = min(size, pool.get_chunksize(len(X)))
+        batches = [X[i:i + size] for i in range(0, len(X), size)]
+        results = self.map(self._para_transform_batch, batches, chunksize=1)
+        if not results:
+            return numpy.array(results)
+        return numpy.concatenate(results)
+
+
 class InputTypeMixin(object):
     """
     A simple mixin to to check input_types if there are multiples.
@@ -552,6 +1368,120 @@ class EncodedFeature(BaseFeature):
         self.end = end
         self.spacing = spacing
 
+    def _encode_grid(self, values):
+        '''
+        Evaluate the smoothing function for many values at the same time.
+
+        Parameters
+        ----------
+            values : array, shape=(n_values, )
+                The values to encode.
+
+        Returns
+        -------
+            grid : array, shape=(n_values, segments)
+                The smoothed encodings of each of the values.
+        '''
+        smoothing_func = get_smoothing_function(self.smoothing)
+        theta_func = get_spacing_function(self.spacing)
+        theta = numpy.linspace(theta_func(self.start), theta_func(self.end),
+                               self.segments)
+        diff = theta - theta_func(values)[:, None]
+        if self.smoothing == 'circ':
+            return smoothing_func(diff, self.slope)
+        return smoothing_func(self.slope * diff)
+
+    def _encode_blocks(self, idxs, values, scalings, vector):
+        '''
+        Scatter-add the encodings of values into the rows of vector.
+
+        The values are processed in blocks to bound the size of the
+        intermediate (n_values, segments) grid.
+        '''
+        step = max(ENCODE_BLOCK_SIZE // self.segments, 1)
+        for i in range(0, len(values), step):
+            grid = self._encode_grid(values[i:i + step])
+            grid *= scalings[i:i + step, None]
+            numpy.add.at(vector, tuple(x[i:i + step] for x in idxs), grid)
+
+    def encode_array(self, idxs, values, scalings, length):
+        '''
+        Encodes arrays of values into a single uniform length array.
+
+        This is the vectorized form of encode_values.
+
+        Parameters
+        ----------
+            idxs : array, shape=(n_values, )
+                The encoding bucket that each value goes in. A value of -1
+                places it in the last bucket.
+
+            values : array, shape=(n_values, )
+                The values to encode.
+
+            scalings : array, shape=(n_values, )
+                The factors that get multiplied by each encoded subvector
+                before getting added to the total.
+
+            length : int
+                The number of encoding subvectors to create. In terms of
+                EncodedBonds, this would be the number of element pairs.
+
+        Returns
+        -------
+            vector : array, shape=(length * segments, )
+                The final concatenated vector of all the subvectors.
+        '''
+        vector = numpy.zeros((length, self.segments))
+        self._encode_blocks((numpy.asarray(idxs, dtype=int), ),
+                            numpy.asarray(values, dtype=float),
+                            numpy.asarray(scalings, dtype=float),
+                            vector)
+        return vector.reshape(-1)
+
+    def encode_atom_array(self, atom_idxs, idxs, values, scalings, n_atoms,
+                          length):
+        '''
+        Encodes arrays of values into a uniform length array per atom.
+
+        This is the vectorized form of encode_atom_values.
+
+        Parameters
+        ----------
+            atom_idxs : array, shape=(n_values, )
+                The atom that each value belongs to.
+
+            idxs : array, shape=(n_values, )
+                The encoding bucket that each value goes in. A value of -1
+                places it in the last bucket.
+
+            values : array, shape=(n_values, )
+                The values to encode.
+
+            scalings : array, shape=(n_values, )
+                The factors that get multiplied by each encoded subvector
+                before getting added to the total.
+
+            n_atoms : int
+                The number of atoms to consider in the encoding.
+
+            length : int
+                The number of encoding subvectors to create. In terms of
+                EncodedBonds, this would be the number of element pairs.
+
+        Returns
+        -------
+            vector : array, shape=(n_atoms, length * segments)
+                The final concatenated vector of all the subvectors.
+        '''
+        vector = numpy.zeros((n_atoms, length, self.segments))
+        self._encode_blocks((numpy.asarray(atom_idxs, dtype=int),
+                             numpy.asarray(idxs, dtype=int)),
+                            numpy.asarray(values, dtype=float),
+                            numpy.asarray(scalings, dtype=float),
+                            vector)
+        return vector.reshape(n_atoms, -1)
+
     def encode_values(self, iterator, length):
         '''
         Encodes an iterable of values into a single uniform length list.
@@ -577,22 +1507,8 @@ class EncodedFeature(BaseFeature):
                 The final concatenated vector of all the subvectors. This will
                 have a length of length * segments.
         '''
-        smoothing_func = get_smoothing_function(self.smoothing)
-        theta_func = get_spacing_function(self.spacing)
-        vector = numpy.zeros((length, self.segments))
-        theta = numpy.linspace(theta_func(self.start), theta_func(self.end),
-                               self.segments)
-
-        for idx, value, scaling in iterator:
-            if idx is None:
-                continue
-            diff = theta - theta_func(value)
-            if self.smoothing == 'circ':
-                value = smoothing_func(diff, self.slope)
-            else:
-                value = smoothing_func(self.slope * diff)
-            vector[idx] += value * scaling
-        return vector.flatten().tolist()
+        idxs, values, scalings = _unpack_encode_items(iterator)
+        return self.encode_array(idxs, values, scalings, length).tolist()
 
     def encode_atom_values(self, iterator, n_atoms, length):
         '''
@@ -624,20 +1540,7 @@ class EncodedFeature(BaseFeature):
                 The final concatenated vector of all the subvectors. This will
                 have a shape of (n_atoms, length * segments).
         '''
-        smoothing_func = get_smoothing_function(self.smoothing)
-        theta_func = get_spacing_function(self.spacing)
-        vector = numpy.zeros((n_atoms, length, self.segments))
-        theta = numpy.linspace(theta_func(self.start), theta_func(self.end),
-                               self.segments)
-
-        for idx, value, scaling in iterator:
-            if idx is None:
-                continue
-            diff = theta - theta_func(value)
-            if self.smoothing == 'circ':
-                value = smoothing_func(diff, self.slope)
-            else:
-                value = smoothing_func(self.slope * diff)
-            i, j = idx
-            vector[i, j] += value * scaling
-        return vector.reshape(n_atoms, -1)
+        idxs, values, scalings = _unpack_encode_items(iterator)
+        idxs = idxs.reshape(-1, 2)
+        return self.encode_atom_array(idxs[:, 0], idxs[:, 1], values,
+                                      scalings, n_atoms, length)
@@ -0,0 +1,237 @@
+"""
+An on-disk cache for the features of single molecules.
+
+This allows repeated transforms of the same molecules (with the same
+transformer parameters and fit) to be loaded from disk instead of being
+recomputed.
+"""
+import hashlib
+import os
+import tempfile
+
+import numpy
+
+
+__all__ = ("FeatureCache", )
+
+
+def _canonical(value):
+    """
+    Convert a value into a form with a deterministic repr.
+
+    Sets and dictionaries do not have a stable ordering between processes, so
+    they are converted to sorted lists.
+    """
+    if isinstance(value, dict):
+        items = [(_canonical(k), _canonical(v)) for k, v in value.items()]
+        return ['dict'] + sorted(items, key=repr)
+    if isinstance(value, (set, frozenset)):
+        return ['set'] + sorted((_canonical(x) for x in value), key=repr)
+    if isinstance(value, (list, tuple)):
+        return [_canonical(x) for x in value]
+    if isinstance(value, numpy.ndarray):
+        return _canonical(value.tolist())
+    if hasattr(value, "to_json"):
+        return _canonical(value.to_json())
+    return value
+
+
+def get_transformer_hash(transformer):
+    """
+    Get a hash of the parameters and fit values of a transformer.
+
+    Parameters
+    ----------
+    transformer : BaseFeature
+        The transformer to hash
+
+    Returns
+    -------
+    value : str
+        The hex digest of the hash
+    """
+    data = transformer.to_json()
+    value = repr(_canonical([transformer.slugify(), data["attributes"]]))
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+def get_molecule_hash(data):
+    """
+    Get a hash of the values that define a molecule.
+
+    This includes the elements, the coordinates, and, if they were given, the
+    connections and unit cell.
+
+    Parameters
+    ----------
+    data : LazyValues
+        The molecule to hash
+
+    Returns
+    -------
+    value : str
+        The hex digest of the hash
+    """
+    h = hashlib.sha1()
+    try:
+        elements = data.elements
+    except ValueError:
+        elements = []
+    h.update(repr([str(x) for x in elements]).encode("utf-8"))
+    try:
+        coords = data.coords
+    except ValueError:
+        coords = []
+    h.update(numpy.ascontiguousarray(coords, dtype=float).tobytes())
+    if data._connections is not None:
+        h.update(repr(_canonical(data._connections)).encode("utf-8"))
+    if data._unit_cell is not None:
+        unit_cell = numpy.ascontiguousarray(data._unit_cell, dtype=float)
+        h.update(unit_cell.tobytes())
+    return h.hexdigest()
+
+
+class FeatureCache(object):
+    """
+    A directory of cached feature arrays with a size bound.
+
+    Each value is stored as its own .npy file named by its key. When the
+    total size of the files goes over `max_size`, the least recently used
+    values are deleted. Files are written atomically, so the same directory
+    can be used by many processes at once.
+
+    Parameters
+    ----------
+    path : str
+        The directory to store the values in. It is created if it does not
+        exist.
+
+    max_size : int, default=None
+        The maximum number of bytes to store. If this is None, then the size
+        is not bounded.
+    """
+    def __init__(self, path, max_size=None):
+        self.path = path
+        self.max_size = max_size
+        # An estimate of the total size, so the directory is not scanned for
+        # every new value
+        self._size = None
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _get_path(self, key):
+        return os.path.join(self.path, key[:2], key + ".npy")
+
+    def _get_files(self):
+        files = []
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                if not name.endswith(".npy"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def get_size(self):
+        """
+        Get the total number of bytes stored.
+
+        Returns
+        -------
+        size : int
+            The size of all the stored values.
+        """
+        return sum(x[1] for x in self._get_files())
+
+    def get(self, key):
+        """
+        Load a value from the cache.
+
+        Parameters
+        ----------
+        key : str
+            The key of the value
+
+        Returns
+        -------
+        value : array or None
+            The stored value, or None if it is not in the cache.
+        """
+        path = self._get_path(key)
+        try:
+            value = numpy.load(path)
+            # Mark the value as recently used
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return value
+
+    def set(self, key, value):
+        """
+        Store a value in the cache.
+
+        Parameters
+        ----------
+        key : str
+            The key of the value
+
+        value : array-like
+            The value to store
+        """
+        path = self._get_path(key)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # It was made by another process
+                pass
+        fd, temp = tempfile.mkstemp(suffix=".tmp", dir=folder)
+        with os.fdopen(fd, "wb") as f:
+            numpy.save(f, numpy.asarray(value))
+        # The size of the value that is being replaced
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        os.rename(temp, path)
+
+        if self.max_size is None:
+            return
+        if self._size is None:
+            self._size = self.get_size()
+        else:
+            self._size += os.path.getsize(path) - old_size
+        if self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used values until the size is bounded.
+        """
+        files = sorted(self._get_files())
+        size = sum(x[1] for x in files)
+        for _, file_size, path in files:
+            if self.max_size is None or size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= file_size
+        self._size = size
+
+    def clear(self):
+        """
+        Delete all the values in the cache.
+        """
+        for _, _, path in self._get_files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._size = 0
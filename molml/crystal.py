@@ -5,6 +5,8 @@ This module contains a variety of methods to extract features from molecules
 based on the entire molecule. All of the methods included here will produce
 one vector per molecule input.
 """
+import copy
+
 import numpy
 import scipy
 
@@ -70,18 +72,38 @@ class GenerallizedCrystal(InputTypeMixin, BaseFeature):
         self.transformer.convert_input = self.convert_input
 
     def convert_input(self, X):
-        temp = self._old_convert_input(X)
+        # The input may be a shared LazyValues object, so it is not modified
+        temp = copy.copy(self._old_convert_input(X))
         temp.fill_in_crystal(radius=self.radius, units=self.units)
         return temp
 
     def fit(self, X, y=None):
         return self.transformer.fit(X)
 
+    def partial_fit(self, X, y=None):
+        self.transformer.partial_fit(X)
+        self._new_labels = self.transformer._new_labels
+        return self
+
     def fit_transform(self, X, y=None):
         return self.transformer.fit_transform(X)
 
-    def transform(self, X, y=None):
-        return self.transformer.transform(X)
+    def transform(self, X, y=None, out=None):
+        return self.transformer.transform(X, out=out)
+
+    def check_fit(self):
+        self.transformer.check_fit()
+
+    def get_labels(self):
+        return self.transformer.get_labels()
+
+    def _get_layouts(self):
+        self.transformer._get_layouts()
+        return {}
+
+    def _para_transform(self, X):
+        # This is used when the crystal is part of a FeatureUnion
+        return self.transformer._para_transform(X)
 
 
 class EwaldSumMatrix(CoulombMatrix):
@@ -133,7 +155,13 @@ class EwaldSumMatrix(CoulombMatrix):
     eigen : bool, default=False
         Specifies whether or not to use the eigen spectrum of the coulomb
         matrix rather than the matrix itself. This changes the scaling to be
-        linear in the number of atoms.
+        linear in the number of atoms. The eigenvalues are ordered by
+        decreasing absolute value.
+
+    n_eigen : int, default=None
+        If eigen is True, this specifies the number of eigenvalues with the
+        largest absolute value to keep. If this is None, then all of them are
+        kept.
 
     Attributes
     ----------
@@ -151,7 +179,7 @@ class EwaldSumMatrix(CoulombMatrix):
     LABELS = None
 
     def __init__(self, input_type='list', n_jobs=1, L_max=10, G_max=10,
-                 sort=False, eigen=False):
+                 sort=False, eigen=False, n_eigen=None):
         super(EwaldSumMatrix, self).__init__(input_type=input_type,
                                              n_jobs=n_jobs)
         self._max_size = None
@@ -159,35 +187,30 @@ class EwaldSumMatrix(CoulombMatrix):
         self.G_max = G_max
         self.sort = sort
         self.eigen = eigen
+        self.n_eigen = n_eigen
 
-    def _para_transform(self, X):
-        """
-        A single instance of the transform procedure.
+    def _get_matrices(self, datas):
+        return self._stack_matrices([self._get_matrix(x) for x in datas])
 
-        This is formulated in a way that the transformations can be done
-        completely parallel with map.
+    def _get_matrix(self, data):
+        """
+        Compute the matrix for a single molecule.
 
         Parameters
         ----------
-        X : object
-            An object to use for the transform
+        data : LazyValues
+            The converted molecule
 
         Returns
         -------
-        value : array
-            The features extracted from the molecule
+        value : array, shape=(n_atoms, n_atoms)
+            The matrix for the molecule
 
         Raises
         ------
-        ValueError
-            If the transformer has not been fit.
-
         ValueError
             If the size of the transforming molecules are larger than the fit.
         """
-        self.check_fit()
-
-        data = self.convert_input(X)
         if len(data.numbers) > self._max_size:
             msg = "The fit molecules (%d) were not as large as the ones that"
             msg += " are being transformed (%d)."
@@ -238,19 +261,7 @@ class EwaldSumMatrix(CoulombMatrix):
         xii = alpha / numpy.sqrt(numpy.pi) + factor
         xii *= -num2
         numpy.fill_diagonal(values, xii)
-
-        if self.sort:
-            order = numpy.argsort(values.sum(0))[::-1]
-            values = values[order, :][:, order]
-
-        if self.eigen:
-            values = numpy.linalg.eig(values)[0]
-
-        padding_difference = self._max_size - len(data.numbers)
-        values = numpy.pad(values,
-                           (0, padding_difference),
-                           mode="constant")
-        return values.reshape(-1)
+        return values
 
 
 class SineMatrix(CoulombMatrix):
@@ -295,7 +306,13 @@ class SineMatrix(CoulombMatrix):
     eigen : bool, default=False
         Specifies whether or not to use the eigen spectrum of the coulomb
         matrix rather than the matrix itself. This changes the scaling to be
-        linear in the number of atoms.
+        linear in the number of atoms. The eigenvalues are ordered by
+        decreasing absolute value.
+
+    n_eigen : int, default=None
+        If eigen is True, this specifies the number of eigenvalues with the
+        largest absolute value to keep. If this is None, then all of them are
+        kept.
 
     Attributes
     ----------
@@ -312,48 +329,42 @@ class SineMatrix(CoulombMatrix):
     ATTRIBUTES = ("_max_size", )
     LABELS = None
 
-    def __init__(self, input_type='list', n_jobs=1, sort=False, eigen=False):
+    def __init__(self, input_type='list', n_jobs=1, sort=False, eigen=False,
+                 n_eigen=None):
         super(SineMatrix, self).__init__(input_type=input_type,
                                          n_jobs=n_jobs)
         self._max_size = None
         self.sort = sort
         self.eigen = eigen
+        self.n_eigen = n_eigen
 
-    def _para_transform(self, X):
-        """
-        A single instance of the transform procedure.
+    def _get_matrices(self, datas):
+        return self._stack_matrices([self._get_matrix(x) for x in datas])
 
-        This is formulated in a way that the transformations can be done
-        completely parallel with map.
+    def _get_matrix(self, data):
+        """
+        Compute the matrix for a single molecule.
 
         Parameters
         ----------
-        X : object
-            An object to use for the transform
+        data : LazyValues
+            The converted molecule
 
         Returns
         -------
-        value : array
-            The features extracted from the molecule
+        value : array, shape=(n_atoms, n_atoms)
+            The matrix for the molecule
 
         Raises
         ------
-        ValueError
-            If the transformer has not been fit.
-
         ValueError
             If the size of the transforming molecules are larger than the fit.
         """
-        self.check_fit()
-
-        data = self.convert_input(X)
         if len(data.numbers) > self._max_size:
             msg = "The fit molecules (%d) were not as large as the ones that"
             msg += " are being transformed (%d)."
             raise ValueError(msg % (self._max_size, len(data.numbers)))
 
-        padding_difference = self._max_size - len(data.numbers)
-
         # Standard parts
         ZZ = numpy.outer(data.numbers, data.numbers).astype(float)
         rr = data.coords[:, None] - data.coords
@@ -374,16 +385,4 @@ class SineMatrix(CoulombMatrix):
         ZZ *= phi
         diag = 0.5 * data.numbers ** 2.4
         numpy.fill_diagonal(ZZ, diag)
-        values = ZZ
-
-        if self.sort:
-            order = numpy.argsort(values.sum(0))[::-1]
-            values = values[order, :][:, order]
-
-        if self.eigen:
-            values = numpy.linalg.eig(values)[0]
-
-        values = numpy.pad(values,
-                           (0, padding_difference),
-                           mode="constant")
-        return values.reshape(-1)
+        return ZZ
@@ -2,3 +2,4 @@ from .atom import *  # NOQA
 from .molecule import *  # NOQA
 from .crystal import *  # NOQA
 from .kernel import *  # NOQA
+from .union import *  # NOQA
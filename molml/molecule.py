@@ -7,24 +7,30 @@ one vector per molecule input.
 """
 from builtins import range
 from collections import defaultdict
+from functools import reduce
 from itertools import product
 
 import numpy
-from scipy.spatial.distance import cdist
+import scipy.sparse
 
-from .base import BaseFeature, SetMergeMixin, EncodedFeature
-from .utils import get_depth_threshold_mask_connections, get_coulomb_matrix
-from .utils import get_element_pairs, cosine_decay, needs_reversal
-from .utils import get_index_mapping, get_angles
-from .utils import get_graph_distance, ELE_TO_NUM
-from .constants import ELECTRONEGATIVITY, BOND_LENGTHS
+from .base import BaseFeature, SetMergeMixin, SparseMixin, EncodedFeature
+from .base import BatchMixin
+from .utils import get_coulomb_matrix, get_coulomb_matrices
+from .utils import get_element_pairs, cosine_decay
+from .utils import get_chains, get_reversal_mask
+from .utils import FeatureLayout, _to_tuple
+from .utils import ELECTRONEGATIVITY_TABLE, BOND_LENGTH_TABLE
+from .constants import TYPE_ORDER
 
 
 __all__ = ("Connectivity", "Autocorrelation", "EncodedAngle", "EncodedBond",
            "CoulombMatrix", "BagOfBonds")
 
+# The column of the single bond lengths in BOND_LENGTH_TABLE
+SINGLE_BOND = TYPE_ORDER.index('1')
 
-class Connectivity(SetMergeMixin, BaseFeature):
+
+class Connectivity(SetMergeMixin, SparseMixin, BaseFeature):
     """
     A collection of feature types based on the connectivity of atoms.
 
@@ -54,11 +60,29 @@ class Connectivity(SetMergeMixin, BaseFeature):
         Specifies whether or not to include an extra UNKNOWN count in the
         feature vector.
 
+    do_tfidf : boolean, default=False
+        Specifies whether or not to scale the counts by the inverse document
+        frequency of each chain in the fit molecules.
+
+    sparse : boolean, default=False
+        Specifies whether or not to return a scipy.sparse.csr_matrix from
+        transform instead of a dense array.
+
     Attributes
     ----------
     _base_chains : set, tuples
         All the chains that are in the fit molecules.
 
+    _idf_values : dict, tuple->float
+        The inverse document frequency of each chain (only if `do_tfidf`).
+
+    _idf_counts : dict, tuple->float
+        The number of fit molecules that have each chain (only if
+        `do_tfidf`). This is used to update the fit in `partial_fit`.
+
+    _n_documents : int
+        The number of fit molecules (only if `do_tfidf`).
+
     References
     ----------
     Collins, C.; Gordon, G.; von Lilienfeld, O. A.; Yaron, D. Constant Size
@@ -69,7 +93,7 @@ class Connectivity(SetMergeMixin, BaseFeature):
 
     def __init__(self, input_type='list', n_jobs=1, depth=1,
                  use_bond_order=False, use_coordination=False,
-                 add_unknown=False, do_tfidf=False):
+                 add_unknown=False, do_tfidf=False, sparse=False):
         super(Connectivity, self).__init__(input_type=input_type,
                                            n_jobs=n_jobs)
         self.depth = depth
@@ -77,139 +101,107 @@ class Connectivity(SetMergeMixin, BaseFeature):
         self.use_coordination = use_coordination
         self.add_unknown = add_unknown
         self.do_tfidf = do_tfidf
+        self.sparse = sparse
         self._base_chains = None
+        self._idf_counts = None
+        self._n_documents = None
 
         if self.do_tfidf:
             self._idf_values = None
         else:
             self._idf_values = {}
 
-    def _loop_depth(self, connections):
-        """
-        Loop over the depth number expanding chains.
-
-        Parameters
-        ----------
-        connections : dict, key->list of keys
-            A dictonary edge table with all the bidirectional connections
-
-        Returns
-        -------
-        chains : list
-            A list of key tuples of all the chains in the molecule
-        """
-        chains = [(x, ) for x in connections]
-        for i in range(self.depth - 1):
-            chains = self._expand_chains(chains, connections)
-        return chains
-
-    def _expand_chains(self, initial, connections):
-        """
-        Use the connectivity information to add one more atom to each chain.
-
-        Parameters
-        ----------
-        initial : list
-            A list of key tuples of all the chains in the molecule
-
-        connections : dict, key->list of keys
-            A dictonary edge table with all the bidirectional connections
-
-        Returns
-        -------
-        results : list
-            A list of index chains that are one index longer than the inputs
-            in initial.
-        """
-        if len(initial) and len(initial[0]) > 1:
-            # All of the chains are duplicated and reversed.
-            # This is to make the loop simpler when handling both ends of the
-            # chain.
-            initial = initial + [x[::-1] for x in initial]
-
-        results = {}
-        for item in initial:
-            # We use the first item because the indexing is easier?
-            for x in connections[item[0]]:
-                if x in item:
-                    continue
-                new = (x, ) + item
-                if new[0] > new[-1]:
-                    new = new[::-1]
-                if new not in results:
-                    results[new] = 1
-        return list(results.keys())
-
-    def _convert_to_bond_order(self, chain, labelled, connections):
-        """
-        Convert a chain based on elements into one that includes bond order.
-
-        Parameters
-        ----------
-        chain : tuple
-            The atom index values in the chain
-
-        labelled : tuple
-            Elements corresponding to the chain indices
-
-        connections : dict, key->list of keys
-            A dictonary edge table with all the bidirectional connections
-
-        Returns
-        -------
-        labelled : list
-            The new labelled chain if use_bond_order is set
-        """
-        if self.use_bond_order and len(labelled) > 1:
-            temp = []
-            for i, x in enumerate(chain[:-1]):
-                idx1 = x
-                idx2 = chain[i + 1]
-                symbol1 = labelled[i]
-                symbol2 = labelled[i + 1]
-                temp.append((symbol1, symbol2, connections[idx1][idx2]))
-            labelled = temp
-        return labelled
-
-    def _tally_chains(self, chains, nodes, connections=None):
+    def _tally_chains(self, data):
         """
         Tally chain types and return a dictonary with counts of the types.
 
+        The chains are found as integer arrays, labelled with integer codes
+        for the atom (and bond) types, and then counted with `numpy.unique`.
+
         Parameters
         ----------
-        chains : list
-            All of the chains in the molecule
-
-        nodes : list
-            All of the element labels of the atoms
-
-        connections : dict, key->list of keys
-            A dictonary edge table with all the bidirectional connections
+        data : LazyValues
+            The molecule to tally the chains of
 
         Returns
         -------
         results : dict, labelled_chain->int
             Totals of the number of each type of chain
         """
+        graph = data.bond_graph
+        chains, bonds = get_chains(graph, self.depth, return_bonds=True)
+        n = chains.shape[1]
+
+        labels = [str(x) for x in data.elements]
+        if self.use_coordination:
+            degrees = numpy.diff(graph.indptr)
+            labels = [x + str(y) for x, y in zip(labels, degrees)]
+        # The codes are in sorted order so they can be compared like labels
+        names, codes = numpy.unique(labels, return_inverse=True)
+        names = [str(x) for x in names]
+
+        values = codes.reshape(-1)[chains]
+        reverse = get_reversal_mask(values)
+        values[reverse] = values[reverse, ::-1]
+        sizes = [len(names)] * n
+        use_bond_order = self.use_bond_order and n > 1
+        if use_bond_order:
+            bonds = bonds.astype(values.dtype) - 1
+            bonds[reverse] = bonds[reverse, ::-1]
+            values = numpy.hstack([values, bonds])
+            bond_labels = data.bond_labels
+            sizes += [len(bond_labels)] * (n - 1)
+
         results = {}
-        for chain in chains:
-            labelled = tuple(nodes[x] for x in chain)
-            if self.use_coordination:
-                extra = tuple(str(len(connections[x])) for x in chain)
-                labelled = tuple(x + y for x, y in zip(labelled, extra))
-
-            if needs_reversal(labelled):
-                labelled = labelled[::-1]
-                chain = chain[::-1]
-            labelled = self._convert_to_bond_order(chain, labelled,
-                                                   connections)
-
-            labelled = tuple(labelled)
-            if labelled not in results:
-                results[labelled] = 0
-            results[labelled] += 1
+        if not values.shape[0]:
+            return results
+        if numpy.prod(sizes, dtype=float) < 2 ** 62:
+            # Pack each chain into a single integer
+            scales = numpy.cumprod([1] + sizes[:-1])
+            keys = values.dot(scales)
+            _, idxs, counts = numpy.unique(keys, return_index=True,
+                                           return_counts=True)
+            unique = values[idxs]
+        else:
+            unique, counts = numpy.unique(values, axis=0, return_counts=True)
+
+        for row, count in zip(unique.tolist(), counts.tolist()):
+            labelled = tuple(names[x] for x in row[:n])
+            if use_bond_order:
+                labelled = tuple((labelled[i], labelled[i + 1],
+                                  bond_labels[row[n + i]])
+                                 for i in range(n - 1))
+            results[labelled] = count
         return results
 
+    def _compile_layouts(self):
+        return {"_base_chains": FeatureLayout(self._base_chains)}
+
+    def to_json(self):
+        data = super(Connectivity, self).to_json()
+        attributes = data["attributes"]
+        # The document counts are not needed to transform, but they are
+        # needed to update the fit with partial_fit
+        if self.do_tfidf:
+            attributes["_idf_counts"] = self._idf_counts
+            attributes["_n_documents"] = self._n_documents
+        # Sets and dicts with tuple keys are not json compatible, so they are
+        # stored as sorted lists
+        if self._base_chains is not None:
+            attributes["_base_chains"] = sorted(self._base_chains)
+        for key in ("_idf_values", "_idf_counts"):
+            value = attributes.get(key)
+            if value is not None:
+                attributes[key] = sorted(value.items())
+        return data
+
+    def _load_attributes(self, attributes):
+        super(Connectivity, self)._load_attributes(attributes)
+        for key in ("_idf_values", "_idf_counts"):
+            value = getattr(self, key)
+            if isinstance(value, list):
+                setattr(self, key, {_to_tuple(k): v for k, v in value})
+
     def _para_fit(self, X):
         """
         A single instance of the fit procedure.
@@ -228,26 +220,53 @@ class Connectivity(SetMergeMixin, BaseFeature):
             All the chains in the molecule
         """
         data = self.convert_input(X)
-        chains = self._loop_depth(data.connections)
-        all_counts = self._tally_chains(chains, data.elements,
-                                        data.connections)
-        return list(all_counts.keys())
+        return list(self._tally_chains(data).keys())
 
-    def _idf(self, all_keys):
+    def _count_documents(self, all_keys):
         res = defaultdict(float)
         for mol in all_keys:
             for key in mol:
                 res[key] += 1
-        N = len(all_keys)
-        return {key: numpy.log(N / x) for key, x in res.items()}
+        return res
+
+    def _idf(self, counts, N):
+        return {key: numpy.log(N / x) for key, x in counts.items()}
 
     def fit(self, X, y=None):
-        res = self.map(self._para_fit, X)
-        vals = self.reduce(lambda x, y: set(x) | set(y), res)
+        return self._combine_fit_summaries(self._map_fit(X))
+
+    def _combine_fit(self, res):
+        vals = reduce(lambda x, y: set(x) | set(y), res)
         self._base_chains = set(vals)
 
         if self.do_tfidf:
-            self._idf_values = self._idf(res)
+            self._idf_counts = self._count_documents(res)
+            self._n_documents = len(res)
+            self._idf_values = self._idf(self._idf_counts, self._n_documents)
+        return self
+
+    def _get_fit_summary(self):
+        if self.do_tfidf and self._idf_counts is None:
+            msg = ("The document counts of this fit are not known. Call "
+                   "'fit' first.")
+            raise ValueError(msg)
+        # The chains are lists after loading with load_json
+        chains = set(_to_tuple(x) for x in self._base_chains)
+        return chains, self._idf_counts, self._n_documents
+
+    def _combine_fit_summaries(self, summaries):
+        self._base_chains = set()
+        for chains, _, _ in summaries:
+            self._base_chains |= chains
+
+        if self.do_tfidf:
+            self._idf_counts = defaultdict(float)
+            self._n_documents = 0
+            for _, counts, n_documents in summaries:
+                for key, value in counts.items():
+                    self._idf_counts[key] += value
+                self._n_documents += n_documents
+            self._idf_values = self._idf(self._idf_counts, self._n_documents)
         return self
 
     def _para_transform(self, X, y=None):
@@ -274,27 +293,85 @@ class Connectivity(SetMergeMixin, BaseFeature):
         """
         self.check_fit()
 
-        data = self.convert_input(X)
-        chains = self._loop_depth(data.connections)
-        tallies = self._tally_chains(chains, data.elements, data.connections)
+        columns, values, n_features = self._get_tally_columns(X)
+        vector = [0.0 if self.do_tfidf else 0] * n_features
+        for column, value in zip(columns, values):
+            vector[column] = value
+        return vector
 
-        vector = []
-        for x in sorted(self._base_chains):
-            value = tallies.get(x, 0)
+    def _para_transform_sparse(self, X):
+        """
+        A single instance of the transform procedure with sparse output.
+
+        Parameters
+        ----------
+        X : object
+            An object to use for the transform
+
+        Returns
+        -------
+        value : scipy.sparse.csr_matrix, shape=(1, n_features)
+            The features extracted from the molecule
+
+        Raises
+        ------
+        ValueError
+            If the transformer has not been fit.
+        """
+        self.check_fit()
+
+        columns, values, n_features = self._get_tally_columns(X)
+        rows = numpy.zeros(len(columns), dtype=int)
+        return scipy.sparse.csr_matrix((values, (rows, columns)),
+                                       shape=(1, n_features))
+
+    def _get_tally_columns(self, X):
+        """
+        Get the nonzero features of a molecule.
+
+        Parameters
+        ----------
+        X : object
+            An object to use for the transform
+
+        Returns
+        -------
+        columns : list
+            The feature column of each value
+
+        values : list
+            The nonzero feature values
+
+        n_features : int
+            The total number of features
+        """
+        data = self.convert_input(X)
+        tallies = self._tally_chains(data)
+        chain_columns = self._get_columns()
+
+        columns = []
+        values = []
+        unknown = 0
+        for key, value in tallies.items():
+            column = chain_columns.get(key)
+            if column is None:
+                unknown += value
+                continue
             if self.do_tfidf:
-                value *= self._idf_values[x]
-            vector.append(value)
+                value *= self._idf_values[key]
+            columns.append(column)
+            values.append(value)
 
+        n_features = len(chain_columns)
         if self.add_unknown:
-            unknown = 0
-            for key, value in tallies.items():
-                if key not in self._base_chains:
-                    unknown += value
-            vector.append(unknown)
-        return vector
+            if unknown:
+                columns.append(n_features)
+                values.append(unknown)
+            n_features += 1
+        return columns, values, n_features
 
 
-class Autocorrelation(BaseFeature):
+class Autocorrelation(BatchMixin, BaseFeature):
     """
     A molecular descriptor based on Autocorrelation functions for properties.
 
@@ -348,11 +425,12 @@ class Autocorrelation(BaseFeature):
                                               n_jobs=n_jobs)
         self.functions = {
             'Z': lambda data: data.numbers,
-            'EN': lambda data: [ELECTRONEGATIVITY[x] for x in data.elements],
-            'CN': lambda data: [len(value) for key, value in
-                                data.connections.items()],
-            'I': lambda data: [1 for x in data.numbers],
-            'R': lambda data: [BOND_LENGTHS[x]['1'] for x in data.elements],
+            'EN': lambda data: ELECTRONEGATIVITY_TABLE[
+                numpy.asarray(data.numbers, dtype=int)],
+            'CN': lambda data: numpy.diff(data.bond_graph.indptr),
+            'I': lambda data: numpy.ones(len(data.numbers)),
+            'R': lambda data: BOND_LENGTH_TABLE[
+                numpy.asarray(data.numbers, dtype=int), SINGLE_BOND],
         }
         if depths is None:
             depths = list(range(4))
@@ -367,23 +445,106 @@ class Autocorrelation(BaseFeature):
         """No fitting is required because it is defined by the parameters."""
         return self
 
-    def _para_transform(self, X):
-        self.check_fit()
+    def _get_property_matrix(self, data):
+        """
+        Compute all the properties of the atoms in a molecule.
 
-        data = self.convert_input(X)
-        D = get_graph_distance(data.connections)
+        Parameters
+        ----------
+        data : LazyValues
+            The molecule
 
-        res = []
-        for prop in self.properties:
+        Returns
+        -------
+        values : array, shape=(n_atoms, len(self.properties))
+            The value of each property for each atom
+        """
+        values = numpy.zeros((len(data.elements), len(self.properties)))
+        for i, prop in enumerate(self.properties):
             if callable(prop):
-                p = prop(data)
+                values[:, i] = prop(data)
             else:
-                p = self.functions[prop](data)
+                values[:, i] = self.functions[prop](data)
+        return values
 
-            P = numpy.outer(p, p)
-            for d in self.depths:
-                res.append(((D == d) * P).sum())
-        return res
+    def _para_transform_batch(self, X):
+        """
+        A single instance of the batched transform procedure.
+
+        The graph distance of every pair of atoms is converted to the index
+        of its depth, and then the products of the properties of all the
+        pairs in the batch are summed with a single `numpy.bincount`.
+
+        Parameters
+        ----------
+        X : list
+            The objects to use for the transform
+
+        Returns
+        -------
+        value : array, shape=(len(X), n_features)
+            The features extracted from the molecules
+
+        Raises
+        ------
+        ValueError
+            If the transformer has not been fit.
+        """
+        self.check_fit()
+
+        depths, order = numpy.unique(numpy.asarray(self.depths, dtype=float),
+                                     return_inverse=True)
+        n_props = len(self.properties)
+        n_depths = len(depths)
+        size = len(X) * n_depths * n_props
+        if not size:
+            return numpy.zeros((len(X), len(self._labels)))
+
+        bins = []
+        weights = []
+        for i, x in enumerate(X):
+            data = self.convert_input(x)
+            P = self._get_property_matrix(data)
+            D = data.graph_distance
+
+            classes = numpy.searchsorted(depths, D)
+            classes = numpy.minimum(classes, n_depths - 1)
+            a, b = numpy.nonzero(depths[classes] == D)
+            bins.append((i * n_depths + classes[a, b]) * n_props)
+            weights.append(P[a] * P[b])
+
+        bins = numpy.concatenate(bins)[:, None] + numpy.arange(n_props)
+        weights = numpy.concatenate(weights)
+        values = numpy.bincount(bins.ravel(), weights=weights.ravel(),
+                                minlength=size)
+        values = values.reshape(len(X), n_depths, n_props)
+        # Put the values back in the order of (properties, depths)
+        values = values[:, order.ravel()].transpose(0, 2, 1)
+        return values.reshape(len(X), -1)
+
+    def _para_transform(self, X):
+        """
+        A single instance of the transform procedure.
+
+        This is formulated in a way that the transformations can be done
+        completely parallel with map.
+
+        Parameters
+        ----------
+        X : object
+            An object to use for the transform
+
+        Returns
+        -------
+        value : array
+            The features extracted from the molecule
+
+        Raises
+        ------
+        ValueError
+            If the transformer has not been fit.
+        """
+        return self._para_transform_batch([X])[0]
 
 
 class EncodedAngle(SetMergeMixin, EncodedFeature):
@@ -465,6 +626,11 @@ class EncodedAngle(SetMergeMixin, EncodedFeature):
         self.r_cut = r_cut
         self.add_unknown = add_unknown
 
+    def _compile_layouts(self):
+        layout = FeatureLayout(self._groups, form=self.form,
+                               add_unknown=self.add_unknown)
+        return {"_groups": layout}
+
     def _para_fit(self, X):
         """
         A single instance of the fit procedure.
@@ -502,33 +668,28 @@ class EncodedAngle(SetMergeMixin, EncodedFeature):
     def f_c(self, R):
         return cosine_decay(R, r_cut=self.r_cut)
 
-    def _iterator(self, data, get_index, both):
-        mat = get_depth_threshold_mask_connections(data.connections,
-                                                   min_depth=self.min_depth,
-                                                   max_depth=self.max_depth)
-        distances = cdist(data.coords, data.coords)
-        f_c = self.f_c(distances)
-        angles = get_angles(data.coords)
-        for i, ele1 in enumerate(data.elements):
-            for j, ele2 in enumerate(data.elements):
-                if i == j or not mat[i, j]:
-                    continue
-                if not f_c[i, j]:
-                    continue
-                for k, ele3 in enumerate(data.elements):
-                    if j == k or not mat[j, k]:
-                        continue
-                    if i > k and not both:
-                        continue
-                    if not f_c[i, k] or not f_c[j, k]:
-                        continue
-                    F = f_c[i, j] * f_c[j, k] * f_c[i, k]
-                    eles = ele1, ele2, ele3
-                    try:
-                        idx = get_index(eles)
-                    except KeyError:
-                        idx = None
-                    yield idx, angles[i, j, k], F
+    def _iterator(self, data, layout):
+        mat = data.get_depth_mask(min_depth=self.min_depth,
+                                  max_depth=self.max_depth)
+        distances = data.distances
+        i, j, k = data.get_cutoff_triplets(self.r_cut)
+        angles = data.get_triplet_angles(self.r_cut)
+        f_c_ij = self.f_c(distances[i, j])
+        f_c_jk = self.f_c(distances[j, k])
+        f_c_ik = self.f_c(distances[i, k])
+        keep = (f_c_ij != 0) & (f_c_jk != 0) & (f_c_ik != 0)
+        keep &= mat[i, j] & mat[j, k]
+        if not layout.both:
+            keep &= i <= k
+
+        codes = layout.encode(data)
+        table, valid = layout.get_code_table(3)
+        keep &= valid[codes[i], codes[j], codes[k]]
+
+        i, j, k = i[keep], j[keep], k[keep]
+        F = f_c_ij[keep] * f_c_jk[keep] * f_c_ik[keep]
+        idxs = table[codes[i], codes[j], codes[k]]
+        return idxs, angles[keep], F
 
     def _para_transform(self, X, y=None):
         """
@@ -554,11 +715,10 @@ class EncodedAngle(SetMergeMixin, EncodedFeature):
         """
         self.check_fit()
         data = self.convert_input(X)
-        get_index, length, both = get_index_mapping(self._groups,
-                                                    self.form,
-                                                    self.add_unknown)
-        iterator = self._iterator(data, get_index, both)
-        return self.encode_values(iterator, length)
+        layout = self._get_layouts()["_groups"]
+        idxs, values, scalings = self._iterator(data, layout)
+        return self.encode_array(idxs, values, scalings,
+                                 layout.length).tolist()
 
 
 class EncodedBond(SetMergeMixin, EncodedFeature):
@@ -655,6 +815,11 @@ class EncodedBond(SetMergeMixin, EncodedFeature):
         self.form = form
         self.add_unknown = add_unknown
 
+    def _compile_layouts(self):
+        layout = FeatureLayout(self._element_pairs, form=self.form,
+                               add_unknown=self.add_unknown)
+        return {"_element_pairs": layout}
+
     def _para_fit(self, X):
         """
         A single instance of the fit procedure.
@@ -675,23 +840,22 @@ class EncodedBond(SetMergeMixin, EncodedFeature):
         data = self.convert_input(X)
         return get_element_pairs(data.elements)
 
-    def _iterator(self, data, get_index, both):
-        mat = get_depth_threshold_mask_connections(data.connections,
-                                                   max_depth=self.max_depth,
-                                                   min_depth=self.min_depth)
-        distances = cdist(data.coords, data.coords)
-        for i, ele1 in enumerate(data.elements):
-            for j, ele2 in enumerate(data.elements):
-                if i > j and not both:
-                    continue
-                if i == j or not mat[i, j]:
-                    continue
-                eles = (ele1, ele2)
-                try:
-                    idx = get_index(eles)
-                except KeyError:
-                    idx = None
-                yield idx, distances[i, j], 1.
+    def _iterator(self, data, layout):
+        mat = data.get_depth_mask(max_depth=self.max_depth,
+                                  min_depth=self.min_depth)
+        distances = data.distances
+        codes = layout.encode(data)
+        table, valid = layout.get_code_table(2)
+
+        n = len(codes)
+        if layout.both:
+            i, j = numpy.where(~numpy.eye(n, dtype=bool))
+        else:
+            i, j = numpy.triu_indices(n, k=1)
+        keep = mat[i, j] & valid[codes[i], codes[j]]
+        i, j = i[keep], j[keep]
+        idxs = table[codes[i], codes[j]]
+        return idxs, distances[i, j], numpy.ones(len(idxs))
 
     def _para_transform(self, X, y=None):
         """
@@ -717,14 +881,13 @@ class EncodedBond(SetMergeMixin, EncodedFeature):
         """
         self.check_fit()
         data = self.convert_input(X)
-        get_index, length, both = get_index_mapping(self._element_pairs,
-                                                    self.form,
-                                                    self.add_unknown)
-        iterator = self._iterator(data, get_index, both)
-        return self.encode_values(iterator, length)
+        layout = self._get_layouts()["_element_pairs"]
+        idxs, values, scalings = self._iterator(data, layout)
+        return self.encode_array(idxs, values, scalings,
+                                 layout.length).tolist()
 
 
-class CoulombMatrix(BaseFeature):
+class CoulombMatrix(BatchMixin, BaseFeature):
     r"""
     A molecular descriptor based on Coulomb interactions.
 
@@ -757,7 +920,8 @@ class CoulombMatrix(BaseFeature):
     eigen : bool, default=False
         Specifies whether or not to use the eigen spectrum of the coulomb
         matrix rather than the matrix itself. This changes the scaling to be
-        linear in the number of atoms.
+        linear in the number of atoms. The eigenvalues are ordered by
+        decreasing absolute value.
 
     drop_values : bool, default=False
         Specifies whether or not to drop the atoms from molecules larger than
@@ -766,6 +930,11 @@ class CoulombMatrix(BaseFeature):
         set to True, then it will truncate the molecule to only include the
         first _max_size atoms of the molecule.
 
+    n_eigen : int, default=None
+        If eigen is True, this specifies the number of eigenvalues with the
+        largest absolute value to keep. If this is None, then all of them are
+        kept.
+
     Attributes
     ----------
     _max_size : int
@@ -787,13 +956,14 @@ class CoulombMatrix(BaseFeature):
     LABELS = None
 
     def __init__(self, input_type='list', n_jobs=1, sort=False, eigen=False,
-                 drop_values=False):
+                 drop_values=False, n_eigen=None):
         super(CoulombMatrix, self).__init__(input_type=input_type,
                                             n_jobs=n_jobs)
         self._max_size = None
         self.sort = sort
         self.eigen = eigen
         self.drop_values = drop_values
+        self.n_eigen = n_eigen
 
     def _para_fit(self, X):
         """
@@ -829,10 +999,157 @@ class CoulombMatrix(BaseFeature):
         self : object
             Returns the instance itself.
         """
-        max_size = self.map(self._para_fit, X)
-        self._max_size = max(max_size)
+        return self._combine_fit_summaries(self._map_fit(X))
+
+    def _combine_fit(self, res):
+        """
+        Set the fit attributes from the results of _para_fit.
+
+        Parameters
+        ----------
+        res : list
+            The results of _para_fit for all of the values.
+
+        Returns
+        -------
+        self : object
+            Returns the instance itself.
+        """
+        self._max_size = max(res)
         return self
 
+    def _get_matrices(self, datas):
+        """
+        Compute the padded matrices for a batch of molecules.
+
+        Parameters
+        ----------
+        datas : list of LazyValues
+            The converted molecules
+
+        Returns
+        -------
+        values : array, shape=(n_mols, _max_size, _max_size)
+            The matrices for all the molecules padded with zeros
+
+        sizes : array, shape=(n_mols, )
+            The number of atoms used from each molecule
+
+        Raises
+        ------
+        ValueError
+            If the size of the transforming molecules are larger than the fit.
+        """
+        numbers = numpy.zeros((len(datas), self._max_size))
+        coords = numpy.zeros((len(datas), self._max_size, 3))
+        sizes = numpy.zeros(len(datas), dtype=int)
+        for i, data in enumerate(datas):
+            n = len(data.numbers)
+            if n > self._max_size:
+                if not self.drop_values:
+                    msg = "The fit molecules (%d) were not as large as the"
+                    msg += " ones that are being transformed (%d)."
+                    raise ValueError(msg % (self._max_size, n))
+                n = self._max_size
+            numbers[i, :n] = data.numbers[:n]
+            coords[i, :n] = data.coords[:n]
+            sizes[i] = n
+        return get_coulomb_matrices(numbers, coords), sizes
+
+    def _stack_matrices(self, matrices):
+        """
+        Pad and stack a list of square matrices.
+
+        Parameters
+        ----------
+        matrices : list of arrays
+            The matrices for each molecule
+
+        Returns
+        -------
+        values : array, shape=(n_mols, _max_size, _max_size)
+            The matrices for all the molecules padded with zeros
+
+        sizes : array, shape=(n_mols, )
+            The number of atoms in each molecule
+        """
+        values = numpy.zeros((len(matrices), self._max_size, self._max_size))
+        sizes = numpy.zeros(len(matrices), dtype=int)
+        for i, matrix in enumerate(matrices):
+            n = matrix.shape[0]
+            values[i, :n, :n] = matrix
+            sizes[i] = n
+        return values, sizes
+
+    def _sort_matrices(self, values, sizes):
+        """
+        Sort the rows and columns of the matrices by their row sums.
+
+        The padding is always kept at the end of the matrices.
+        """
+        norms = values.sum(1)
+        norms[numpy.arange(values.shape[1]) >= sizes[:, None]] = -numpy.inf
+        order = numpy.argsort(norms, axis=1, kind='mergesort')[:, ::-1]
+        mols = numpy.arange(values.shape[0])[:, None, None]
+        return values[mols, order[:, :, None], order[:, None, :]]
+
+    def _get_eigenvalues(self, values, sizes):
+        """
+        Compute the eigen spectra of the matrices.
+
+        The matrices are symmetric, so the eigenvalues are computed with a
+        batched symmetric solver over all the molecules of each size. The
+        eigenvalues are ordered by decreasing absolute value, truncated to
+        the first n_eigen, and then padded with zeros.
+        """
+        length = values.shape[1]
+        if self.n_eigen is not None:
+            length = min(self.n_eigen, length)
+        spectra = numpy.zeros((values.shape[0], length))
+        for n in numpy.unique(sizes):
+            idxs = numpy.where(sizes == n)[0]
+            eigs = numpy.linalg.eigvalsh(values[idxs, :n, :n])
+            order = numpy.argsort(-numpy.abs(eigs), axis=1,
+                                  kind='mergesort')
+            k = min(n, length)
+            mols = numpy.arange(len(idxs))[:, None]
+            spectra[idxs, :k] = eigs[mols, order[:, :k]]
+        return spectra
+
+    def _para_transform_batch(self, X):
+        """
+        A single instance of the batched transform procedure.
+
+        Parameters
+        ----------
+        X : list
+            The objects to use for the transform
+
+        Returns
+        -------
+        value : array, shape=(len(X), n_features)
+            The features extracted from the molecules
+
+        Raises
+        ------
+        ValueError
+            If the transformer has not been fit.
+
+        ValueError
+            If the size of the transforming molecules are larger than the fit.
+        """
+        self.check_fit()
+
+        datas = [self.convert_input(x) for x in X]
+        values, sizes = self._get_matrices(datas)
+        # The eigenvalues do not depend on the order of the atoms
+        if self.sort and not self.eigen:
+            values = self._sort_matrices(values, sizes)
+
+        if self.eigen:
+            values = self._get_eigenvalues(values, sizes)
+        return values.reshape(len(datas), -1)
+
     def _para_transform(self, X):
         """
         A single instance of the transform procedure.
@@ -858,33 +1175,7 @@ class CoulombMatrix(BaseFeature):
         ValueError
             If the size of the transforming molecules are larger than the fit.
         """
-        self.check_fit()
-
-        data = self.convert_input(X)
-        if len(data.numbers) > self._max_size:
-            if not self.drop_values:
-                msg = "The fit molecules (%d) were not as large as the ones"
-                msg += " that are being transformed (%d)."
-                raise ValueError(msg % (self._max_size, len(data.numbers)))
-            numbers = data.numbers[:self._max_size]
-            coords = data.coords[:self._max_size, :]
-        else:
-            numbers = data.numbers
-            coords = data.coords
-
-        padding_difference = self._max_size - len(numbers)
-        values = get_coulomb_matrix(numbers, coords)
-        if self.sort:
-            order = numpy.argsort(values.sum(0))[::-1]
-            values = values[order, :][:, order]
-
-        if self.eigen:
-            values = numpy.linalg.eig(values)[0]
-
-        values = numpy.pad(values,
-                           (0, padding_difference),
-                           mode="constant")
-        return values.reshape(-1)
+        return self._para_transform_batch([X])[0]
 
 
 class BagOfBonds(BaseFeature):
@@ -934,6 +1225,9 @@ class BagOfBonds(BaseFeature):
         self._bag_sizes = None
         self.drop_values = drop_values
 
+    def _compile_layouts(self):
+        return {"_bag_sizes": FeatureLayout(self._bag_sizes, form=2)}
+
     def _para_fit(self, X):
         """
         A single instance of the fit procedure.
@@ -1007,8 +1301,23 @@ class BagOfBonds(BaseFeature):
         self : object
             Returns the instance itself.
         """
-        bags = self.map(self._para_fit, X)
-        self._bag_sizes = self.reduce(self._max_merge_dict, bags)
+        return self._combine_fit_summaries(self._map_fit(X))
+
+    def _combine_fit(self, res):
+        """
+        Set the fit attributes from the results of _para_fit.
+
+        Parameters
+        ----------
+        res : list
+            The results of _para_fit for all of the values.
+
+        Returns
+        -------
+        self : object
+            Returns the instance itself.
+        """
+        self._bag_sizes = reduce(self._max_merge_dict, res)
         return self
 
     def _para_transform(self, X):
@@ -1040,36 +1349,37 @@ class BagOfBonds(BaseFeature):
         self.check_fit()
 
         data = self.convert_input(X)
-        # Sort the elements and coords based on the element
-        temp = sorted(zip(data.elements, data.coords), key=lambda x: x[0])
-        elements, coords = zip(*temp)
-
-        bags = {key: [0 for i in range(value)]
-                for key, value in self._bag_sizes.items()}
-        numbers = [ELE_TO_NUM[x] for x in elements]
-        coulomb_matrix = get_coulomb_matrix(numbers, coords)
-
-        ele_array = numpy.array(elements)
-        for ele1, ele2 in bags.keys():
-            # Select only the rows that are of type ele1
-            first = ele_array == ele1
-
-            # Select only the cols that are of type ele2
-            second = ele_array == ele2
-            # Select only the rows/cols that are in the upper triangle
-            # (This could also be the lower), and are in a row, col with
-            # ele1 and ele2 respectively
-            mask = numpy.triu(numpy.logical_and.outer(first, second), k=1)
-            # Add to correct double element bag highest to lowest
-            values = sorted(coulomb_matrix[mask].tolist(), reverse=True)
-
-            # The molecule being used was fit to something smaller
-            if len(values) > len(bags[ele1, ele2]):
-                if not self.drop_values:
-                    msg = "The size of the %s bag is too small for this input"
-                    raise ValueError(msg % ((ele1, ele2), ))
-                values = values[:len(bags[ele1, ele2])]
-
-            bags[ele1, ele2][:len(values)] = values
-        order = sorted(bags)
-        return sum((bags[key] for key in order), [])
+        layout = self._get_layouts()["_bag_sizes"]
+        keys = layout.keys
+        sizes = numpy.array([self._bag_sizes[key] for key in keys], dtype=int)
+        offsets = numpy.concatenate([[0], numpy.cumsum(sizes)])
+        values = numpy.zeros(offsets[-1])
+
+        # Encode every pair in the upper triangle to the index of its bag
+        codes = layout.encode(data)
+        table, valid = layout.get_code_table(2)
+        i, j = numpy.triu_indices(len(codes), k=1)
+        mask = valid[codes[i], codes[j]]
+        i, j = i[mask], j[mask]
+        bag = table[codes[i], codes[j]]
+        coulomb_matrix = get_coulomb_matrix(data.numbers, data.coords)
+        pair_values = coulomb_matrix[i, j]
+
+        # Group by bag with the values in each bag from highest to lowest
+        order = numpy.lexsort((-pair_values, bag))
+        bag = bag[order]
+        pair_values = pair_values[order]
+        rank = numpy.arange(len(bag)) - numpy.searchsorted(bag, bag)
+
+        # The molecule being used was fit to something smaller
+        too_large = rank >= sizes[bag]
+        if too_large.any():
+            if not self.drop_values:
+                msg = "The size of the %s bag is too small for this input"
+                raise ValueError(msg % (keys[bag[too_large][0]], ))
+            bag = bag[~too_large]
+            rank = rank[~too_large]
+            pair_values = pair_values[~too_large]
+
+        values[offsets[bag] + rank] = pair_values
+        return values
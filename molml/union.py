@@ -0,0 +1,231 @@
+"""
+A module to combine several representations into one.
+
+The transformers in a union share a single pass over the data. So, each
+molecule is only read and converted once, and all of its cached geometry is
+shared by every transformer.
+"""
+import copy
+
+import numpy
+
+from .base import BaseFeature, InputTypeMixin
+
+
+__all__ = ("FeatureUnion", )
+
+
+class FeatureUnion(InputTypeMixin, BaseFeature):
+    """
+    Concatenates the features from several transformers.
+
+    Parameters
+    ----------
+    input_type : string, default=None
+        Specifies the format the input values will be (must be one of 'list'
+        or 'filename'). If this value is None, then it will take the value
+        from the transformers, or if there are no transformers then it will
+        default to 'list'. If a value is given and it does not match the
+        value of all the transformers, then this will raise a ValueError.
+
+    n_jobs : int, default=1
+        Specifies the number of processes to create when generating the
+        features. Positive numbers specify a specifc amount, and numbers less
+        than 1 will use the number of cores the computer has.
+
+    transformers : list of BaseFeature, default=None
+        The transformers to combine. The features are concatenated in this
+        order. They should either all give one vector per molecule, or all
+        give one vector per atom.
+
+    Notes
+    -----
+    The fit of every transformer that defines `_para_fit` and `_combine_fit`
+    is done in a single pass over the data. Any other transformer is fit on
+    its own.
+
+    The features are always dense. Transformers with `sparse=True` (such as
+    Connectivity or Shell) give dense features when they are part of a union.
+    """
+    ATTRIBUTES = None
+    LABELS = None
+
+    def __init__(self, input_type=None, n_jobs=1, transformers=None):
+        super(FeatureUnion, self).__init__(input_type=input_type,
+                                           n_jobs=n_jobs)
+        if transformers is None:
+            transformers = []
+        for transformer in transformers:
+            self.check_transformer(transformer)
+        if self.input_type is None:
+            self.input_type = 'list'
+        self.transformers = list(transformers)
+
+    def _get_fused(self):
+        return [x for x in self.transformers
+                if hasattr(x, "_para_fit") and hasattr(x, "_combine_fit")]
+
+    def _para_fit(self, X):
+        """
+        A single instance of the fit procedure.
+
+        This is formulated in a way that the fits can be done completely
+        parallel in a map/reduce fashion.
+
+        Parameters
+        ----------
+        X : object
+            An object to use for the fit
+
+        Returns
+        -------
+        value : list
+            The _para_fit results of each of the fused transformers
+        """
+        data = self.convert_input(X)
+        return [x._para_fit(data) for x in self._get_fused()]
+
+    def _fit_chunk(self, X):
+        """
+        Fit a chunk of the values and summarize the fits.
+
+        Parameters
+        ----------
+        X : list
+            The values to fit
+
+        Returns
+        -------
+        value : list
+            The fit summaries of each of the fused transformers
+        """
+        fused = [copy.copy(x) for x in self._get_fused()]
+        res = [self._para_fit(x) for x in X]
+        for i, transformer in enumerate(fused):
+            transformer._combine_fit([x[i] for x in res])
+        return [x._get_fit_summary() for x in fused]
+
+    def fit(self, X, y=None):
+        """
+        Fit all of the transformers.
+
+        Parameters
+        ----------
+        X : list, shape=(n_samples, )
+            A list of objects to use to fit.
+
+        Returns
+        -------
+        self : object
+            Returns the instance itself.
+        """
+        X = list(X)
+        fused = self._get_fused()
+        summaries = self._map_fit(X)
+        for i, transformer in enumerate(fused):
+            transformer._combine_fit_summaries([x[i] for x in summaries])
+
+        for transformer in self.transformers:
+            if not any(transformer is x for x in fused):
+                transformer.fit(X)
+        return self
+
+    def partial_fit(self, X, y=None):
+        """
+        Update the fit of all of the transformers with more values.
+
+        Parameters
+        ----------
+        X : list, shape=(n_samples, )
+            A list of objects to use to fit.
+
+        Returns
+        -------
+        self : object
+            Returns the instance itself.
+        """
+        X = list(X)
+        fused = self._get_fused()
+        summaries = self._map_fit(X)
+        for i, transformer in enumerate(fused):
+            transformer._update_fit([x[i] for x in summaries])
+
+        for transformer in self.transformers:
+            if not any(transformer is x for x in fused):
+                transformer.partial_fit(X)
+        self._new_labels = sum((x._new_labels for x in self.transformers),
+                               tuple())
+        return self
+
+    def check_fit(self):
+        """
+        Check if all the transformers have been fit
+
+        Raises
+        ------
+        ValueError
+            A transformer has not been fit.
+        """
+        for transformer in self.transformers:
+            transformer.check_fit()
+
+    def _get_layouts(self):
+        # Compile the layouts of all the transformers at once, so they are
+        # sent to the workers
+        for transformer in self.transformers:
+            transformer._get_layouts()
+        return {}
+
+    def get_labels(self):
+        """
+        Get the labels for the features of all the transformers
+
+        Returns
+        -------
+        values : tuple
+            All of the labels of the resulting features in order.
+        """
+        return sum((x.get_labels() for x in self.transformers), tuple())
+
+    def _para_transform(self, X):
+        """
+        A single instance of the transform procedure.
+
+        This is formulated in a way that the transformations can be done
+        completely parallel with map.
+
+        Parameters
+        ----------
+        X : object
+            An object to use for the transform
+
+        Returns
+        -------
+        value : array
+            The concatenated features from all of the transformers
+
+        Raises
+        ------
+        ValueError
+            If any of the transformers have not been fit, or if they do not
+            give the same number of rows.
+        """
+        self.check_fit()
+
+        data = self.convert_input(X)
+        values = [numpy.asarray(x._para_transform(data), dtype=float)
+                  for x in self.transformers]
+        shape = values[0].shape[:-1]
+        if any(x.shape[:-1] != shape for x in values):
+            msg = "The transformers do not give the same number of rows."
+            raise ValueError(msg)
+
+        # The widths are only known after the transforms, so the blocks are
+        # written into the row as soon as it can be made
+        widths = [x.shape[-1] for x in values]
+        row = numpy.empty(shape + (sum(widths), ))
+        start = 0
+        for value, width in zip(values, widths):
+            row[..., start:start + width] = value
+            start += width
+        return row
@@ -8,15 +8,21 @@ import warnings
 from itertools import product
 
 import numpy
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 from scipy.special import expit
+import scipy.sparse
+import scipy.sparse.csgraph
 import scipy.stats
 
 from .constants import ELE_TO_NUM, NUM_TO_ELE, TYPE_ORDER, BOND_LENGTHS
+from .constants import ELECTRONEGATIVITY
 
 
 def lerp_smooth(x):
-    span = x[1] - x[0]
+    # The span is taken along the last axis so that many rows can be
+    # smoothed at the same time
+    span = x[..., 1:2] - x[..., :1]
     return numpy.maximum(-numpy.abs(x / span) + 1, 0)
 
 
@@ -82,6 +88,92 @@ def get_bond_type(element1, element2, dist):
             continue
 
 
+def _get_bond_length_table():
+    """
+    Convert BOND_LENGTHS into an array indexed by atomic number.
+
+    Returns
+    -------
+    table : numpy.array, shape=(max_atomic_number + 1, len(TYPE_ORDER))
+        The bond length contributions of each element for each bond type in
+        TYPE_ORDER. Missing values are NaN. Row 0 is used for unknown
+        elements.
+    """
+    table = numpy.empty((max(NUM_TO_ELE) + 1, len(TYPE_ORDER)))
+    table.fill(numpy.nan)
+    for ele, lengths in BOND_LENGTHS.items():
+        for i, key in enumerate(TYPE_ORDER):
+            if key in lengths:
+                table[ELE_TO_NUM[ele], i] = lengths[key]
+    return table
+
+
+BOND_LENGTH_TABLE = _get_bond_length_table()
+
+
+def _get_element_table(values):
+    """
+    Convert a dict of element properties into an array indexed by atomic
+    number.
+
+    Parameters
+    ----------
+    values : dict, element->float
+        The property of each element.
+
+    Returns
+    -------
+    table : numpy.array, shape=(max_atomic_number + 1, )
+        The property of each element. Missing values are NaN.
+    """
+    table = numpy.empty(max(NUM_TO_ELE) + 1)
+    table.fill(numpy.nan)
+    for ele, value in values.items():
+        table[ELE_TO_NUM[ele]] = value
+    return table
+
+
+ELECTRONEGATIVITY_TABLE = _get_element_table(ELECTRONEGATIVITY)
+
+
+def get_bond_types(numbers1, numbers2, dists):
+    """
+    Get the bond types between many pairs of atoms based on their distances.
+
+    This is the vectorized form of get_bond_type.
+
+    Parameters
+    ----------
+    numbers1 : array, shape=(n_pairs, )
+        The atomic numbers of the first atom in each pair. Unknown elements
+        should be given as 0.
+
+    numbers2 : array, shape=(n_pairs, )
+        The atomic numbers of the second atom in each pair.
+
+    dists : array, shape=(n_pairs, )
+        The distance between the atoms in each pair.
+
+    Returns
+    -------
+    types : numpy.array, shape=(n_pairs, )
+        The index in TYPE_ORDER of the type of each bond, or -1 if there is
+        no bond.
+    """
+    cutoffs = BOND_LENGTH_TABLE[numbers1] + BOND_LENGTH_TABLE[numbers2]
+    with numpy.errstate(invalid='ignore'):
+        bonded = numpy.asarray(dists)[:, None] < cutoffs
+    # The highest bond order that is within its cutoff
+    types = len(TYPE_ORDER) - 1 - numpy.argmax(bonded[:, ::-1], axis=1)
+    types[~bonded.any(axis=1)] = -1
+    return types
+
+
+def _get_table_numbers(elements):
+    """Get the atomic numbers to use to index BOND_LENGTH_TABLE."""
+    return numpy.array([ELE_TO_NUM.get(x, 0) for x in elements], dtype=int)
+
+
 def get_connections(elements1, coords1, elements2=None, coords2=None):
     """
     Return a dictionary edge list
@@ -92,6 +184,9 @@ def get_connections(elements1, coords1, elements2=None, coords2=None):
     Each value is is a tuple of the index of the connecting atom and the bond
     order as a string. Where the bond order is one of ['1', 'Ar', '2', '3'].
 
+    Only the atoms that are within the longest possible bond length of each
+    other are compared.
+
     Note: If two sets are given, this returns only the connections from the
     first set to the second. This is in contrast to returning connections from
     both directions.
@@ -121,27 +216,182 @@ def get_connections(elements1, coords1, elements2=None, coords2=None):
         elements2 = elements1
         coords2 = coords1
 
-    dist_mat = cdist(coords1, coords2)
     connections = {i: {} for i in range(len(elements1))}
-    for i, element1 in enumerate(elements1):
-        for j, element2 in enumerate(elements2):
-            if not disjoint and i >= j:
-                continue
+    i, j, types = _get_bond_pairs(elements1, coords1, elements2, coords2,
+                                  disjoint=disjoint)
+    for x, y, t in zip(i.tolist(), j.tolist(), types.tolist()):
+        bond_type = TYPE_ORDER[t]
+        connections[x][y] = bond_type
+        if not disjoint:
+            connections[y][x] = bond_type
+    return connections
 
-            dist = dist_mat[i, j]
-            bond_type = get_bond_type(element1, element2, dist)
-            if not bond_type:
-                continue
 
-            connections[i][j] = bond_type
-            if not disjoint:
-                connections[j][i] = bond_type
+def _get_bond_pairs(elements1, coords1, elements2, coords2, disjoint=True):
+    """
+    Find all the bonded pairs of atoms.
+
+    If the sets are not disjoint, then only the pairs with i < j are
+    returned.
+
+    Returns
+    -------
+    i : numpy.array, shape=(n_bonds, )
+        The indices of the first atom in each bond.
+
+    j : numpy.array, shape=(n_bonds, )
+        The indices of the second atom in each bond.
+
+    types : numpy.array, shape=(n_bonds, )
+        The index in TYPE_ORDER of the type of each bond.
+    """
+    empty = numpy.zeros(0, dtype=int)
+    numbers1 = _get_table_numbers(elements1)
+    numbers2 = _get_table_numbers(elements2)
+    if not len(numbers1) or not len(numbers2):
+        return empty, empty, empty
+
+    # The longest bond that any of these atoms could be in (fmax skips NaNs)
+    r_max = (numpy.fmax.reduce(BOND_LENGTH_TABLE[numbers1], axis=None) +
+             numpy.fmax.reduce(BOND_LENGTH_TABLE[numbers2], axis=None))
+    if numpy.isnan(r_max):
+        return empty, empty, empty
+
+    coords1 = numpy.asarray(coords1, dtype=float)
+    coords2 = numpy.asarray(coords2, dtype=float)
+    if disjoint:
+        tree1 = cKDTree(coords1)
+        tree2 = cKDTree(coords2)
+        near = tree1.query_ball_tree(tree2, r_max)
+        pairs = [(i, j) for i, values in enumerate(near)
+                 for j in sorted(values)]
+        pairs = numpy.array(pairs, dtype=int).reshape(-1, 2)
+    else:
+        pairs = get_cutoff_pairs(coords1, r_max)
+
+    i, j = pairs.T
+    dists = numpy.linalg.norm(coords1[i] - coords2[j], axis=1)
+    types = get_bond_types(numbers1[i], numbers2[j], dists)
+    mask = types >= 0
+    return i[mask], j[mask], types[mask]
+
+
+def _get_bond_graph(rows, cols, types, n_atoms, dtype=numpy.int8):
+    """Build the symmetric bond graph from the bonds in one direction."""
+    rows = numpy.asarray(rows, dtype=int)
+    cols = numpy.asarray(cols, dtype=int)
+    data = numpy.asarray(types, dtype=dtype) + 1
+    graph = scipy.sparse.csr_matrix((data, (rows, cols)),
+                                    shape=(n_atoms, n_atoms))
+    graph.sort_indices()
+    return graph
+
+
+def get_bond_graph(elements, coords):
+    """
+    Return the bonds of a molecule as a compact sparse matrix.
+
+    This is the array-backed form of get_connections. The bond orders are
+    stored as int8 values of one plus the index in TYPE_ORDER, so that the
+    `indptr`, `indices`, and `data` of the matrix are a complete
+    representation of the connections.
+
+    Parameters
+    ----------
+    elements : list
+        All the elements in the molecule.
+
+    coords : array, shape=(n_atoms, 3)
+        The coordinates of the atoms in the molecule.
+
+    Returns
+    -------
+    graph : scipy.sparse.csr_matrix, shape=(n_atoms, n_atoms)
+        The symmetric bond graph of the molecule.
+    """
+    i, j, types = _get_bond_pairs(elements, coords, elements, coords,
+                                  disjoint=False)
+    rows = numpy.concatenate([i, j])
+    cols = numpy.concatenate([j, i])
+    types = numpy.concatenate([types, types])
+    return _get_bond_graph(rows, cols, types, len(elements))
+
+
+def connections_to_bond_graph(connections, return_labels=False):
+    """
+    Convert a dictionary edge list into a compact bond graph.
+
+    Parameters
+    ----------
+    connections : dict, int->dict or int->list
+        Contains all atoms that are connected to each atom and bond type. If
+        the connected atoms are given as a list, then the bond type is None.
+
+    return_labels : bool, default=False
+        Whether or not to return the bond type of each code.
+
+    Returns
+    -------
+    graph : scipy.sparse.csr_matrix, shape=(len(connections),
+                                            len(connections))
+        The bond graph with values of one plus the index in the labels of
+        the bond type.
+
+    labels : tuple
+        The bond type of each code. This starts with TYPE_ORDER, and any
+        other bond types follow in the order they are found. Only returned
+        if `return_labels` is set.
+    """
+    labels = list(TYPE_ORDER)
+    orders = {x: i for i, x in enumerate(labels)}
+    rows = []
+    cols = []
+    types = []
+    for key, values in connections.items():
+        if not isinstance(values, dict):
+            values = {x: None for x in values}
+        for other, bond in values.items():
+            if bond not in orders:
+                orders[bond] = len(labels)
+                labels.append(bond)
+            rows.append(key)
+            cols.append(other)
+            types.append(orders[bond])
+    dtype = numpy.int8 if len(labels) < 127 else int
+    graph = _get_bond_graph(rows, cols, types, len(connections), dtype=dtype)
+    if return_labels:
+        return graph, tuple(labels)
+    return graph
+
+
+def bond_graph_to_connections(graph):
+    """
+    Convert a compact bond graph into a dictionary edge list.
+
+    Parameters
+    ----------
+    graph : scipy.sparse.csr_matrix, shape=(n_atoms, n_atoms)
+        The bond graph with values of one plus the index in TYPE_ORDER of
+        the bond type.
+
+    Returns
+    -------
+    connections : dict, int->dict
+        Contains all atoms that are connected to each atom and bond type.
+    """
+    indptr = graph.indptr.tolist()
+    indices = graph.indices.tolist()
+    types = [TYPE_ORDER[x - 1] for x in graph.data.tolist()]
+    connections = {}
+    for i in range(graph.shape[0]):
+        start, end = indptr[i], indptr[i + 1]
+        connections[i] = dict(zip(indices[start:end], types[start:end]))
     return connections
 
 
-def get_graph_distance(connections):
+def get_connections_matrix(connections):
     """
-    Compute the graph distance between all pairs of atoms using Floyd-Warshall
+    Convert a dictionary edge list into a sparse adjacency matrix.
 
     Parameters
     ----------
@@ -150,24 +400,106 @@ def get_graph_distance(connections):
 
     Returns
     -------
-    dist : numpy.array, shape=(len(connections), len(connections))
-        The graph distance between all pairs of atoms
+    matrix : scipy.sparse.csr_matrix, shape=(len(connections),
+                                             len(connections))
+        The adjacency matrix with a 1 for every connection.
     """
-    # Floyd-Warshall
     V = len(connections)
-    dist = numpy.ones((V, V)) * numpy.inf
-    numpy.fill_diagonal(dist, numpy.zeros(V))
+    rows = []
+    cols = []
     for key, values in connections.items():
-        for val in values:
-            dist[key, val] = 1
+        rows.extend(key for _ in values)
+        cols.extend(values)
+    data = numpy.ones(len(rows))
+    return scipy.sparse.csr_matrix((data, (rows, cols)), shape=(V, V))
+
 
-    for k in range(V):
-        for i in range(V):
-            for j in range(V):
-                temp = dist[i, k] + dist[k, j]
-                if dist[i, j] > temp:
-                    dist[i, j] = temp
-    return dist
+def get_chains(graph, depth, return_bonds=False):
+    """
+    Get all the simple paths of atoms in a bond graph.
+
+    The paths are grown one atom at a time from every atom, without revisiting
+    an atom. Each path is only included once, in the orientation where the
+    first index is less than the last index.
+
+    Parameters
+    ----------
+    graph : scipy.sparse.csr_matrix, shape=(n_atoms, n_atoms)
+        The bond graph of the molecule.
+
+    depth : int
+        The number of atoms in each path.
+
+    return_bonds : bool, default=False
+        Whether or not to also return the graph values of the bonds in each
+        path.
+
+    Returns
+    -------
+    chains : numpy.array, shape=(n_chains, depth)
+        The atom indices of each path.
+
+    bonds : numpy.array, shape=(n_chains, depth - 1)
+        The values in the graph for each bond of the paths. Only returned if
+        `return_bonds` is True.
+    """
+    indptr = graph.indptr
+    indices = graph.indices
+    chains = numpy.arange(graph.shape[0]).reshape(-1, 1)
+    bonds = numpy.zeros((chains.shape[0], 0), dtype=graph.dtype)
+    for i in range(depth - 1):
+        ends = chains[:, -1]
+        starts = indptr[ends]
+        counts = indptr[ends + 1] - starts
+        rows = numpy.repeat(numpy.arange(chains.shape[0]), counts)
+        # The position of each neighbor in the neighbor list of its end atom
+        offsets = numpy.arange(counts.sum()) - numpy.repeat(
+            numpy.cumsum(counts) - counts, counts)
+        idxs = numpy.repeat(starts, counts) + offsets
+        new = indices[idxs]
+        keep = (chains[rows] != new[:, None]).all(axis=1)
+        rows = rows[keep]
+        chains = numpy.hstack([chains[rows], new[keep, None]])
+        bonds = numpy.hstack([bonds[rows], graph.data[idxs[keep], None]])
+    if chains.shape[1] > 1:
+        keep = chains[:, 0] < chains[:, -1]
+        chains = chains[keep]
+        bonds = bonds[keep]
+    if return_bonds:
+        return chains, bonds
+    return chains
+
+
+def get_graph_distance(connections, max_depth=None):
+    """
+    Compute the graph distance between all pairs of atoms.
+
+    This uses a breadth-first search from every atom on the sparse
+    adjacency matrix.
+
+    Parameters
+    ----------
+    connections : dict, index->list of indices or sparse matrix
+        A dictionary that contains lists of all connected atoms, or a sparse
+        adjacency matrix such as the one from get_bond_graph.
+
+    max_depth : int, default=None
+        If given, the search stops at this depth and all the atoms that are
+        further away are given a distance of numpy.inf.
+
+    Returns
+    -------
+    dist : numpy.array, shape=(len(connections), len(connections))
+        The graph distance between all pairs of atoms
+    """
+    if scipy.sparse.issparse(connections):
+        graph = connections
+    else:
+        graph = get_connections_matrix(connections)
+    if max_depth is None:
+        max_depth = numpy.inf
+    return scipy.sparse.csgraph.dijkstra(graph, unweighted=True,
+                                         limit=max_depth)
 
 
 def get_depth_threshold_mask_connections(connections, min_depth=0,
@@ -177,9 +509,9 @@ def get_depth_threshold_mask_connections(connections, min_depth=0,
 
     Parameters
     ----------
-    connections : dict, index->list of indices
-        A dictionary that contains lists of all connected atoms.
-
+    connections : dict, index->list of indices or sparse matrix
+        A dictionary that contains lists of all connected atoms, or a sparse
+        adjacency matrix such as the one from get_bond_graph.
 
     min_depth : int, default=0
         The minimum depth to allow in the masking
@@ -196,9 +528,12 @@ def get_depth_threshold_mask_connections(connections, min_depth=0,
     if max_depth < 1:
         max_depth = numpy.inf
     if not min_depth and max_depth is numpy.inf:
-        V = len(connections)
+        if scipy.sparse.issparse(connections):
+            V = connections.shape[0]
+        else:
+            V = len(connections)
         return numpy.ones((V, V)).astype(bool)
-    dist = get_graph_distance(connections)
+    dist = get_graph_distance(connections, max_depth=max_depth)
     return (min_depth <= dist) & (dist <= max_depth)
 
 
@@ -208,7 +543,9 @@ class LazyValues(object):
 
     This object allows only needing to compute different molecule graph
     properties if they are needed. The prime example of this being the
-    computation of connections.
+    computation of connections. Internally, the connections are stored as a
+    compact sparse bond graph, and the dictionary form is only built when it
+    is asked for.
 
     Parameters
     ----------
@@ -235,6 +572,23 @@ class LazyValues(object):
         initialized value for this was None, then this will be computed from
         the coords and numbers/elements.
 
+    bond_graph : scipy.sparse.csr_matrix, shape=(n_atoms, n_atoms)
+        The same connections as a sparse matrix, where the values are int8
+        codes of one plus the index in bond_labels of the bond type.
+
+    bond_labels : tuple
+        The bond type of each code in bond_graph. This is TYPE_ORDER unless
+        the connections were given with other bond types.
+
+    distances : array, shape=(n_atoms, n_atoms)
+        The distances between all the pairs of atoms.
+
+    angles : array, shape=(n_atoms, n_atoms, n_atoms)
+        The angles between all the triples of atoms (see get_angles).
+
+    graph_distance : array, shape=(n_atoms, n_atoms)
+        The graph distance between all the pairs of atoms.
+
     numbers : array, shape=(n_atoms, )
         The atomic numbers of all the atoms. If the initialized value for this
         was None, then this will be computed from the elements.
@@ -248,10 +602,21 @@ class LazyValues(object):
 
     unit_cell : array, shape=(3, 3)
         An array of unit cell basis vectors, where the vectors are columns.
+
+    Notes
+    -----
+    All of the geometry values (distances, graph distances, depth masks, and
+    cutoff neighbor lists) are computed once and then shared by everything
+    that uses the same object. So, one object can be passed to several
+    transformers without redoing this work. The returned arrays are shared,
+    so they should not be modified in place.
     """
     def __init__(self, connections=None, coords=None, numbers=None,
                  elements=None, unit_cell=None):
         self._connections = connections
+        self._bond_graph = None
+        self._bond_labels = tuple(TYPE_ORDER)
+        self._cache = {}
         self._coords = self._none_check(coords)
         self._numbers = self._none_check(numbers)
         self._elements = self._none_check(elements)
@@ -287,6 +652,10 @@ class LazyValues(object):
             raise ValueError("Only one of radius and units must be set.")
         coords = numpy.array(self.coords)
         self.__crystal_size = len(offsets)
+        if self._bond_graph is not None:
+            self._connections = self.connections
+            self._bond_graph = None
+        self._cache = {}
 
         new_coords = []
         for offset in offsets:
@@ -344,9 +713,112 @@ class LazyValues(object):
     @property
     def connections(self):
         if self._connections is None:
-            self._connections = get_connections(self.elements, self.coords)
+            if self._bond_graph is not None:
+                graph = self._bond_graph
+                self._connections = bond_graph_to_connections(graph)
+            else:
+                self._connections = get_connections(self.elements,
+                                                    self.coords)
         return self._connections
 
+    @property
+    def bond_graph(self):
+        if self._bond_graph is None:
+            if self._connections is not None:
+                graph, labels = connections_to_bond_graph(self._connections,
+                                                          return_labels=True)
+                self._bond_labels = labels
+            else:
+                graph = get_bond_graph(self.elements, self.coords)
+            self._bond_graph = graph
+        return self._bond_graph
+
+    @property
+    def bond_labels(self):
+        # The labels are set when the bond graph is built
+        self.bond_graph
+        return self._bond_labels
+
+    def _cached(self, key, f, *args):
+        if key not in self._cache:
+            self._cache[key] = f(*args)
+        return self._cache[key]
+
+    @property
+    def distances(self):
+        return self._cached("distances", cdist, self.coords, self.coords)
+
+    @property
+    def angles(self):
+        return self._cached("angles", get_angles, self.coords)
+
+    @property
+    def graph_distance(self):
+        return self._cached("graph_distance", get_graph_distance,
+                            self.bond_graph)
+
+    def get_depth_mask(self, min_depth=0, max_depth=numpy.inf):
+        """
+        Get a mask of the pairs of atoms within a range of graph distances.
+
+        This gives the same values as get_depth_threshold_mask_connections.
+
+        Parameters
+        ----------
+        min_depth : int, default=0
+            The minimum depth to allow in the masking
+
+        max_depth : int, default=numpy.inf
+            The maximum depth to allow in the masking. Values less than 1 are
+            treated as no limit.
+
+        Returns
+        -------
+        mask : numpy.array, shape=(n_atoms, n_atoms)
+            A mask of all the atoms that are within the depths.
+        """
+        if max_depth < 1:
+            max_depth = numpy.inf
+        if not min_depth and max_depth == numpy.inf:
+            n = len(self.coords)
+            return self._cached(("depth_mask", ), numpy.ones, (n, n), bool)
+
+        def get_mask():
+            dist = self.graph_distance
+            return (min_depth <= dist) & (dist <= max_depth)
+        return self._cached(("depth_mask", min_depth, max_depth), get_mask)
+
+    def get_cutoff_pairs(self, r_cut):
+        """
+        Get all the pairs of atoms that are within a cutoff of each other.
+
+        See get_cutoff_pairs for details.
+        """
+        return self._cached(("cutoff_pairs", r_cut), get_cutoff_pairs,
+                            self.coords, r_cut)
+
+    def get_cutoff_triplets(self, r_cut):
+        """
+        Get all the triplets of atoms connected through cutoff pairs.
+
+        See get_cutoff_triplets for details.
+        """
+        def get_triplets():
+            pairs = self.get_cutoff_pairs(r_cut)
+            return get_pair_triplets(pairs, len(self.coords))
+        return self._cached(("cutoff_triplets", r_cut), get_triplets)
+
+    def get_triplet_angles(self, r_cut):
+        """
+        Get the angles of all the triplets from get_cutoff_triplets.
+
+        See get_triplet_angles for details.
+        """
+        def get_angles():
+            i, j, k = self.get_cutoff_triplets(r_cut)
+            return get_triplet_angles(self.coords, i, j, k)
+        return self._cached(("triplet_angles", r_cut), get_angles)
+
     @property
     def unit_cell(self):
         if self._unit_cell is None:
@@ -428,6 +900,47 @@ def get_coulomb_matrix(numbers, coords, alpha=1, use_decay=False):
     return top
 
 
+def get_coulomb_matrices(numbers, coords, alpha=1):
+    """
+    Return the coulomb matrices for a batch of padded molecules.
+
+    This is the batched form of get_coulomb_matrix. Molecules with fewer
+    atoms than the rest should be padded with atomic numbers of 0, which
+    results in rows and columns of zeros.
+
+    Parameters
+    ----------
+    numbers : array-like, shape=(n_mols, n_atoms)
+        The atomic numbers of all the atoms in each molecule
+
+    coords : array-like, shape=(n_mols, n_atoms, 3)
+        The xyz coordinates of all the atoms in each molecule (in angstroms)
+
+    alpha : number, default=1
+        Some value to exponentiate the distance in the coulomb matrix.
+
+    Returns
+    -------
+    top : array, shape=(n_mols, n_atoms, n_atoms)
+        The coulomb matrices
+    """
+    numbers = numpy.asarray(numbers, dtype=numpy.float64)
+    coords = numpy.asarray(coords, dtype=numpy.float64)
+    r = numpy.zeros(numbers.shape + numbers.shape[-1:])
+    for i in range(coords.shape[-1]):
+        x = coords[..., i]
+        r += (x[:, :, None] - x[:, None, :]) ** 2
+    r **= 0.5 * alpha
+
+    top = numbers[:, :, None] * numbers[:, None, :]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        numpy.divide(top, r, top)
+    top[~numpy.isfinite(top)] = 0
+    idxs = numpy.arange(numbers.shape[-1])
+    top[:, idxs, idxs] = 0.5 * numbers ** 2.4
+    return top
+
+
 def get_element_pairs(elements):
     """
     Extract all the element pairs in a molecule.
@@ -442,24 +955,17 @@ def get_element_pairs(elements):
     value : list
         All the element pairs in the molecule
     """
-    counts = {}
-    for ele in elements:
-        if ele not in counts:
-            counts[ele] = 0
-        counts[ele] += 1
+    if not len(elements):
+        return []
+    labels, counts = numpy.unique(elements, return_counts=True)
+    labels = labels.tolist()
 
-    pairs = {}
-    for i, x in enumerate(counts):
-        for j, y in enumerate(counts):
-            if i > j:
-                continue
-            if x == y and counts[x] == 1:
-                continue
-            if x > y:
-                pairs[y, x] = 1
-            else:
-                pairs[x, y] = 1
-    return list(pairs.keys())
+    pairs = []
+    for i, x in enumerate(labels):
+        if counts[i] > 1:
+            pairs.append((x, x))
+        pairs.extend((x, y) for y in labels[i + 1:])
+    return pairs
 
 
 def deslugify(string):
@@ -614,6 +1120,337 @@ def get_index_mapping(values, depth, add_unknown):
     return map_func, len(mapping) + extra, both
 
 
+def get_index_table(get_index, labels, ndim):
+    """
+    Evaluate a mapping function for all the combinations of some labels.
+
+    This allows the mapping indices of many atoms to be looked up at the
+    same time with integer array indexing.
+
+    Parameters
+    ----------
+    get_index : function(key)->int
+        A mapping function (see get_index_mapping).
+
+    labels : list
+        The unique labels (elements) to build the table for.
+
+    ndim : int
+        The number of labels in each key. If this is 1, then the labels are
+        passed directly to get_index rather than as a tuple.
+
+    Returns
+    -------
+    table : numpy.array, shape=(len(labels), ) * ndim
+        The mapping index of each combination of labels.
+
+    valid : numpy.array, shape=(len(labels), ) * ndim
+        Whether or not each combination of labels has a mapping index.
+    """
+    shape = (len(labels), ) * ndim
+    table = numpy.zeros(shape, dtype=int)
+    valid = numpy.zeros(shape, dtype=bool)
+    for idx in product(range(len(labels)), repeat=ndim):
+        if ndim == 1:
+            key = labels[idx[0]]
+        else:
+            key = tuple(labels[i] for i in idx)
+        try:
+            table[idx] = get_index(key)
+            valid[idx] = True
+        except KeyError:
+            continue
+    return table, valid
+
+
+def _to_tuple(value):
+    """
+    Convert (possibly nested) lists into tuples so they can be hashed.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(_to_tuple(x) for x in value)
+    return value
+
+
+class FeatureLayout(object):
+    """
+    The compiled feature layout of the fit keys of a transformer.
+
+    This holds all the values that only depend on the fit (the sorted keys,
+    the column of each key, and the index mapping and lookup tables), so
+    they are computed once for a fit instead of once for every molecule.
+
+    Parameters
+    ----------
+    keys : iterable
+        The fit keys (elements, element pairs, chains, ...).
+
+    form : int, default=None
+        The number of elements to use from each key for the index mapping
+        (see get_index_mapping). If this is None, then the keys are mapped
+        directly to their columns.
+
+    add_unknown : bool, default=False
+        Whether or not to include an extra collector for unknown values in the
+        index mapping.
+
+    Attributes
+    ----------
+    keys : tuple
+        The sorted keys.
+
+    columns : dict, key->int
+        The column of each key in the sorted keys.
+
+    length : int
+        The number of values in the index mapping.
+
+    both : bool
+        Indicates whether both values are needed in a loop (A, B) vs (B, A).
+
+    Notes
+    -----
+    The elements of a molecule can be encoded as dense integer codes with
+    `encode`. The code of an element is its position in the sorted labels of
+    the keys, and all the elements that are not in the keys share one extra
+    code. The mapping index of any combination of codes can then be looked up
+    in the table from `get_code_table`, so no strings are compared while
+    transforming.
+    """
+    def __init__(self, keys, form=None, add_unknown=False):
+        self.keys = tuple(sorted(_to_tuple(x) for x in keys))
+        self.columns = {key: i for i, key in enumerate(self.keys)}
+        self.form = form
+        self.add_unknown = add_unknown
+        # The fit attribute that this layout was compiled from
+        self.source = None
+        self._tables = {}
+        self._codes = None
+        self._set_mapping()
+
+    def _set_mapping(self):
+        self._get_index = None
+        if self.form is None:
+            self.length = len(self.keys)
+            self.both = False
+        elif not self.keys:
+            self.length = int(bool(self.add_unknown))
+            self.both = False
+        else:
+            self._get_index, self.length, self.both = get_index_mapping(
+                self.keys, self.form, self.add_unknown)
+
+    def __getstate__(self):
+        # The mapping function is a closure, so it is rebuilt after loading
+        state = self.__dict__.copy()
+        state.pop("_get_index", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._set_mapping()
+
+    def get_index(self, key):
+        """
+        Get the mapping index of a key.
+
+        Parameters
+        ----------
+        key : object
+            The key to look up.
+
+        Returns
+        -------
+        idx : int
+            The mapping index of the key, or -1 if it is unknown and
+            `add_unknown` is set.
+
+        Raises
+        ------
+        KeyError
+            If the key is unknown.
+        """
+        if self._get_index is not None:
+            return self._get_index(key)
+        if self.form is None:
+            return self.columns[key]
+        if self.add_unknown:
+            return -1
+        raise KeyError(key)
+
+    def get_table(self, labels, ndim):
+        """
+        Get the mapping index of all the combinations of some labels.
+
+        The tables are stored, so each set of labels is only evaluated once.
+
+        Parameters
+        ----------
+        labels : list
+            The unique labels (elements) to build the table for.
+
+        ndim : int
+            The number of labels in each key.
+
+        Returns
+        -------
+        table : numpy.array, shape=(len(labels), ) * ndim
+            The mapping index of each combination of labels.
+
+        valid : numpy.array, shape=(len(labels), ) * ndim
+            Whether or not each combination of labels has a mapping index.
+        """
+        key = (tuple(labels), ndim)
+        if key not in self._tables:
+            self._tables[key] = get_index_table(self.get_index, list(labels),
+                                                ndim)
+        return self._tables[key]
+
+    def _get_codes(self):
+        """
+        Get the dense codes of the labels in the keys.
+
+        Returns
+        -------
+        labels : tuple
+            The sorted labels. The code of a label is its position, and
+            `len(labels)` is the code of all unknown labels.
+
+        label_codes : dict, label->int
+            The code of each label.
+
+        number_codes : numpy.array, shape=(max_atomic_number + 1, ) or None
+            The code of each atomic number. This is None if any of the labels
+            is not an element.
+        """
+        if self._codes is None:
+            labels = set()
+            for key in self.keys:
+                labels.update(key if isinstance(key, tuple) else (key, ))
+            labels = tuple(sorted(labels))
+            label_codes = {x: i for i, x in enumerate(labels)}
+
+            number_codes = None
+            if all(x in ELE_TO_NUM for x in labels):
+                number_codes = numpy.empty(max(NUM_TO_ELE) + 1, dtype=int)
+                number_codes.fill(len(labels))
+                for i, x in enumerate(labels):
+                    number_codes[ELE_TO_NUM[x]] = i
+            self._codes = labels, label_codes, number_codes
+        return self._codes
+
+    def encode(self, data):
+        """
+        Get the codes of all the atoms in a molecule.
+
+        If all of the labels are elements, the codes are looked up directly
+        from the atomic numbers.
+
+        Parameters
+        ----------
+        data : LazyValues
+            The molecule to encode.
+
+        Returns
+        -------
+        codes : numpy.array, shape=(n_atoms, )
+            The code of each atom.
+        """
+        number_codes = self._get_codes()[2]
+        if number_codes is not None:
+            try:
+                numbers = data.numbers
+            except KeyError:
+                # There are labels in the molecule that are not elements
+                pass
+            else:
+                return number_codes[numpy.asarray(numbers, dtype=int)]
+        return self.encode_elements(data.elements)
+
+    def encode_elements(self, elements):
+        """
+        Get the codes of some elements.
+
+        Parameters
+        ----------
+        elements : array-like, shape=(n_atoms, )
+            The elements to encode.
+
+        Returns
+        -------
+        codes : numpy.array, shape=(n_atoms, )
+            The code of each element.
+        """
+        labels, label_codes, _ = self._get_codes()
+        if not len(elements):
+            return numpy.zeros(0, dtype=int)
+        unique, inverse = numpy.unique(elements, return_inverse=True)
+        codes = [label_codes.get(x, len(labels)) for x in unique.tolist()]
+        return numpy.array(codes, dtype=int)[inverse.ravel()]
+
+    def get_code_table(self, ndim):
+        """
+        Get the mapping index of all the combinations of codes.
+
+        Parameters
+        ----------
+        ndim : int
+            The number of codes in each key.
+
+        Returns
+        -------
+        table : numpy.array, shape=(len(labels) + 1, ) * ndim
+            The mapping index of each combination of codes.
+
+        valid : numpy.array, shape=(len(labels) + 1, ) * ndim
+            Whether or not each combination of codes has a mapping index.
+        """
+        key = (None, ndim)
+        if key not in self._tables:
+            # Any label that is not in the keys gives the same indices, so
+            # one placeholder (that is as long as the labels) is used in
+            # place of all the unknown labels
+            labels = list(self._get_codes()[0])
+            size = max([1] + [len(x) for x in labels])
+            labels.append("\0" * size)
+            self._tables[key] = get_index_table(self.get_index, labels, ndim)
+        return self._tables[key]
+
+    def to_json(self):
+        """
+        Return the layout as a json compatible dict.
+
+        Returns
+        -------
+        data : dict
+            The json data
+        """
+        return {
+            "keys": [list(x) if isinstance(x, tuple) else x
+                     for x in self.keys],
+            "form": self.form,
+            "add_unknown": self.add_unknown,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Load a layout from the output of to_json.
+
+        Parameters
+        ----------
+        data : dict
+            The json data
+
+        Returns
+        -------
+        layout : FeatureLayout
+            The loaded layout
+        """
+        return cls(data["keys"], form=data["form"],
+                   add_unknown=data["add_unknown"])
+
+
 def needs_reversal(chain):
     """
     Determine if the chain needs to be reversed.
@@ -653,6 +1490,34 @@ def needs_reversal(chain):
     return False
 
 
+def get_reversal_mask(chains):
+    """
+    Determine which chains need to be reversed.
+
+    This is the same as `needs_reversal` for a whole array of chains at once.
+
+    Parameters
+    ----------
+    chains : numpy.array, shape=(n_chains, chain_length)
+        The ordered codes of the values in each chain
+
+    Returns
+    -------
+    mask : numpy.array, shape=(n_chains, )
+        Whether or not each chain needs to be reversed
+    """
+    n, length = chains.shape
+    q, r = divmod(length, 2)
+    if not q:
+        return numpy.zeros(n, dtype=bool)
+    # Compare the values from the inside out
+    first = chains[:, q - 1::-1]
+    second = chains[:, q + r:]
+    diff = numpy.sign(first - second)
+    idxs = (diff != 0).argmax(axis=1)
+    return diff[numpy.arange(n), idxs] > 0
+
+
 def sort_chain(chain):
     """
     Sort a chain from the inside out.
@@ -698,6 +1563,147 @@ def get_angles(coords):
     return res
 
 
+def get_cutoff_pairs(coords, r_cut):
+    """
+    Get all the pairs of atoms that are within a cutoff distance.
+
+    This uses a KD tree so that only nearby atoms are ever compared.
+
+    Parameters
+    ----------
+    coords : numpy.array, shape=(n_atoms, n_dim)
+        An array of all the coordinates.
+
+    r_cut : float
+        The maximum distance between the atoms in a pair.
+
+    Returns
+    -------
+    pairs : numpy.array, shape=(n_pairs, 2)
+        The sorted index pairs (i, j) with i < j.
+    """
+    tree = cKDTree(numpy.asarray(coords, dtype=float))
+    pairs = sorted(tree.query_pairs(r_cut))
+    return numpy.array(pairs, dtype=int).reshape(-1, 2)
+
+
+def get_pair_triplets(pairs, n_atoms):
+    """
+    Get all the triplets of atoms where the ends are paired to the middle.
+
+    The triplets (i, j, k) are all the combinations where both (i, j) and
+    (j, k) are in pairs (in either order). This includes the case where
+    i == k. The number of triplets scales as O(n k^2) where k is the number
+    of pairs that each atom is in.
+
+    Parameters
+    ----------
+    pairs : numpy.array, shape=(n_pairs, 2)
+        The unique index pairs (i, j) with i < j.
+
+    n_atoms : int
+        The total number of atoms.
+
+    Returns
+    -------
+    i : numpy.array, shape=(n_triplets, )
+        The first atom of each triplet.
+
+    j : numpy.array, shape=(n_triplets, )
+        The middle atom of each triplet.
+
+    k : numpy.array, shape=(n_triplets, )
+        The last atom of each triplet.
+    """
+    pairs = numpy.asarray(pairs, dtype=int).reshape(-1, 2)
+    # Both directions of each pair grouped by the middle atom
+    middle = numpy.concatenate([pairs[:, 0], pairs[:, 1]])
+    ends = numpy.concatenate([pairs[:, 1], pairs[:, 0]])
+    order = numpy.lexsort((ends, middle))
+    middle, ends = middle[order], ends[order]
+
+    # Combine every neighbor of a middle atom with all of its other neighbors
+    counts = numpy.bincount(middle, minlength=n_atoms)
+    starts = numpy.cumsum(counts) - counts
+    reps = counts[middle]
+    first = numpy.repeat(numpy.arange(len(middle)), reps)
+    first_starts = numpy.repeat(numpy.cumsum(reps) - reps, reps)
+    offsets = numpy.arange(len(first)) - first_starts
+    second = starts[middle[first]] + offsets
+
+    i, j, k = ends[first], middle[first], ends[second]
+    order = numpy.lexsort((k, j, i))
+    return i[order], j[order], k[order]
+
+
+def get_cutoff_triplets(coords, r_cut):
+    """
+    Get all the triplets of atoms where the ends are near the middle atom.
+
+    The triplets (i, j, k) are all the combinations where both i and k are
+    within r_cut of j. This includes the case where i == k.
+
+    Parameters
+    ----------
+    coords : numpy.array, shape=(n_atoms, n_dim)
+        An array of all the coordinates.
+
+    r_cut : float
+        The maximum distance between the middle atom and the end atoms.
+
+    Returns
+    -------
+    i : numpy.array, shape=(n_triplets, )
+        The first atom of each triplet.
+
+    j : numpy.array, shape=(n_triplets, )
+        The middle atom of each triplet.
+
+    k : numpy.array, shape=(n_triplets, )
+        The last atom of each triplet.
+    """
+    pairs = get_cutoff_pairs(coords, r_cut)
+    return get_pair_triplets(pairs, len(coords))
+
+
+def get_triplet_angles(coords, i, j, k):
+    r"""
+    Get the angles of some triples of coords.
+
+    This gives the same values as get_angles, but only for the requested
+    triples.
+
+    Parameters
+    ----------
+    coords : numpy.array, shape=(n_atoms, n_dim)
+        An array of all the coordinates.
+
+    i : numpy.array, shape=(n_triplets, )
+        The first atom of each triplet.
+
+    j : numpy.array, shape=(n_triplets, )
+        The middle atom of each triplet.
+
+    k : numpy.array, shape=(n_triplets, )
+        The last atom of each triplet.
+
+    Returns
+    -------
+    res : numpy.array, shape=(n_triplets, )
+        The angles of the triplets.
+    """
+    coords = numpy.asarray(coords, dtype=float)
+    first = coords[j] - coords[i]
+    second = coords[k] - coords[j]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        first /= numpy.linalg.norm(first, axis=1)[:, None]
+        second /= numpy.linalg.norm(second, axis=1)[:, None]
+    res = numpy.einsum('ij,ij->i', first, second)
+    numpy.clip(res, -1., 1., res)
+    numpy.arccos(res, res)
+    return res
+
+
 def _load_transformer(data):
     """
     Load the transformer object
@@ -722,17 +1728,29 @@ def _load_transformer(data):
 
     cls = getattr(m, klass)
     comp = set(["attributes", "parameters", "transformer"])
+
+    def is_transformer(value):
+        return isinstance(value, dict) and \
+            len(comp & set(value.keys())) == 3
+
     parameters = {}
     for key, value in data["parameters"].items():
-        if not isinstance(value, dict) or \
-           len(comp & set(value.keys())) != 3:
+        if isinstance(value, list) and value and \
+                all(is_transformer(x) for x in value):
+            parameters[key] = [_load_transformer(x) for x in value]
+        elif is_transformer(value):
+            parameters[key] = _load_transformer(value)
+        else:
             parameters[key] = value
-            continue
-        parameters[key] = _load_transformer(value)
 
     obj = cls(**parameters)
-    for key, value in data["attributes"].items():
-        setattr(obj, key, value)
+    obj._load_attributes(data["attributes"])
+    if data.get("layouts"):
+        layouts = {}
+        for key, value in data["layouts"].items():
+            layouts[key] = FeatureLayout.from_json(value)
+            layouts[key].source = getattr(obj, key)
+        obj._layouts = layouts
     return obj
 
 
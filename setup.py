@@ -33,6 +33,7 @@ setup(
     tests_require=['nose'],
     install_requires=[
         'pathos',
+        'dill',
         'future',
     ],
     classifiers=[
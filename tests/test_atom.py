@@ -1,6 +1,7 @@
 import unittest
 
 import numpy
+import scipy.sparse
 
 from molml.atom import Shell, LocalEncodedBond, LocalCoulombMatrix
 from molml.atom import LocalEncodedAngle
@@ -164,6 +165,44 @@ class ShellTest(unittest.TestCase):
         a = Shell()
         self.assertTrue((a.fit_transform(ALL_DATA) == BASE_SHELL).all())
 
+    def test_transform_iter(self):
+        a = Shell()
+        a.fit(ALL_DATA)
+        res = list(a.transform_iter(iter(ALL_DATA), batch_size=2))
+        self.assertEqual(len(res), 2)
+        expected = numpy.concatenate([numpy.array(x) for x in BASE_SHELL])
+        try:
+            numpy.testing.assert_array_equal(numpy.concatenate(res),
+                                             expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_transform_sparse(self):
+        a = Shell(sparse=True, add_unknown=True)
+        a.fit([METHANE, MID])
+        res = a.transform(ALL_DATA)
+        b = Shell(add_unknown=True)
+        b.fit([METHANE, MID])
+        self.assertEqual(len(res), len(ALL_DATA))
+        for x, y in zip(res, b.transform(ALL_DATA)):
+            self.assertTrue(scipy.sparse.isspmatrix_csr(x))
+            try:
+                numpy.testing.assert_array_equal(x.toarray(), y)
+            except AssertionError as e:
+                self.fail(e)
+
+    def test_transform_iter_sparse(self):
+        a = Shell(sparse=True)
+        a.fit(ALL_DATA)
+        res = list(a.transform_iter(iter(ALL_DATA), batch_size=2))
+        self.assertTrue(all(scipy.sparse.issparse(x) for x in res))
+        expected = numpy.concatenate([numpy.array(x) for x in BASE_SHELL])
+        try:
+            numpy.testing.assert_array_equal(
+                scipy.sparse.vstack(res).toarray(), expected)
+        except AssertionError as e:
+            self.fail(e)
+
     def test_add_unknown(self):
         a = Shell(add_unknown=True)
         a.fit([METHANE])
@@ -478,6 +517,57 @@ class BehlerParrinelloTest(unittest.TestCase):
         self.assertEqual(a._elements, eles)
         self.assertEqual(a._element_pairs, pairs)
 
+    def test_partial_fit(self):
+        a = BehlerParrinello()
+        for x in ALL_DATA:
+            a.partial_fit([x])
+        b = BehlerParrinello().fit(ALL_DATA)
+        self.assertEqual(a._elements, b._elements)
+        self.assertEqual(a._element_pairs, b._element_pairs)
+
+    def test_transform_multiple_parameters(self):
+        a = BehlerParrinello(eta=[1., 0.5], r_s=[1., 2.], lambda_=[1., -1.],
+                             zeta=[1., 4.])
+        a.fit(ALL_DATA)
+        res = a.transform([MID])[0]
+        self.assertEqual(len(a.get_radial_parameters()[0]), 4)
+        self.assertEqual(len(a.get_angular_parameters()[0]), 8)
+
+        n_ele = len(a._elements)
+        n_pairs = len(a._element_pairs)
+        self.assertEqual(res.shape[1], 4 * n_ele + 8 * n_pairs)
+
+        radial = []
+        angular = []
+        for eta in a.eta:
+            for r_s in a.r_s:
+                b = BehlerParrinello(eta=eta, r_s=r_s).fit(ALL_DATA)
+                radial.append(b.transform([MID])[0][:, :n_ele])
+            for lambda_ in a.lambda_:
+                for zeta in a.zeta:
+                    b = BehlerParrinello(eta=eta, lambda_=lambda_, zeta=zeta)
+                    b.fit(ALL_DATA)
+                    angular.append(b.transform([MID])[0][:, n_ele:])
+        expected = numpy.hstack(radial + angular)
+        try:
+            numpy.testing.assert_array_almost_equal(res, expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_calculate_Theta(self):
+        a = BehlerParrinello()
+        coords = numpy.array(METHANE[1])
+        Theta = a.calculate_Theta(coords)
+        self.assertEqual(Theta.shape, (5, 5, 5))
+        for i, j, k in ((0, 1, 2), (1, 0, 3), (2, 4, 0)):
+            Rij = coords[i] - coords[j]
+            Rik = coords[i] - coords[k]
+            expected = Rij.dot(Rik)
+            expected /= numpy.linalg.norm(Rij) * numpy.linalg.norm(Rik)
+            self.assertAlmostEqual(Theta[i, j, k], expected)
+        for i, j, k in ((0, 0, 1), (0, 1, 0), (1, 0, 0), (2, 2, 2)):
+            self.assertEqual(Theta[i, j, k], 0)
+
     def test_transform_before_fit(self):
         a = BehlerParrinello()
         with self.assertRaises(ValueError):
@@ -1,4 +1,6 @@
 import os
+import shutil
+import tempfile
 import unittest
 import json
 try:
@@ -8,8 +10,10 @@ except ImportError:
 
 import numpy
 
+import molml.base
 from molml.base import BaseFeature, SetMergeMixin, InputTypeMixin, _func_star
-from molml.base import EncodedFeature
+from molml.base import EncodedFeature, WorkerPool, get_default_pool
+from molml.utils import LazyValues, FeatureLayout
 
 from .constants import METHANE_ELEMENTS, METHANE_COORDS, METHANE_PATH
 from .constants import METHANE, METHANE_NUMBERS
@@ -80,6 +84,31 @@ class TestFeature3(BaseFeature):
     ATTRIBUTES = None
 
 
+class TestFeature4(BaseFeature):
+    LABELS = None
+    ATTRIBUTES = None
+
+    def _para_transform(self, X):
+        return [X, 2 * X]
+
+
+class TestFeature5(SetMergeMixin, BaseFeature):
+    LABELS = ('values', )
+    ATTRIBUTES = ('values', )
+
+    def __init__(self, input_type='list', n_jobs=1):
+        super(TestFeature5, self).__init__(input_type, n_jobs)
+        self.values = None
+
+    def _para_fit(self, X):
+        return {X}
+
+
+class TestFeature6(TestFeature5):
+    def _compile_layouts(self):
+        return {"values": FeatureLayout(self.values)}
+
+
 #################################################
 class OtherTest(unittest.TestCase):
 
@@ -88,6 +117,46 @@ class OtherTest(unittest.TestCase):
         self.assertEqual(res, 5)
 
 
+class WorkerPoolTest(unittest.TestCase):
+
+    def test_map(self):
+        with WorkerPool(n_jobs=2) as pool:
+            res = pool.map(lambda x: x ** 2, range(10))
+            self.assertFalse(pool.closed)
+        self.assertTrue(pool.closed)
+        self.assertEqual(res, [x ** 2 for x in range(10)])
+
+    def test_reuse_after_close(self):
+        pool = WorkerPool(n_jobs=2)
+        pool.map(abs, range(4))
+        pool.close()
+        self.assertEqual(pool.map(abs, [-1, -2]), [1, 2])
+        pool.close()
+
+    def test_map_chunksize(self):
+        with WorkerPool(n_jobs=2, chunksize=3) as pool:
+            self.assertEqual(pool.get_chunksize(10), 3)
+            res = pool.map(lambda x: x ** 2, range(10))
+            self.assertEqual(res, [x ** 2 for x in range(10)])
+            res = pool.map(lambda x: -x, range(10), chunksize=20)
+            self.assertEqual(res, [-x for x in range(10)])
+            self.assertEqual(pool.map(abs, []), [])
+
+    def test_get_chunksize_default(self):
+        pool = WorkerPool(n_jobs=2)
+        self.assertEqual(pool.get_chunksize(1), 1)
+        self.assertEqual(pool.get_chunksize(16), 2)
+        self.assertEqual(pool.get_chunksize(17), 3)
+
+    def test_n_jobs_negative(self):
+        pool = WorkerPool(n_jobs=-1)
+        self.assertTrue(pool.n_jobs >= 1)
+
+    def test_get_default_pool(self):
+        self.assertIs(get_default_pool(2), get_default_pool(2))
+        self.assertIsNot(get_default_pool(2), get_default_pool(3))
+
+
 class BaseFeatureTest(unittest.TestCase):
 
     def test_map_n_jobs_negative(self):
@@ -105,6 +174,35 @@ class BaseFeatureTest(unittest.TestCase):
         res = a.map(lambda x: x ** 2, range(10))
         self.assertEqual(res, [x ** 2 for x in range(10)])
 
+    def test_map_shared_pool(self):
+        a = BaseFeature(n_jobs=1)
+        b = BaseFeature(n_jobs=1)
+        with WorkerPool(n_jobs=2) as pool:
+            a.set_pool(pool)
+            b.set_pool(pool)
+            self.assertIs(a.get_pool(), b.get_pool())
+            res = a.map(lambda x: x ** 2, range(10))
+            self.assertEqual(res, [x ** 2 for x in range(10)])
+            res = b.reduce(lambda x, y: x + y, range(10))
+            self.assertEqual(res, sum(range(10)))
+
+    def test_map_chunksize(self):
+        a = BaseFeature(n_jobs=2)
+        res = a.map(lambda x: x ** 2, range(10), chunksize=4)
+        self.assertEqual(res, [x ** 2 for x in range(10)])
+
+    def test_get_pool(self):
+        a = BaseFeature(n_jobs=1)
+        self.assertIsNone(a.get_pool())
+        a = BaseFeature(n_jobs=2)
+        self.assertIs(a.get_pool(), get_default_pool(2))
+
+    def test_pool_not_pickled(self):
+        a = BaseFeature(n_jobs=2)
+        with WorkerPool(n_jobs=2) as pool:
+            a.set_pool(pool)
+            self.assertNotIn("_pool", a.__getstate__())
+
     def test_reduce_n_jobs_negative(self):
         a = BaseFeature(n_jobs=-1)
         res = a.reduce(lambda x, y: x + y, range(10))
@@ -148,6 +246,12 @@ class BaseFeatureTest(unittest.TestCase):
         self.assertEqual(data.elements.tolist(), METHANE[0])
         self.assertEqual(data.coords.tolist(), METHANE[1].tolist())
 
+    def test_convert_input_lazy_values(self):
+        data = LazyValues(elements=METHANE_ELEMENTS, coords=METHANE_COORDS)
+        for input_type in ("list", "filename", ["coords", "elements"]):
+            a = BaseFeature(input_type=input_type)
+            self.assertIs(a.convert_input(data), data)
+
     def test_convert_input_filename(self):
         a = BaseFeature(input_type="filename")
         base_path = os.path.join(os.path.dirname(__file__), "data", "methane")
@@ -336,6 +440,84 @@ class BaseFeatureTest(unittest.TestCase):
         except AssertionError as e:
             self.fail(e)
 
+    def test_transform_iter(self):
+        a = TestFeature1()
+        a.fit([1])
+        res = list(a.transform_iter((x for x in range(5)), batch_size=2))
+        self.assertEqual([x.shape for x in res], [(2, 1), (2, 1), (1, 1)])
+        self.assertEqual(res[0].dtype, numpy.float64)
+
+    def test_transform_iter_default_batch_size(self):
+        a = TestFeature1()
+        a.fit([1])
+        a.BATCH_SIZE = 3
+        res = list(a.transform_iter(range(5)))
+        self.assertEqual([x.shape for x in res], [(3, 1), (2, 1)])
+
+    def test_transform_iter_empty(self):
+        a = TestFeature1()
+        self.assertEqual(list(a.transform_iter([])), [])
+
+    def test_transform_out_array(self):
+        a = TestFeature4()
+        a.BATCH_SIZE = 2
+        out = numpy.zeros((5, 2))
+        res = a.transform(range(5), out=out)
+        self.assertIs(res, out)
+        self.assertEqual(out.tolist(), [[x, 2 * x] for x in range(5)])
+
+    def test_transform_out_wrong_size(self):
+        a = TestFeature4()
+        with self.assertRaises(ValueError):
+            a.transform(range(5), out=numpy.zeros((4, 2)))
+
+    def test_transform_out_filename(self):
+        path = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(path, "features.dat")
+            for n_jobs in (1, 2):
+                a = TestFeature4(n_jobs=n_jobs)
+                res = a.transform(range(7), out=filename)
+                self.assertIsInstance(res, numpy.memmap)
+                del res
+                res = numpy.memmap(filename, dtype=float, mode='r',
+                                   shape=(7, 2))
+                self.assertEqual(res.tolist(),
+                                 [[x, 2 * x] for x in range(7)])
+                del res
+        finally:
+            shutil.rmtree(path)
+
+    def test_transform_out_filename_empty(self):
+        path = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(path, "features.dat")
+            a = TestFeature4()
+            res = a.transform([], out=filename)
+            self.assertEqual(res.shape, (0, 0))
+            self.assertEqual(os.path.getsize(filename), 0)
+        finally:
+            shutil.rmtree(path)
+
+    def test_transform_out_memmap_parallel(self):
+        path = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(path, "features.dat")
+            out = numpy.memmap(filename, dtype=float, mode='w+',
+                               shape=(9, 2))
+            a = TestFeature4(n_jobs=2)
+            a.BATCH_SIZE = 2
+            a.transform(range(9), out=out)
+            self.assertEqual(out.tolist(), [[x, 2 * x] for x in range(9)])
+            del out
+        finally:
+            shutil.rmtree(path)
+
+    def test_transform_iter_invalid_batch_size(self):
+        a = TestFeature1()
+        with self.assertRaises(ValueError):
+            list(a.transform_iter([1], batch_size=0))
+
 
 class TestSetMergeMixin(unittest.TestCase):
     def test_multiple_attributes(self):
@@ -367,6 +549,66 @@ class TestSetMergeMixin(unittest.TestCase):
         a.fit([METHANE_PATH, METHANE_PATH])
         self.assertEqual({1, 2, 3}, a.test1)
 
+    def test_fit_parallel(self):
+        a = TestFeature5(n_jobs=2)
+        a.fit(range(10))
+        self.assertEqual(a.values, set(range(10)))
+
+    def test_map_fit_one_summary_per_process(self):
+        a = TestFeature5(n_jobs=2)
+        summaries = a._map_fit(range(10))
+        self.assertEqual(summaries, [set(range(5)), set(range(5, 10))])
+
+    def test_map_fit_does_not_change_fit(self):
+        a = TestFeature5().fit([1, 2])
+        a._map_fit([3])
+        self.assertEqual(a.values, {1, 2})
+
+    def test_partial_fit(self):
+        a = TestFeature5()
+        a.partial_fit([1, 2])
+        self.assertEqual(a._new_labels, (1, 2))
+        a.partial_fit([2, 3])
+        self.assertEqual(a.values, {1, 2, 3})
+        self.assertEqual(a._new_labels, (3, ))
+
+    def test_partial_fit_parallel(self):
+        a = TestFeature5(n_jobs=2).fit(range(5))
+        a.partial_fit(range(3, 10))
+        self.assertEqual(a.values, set(range(10)))
+        self.assertEqual(a._new_labels, tuple(range(5, 10)))
+
+    def test_layouts_compiled_once(self):
+        a = TestFeature6().fit([2, 1])
+        layout = a._get_layouts()["values"]
+        self.assertEqual(layout.keys, (1, 2))
+        self.assertIs(a._get_layouts()["values"], layout)
+        a.fit([3])
+        self.assertEqual(a._get_layouts()["values"].keys, (3, ))
+
+    def test_layouts_before_fit(self):
+        a = TestFeature6()
+        self.assertEqual(a._get_layouts(), {})
+        self.assertNotIn("layouts", a.to_json())
+
+    def test_layouts_set_params(self):
+        a = TestFeature6().fit([1])
+        layout = a._get_layouts()["values"]
+        a.set_params(n_jobs=2)
+        self.assertIsNot(a._get_layouts()["values"], layout)
+
+    def test_layouts_to_json(self):
+        a = TestFeature6().fit([2, 1])
+        data = a.to_json()
+        expected = {"values": {"keys": [1, 2], "form": None,
+                               "add_unknown": False}}
+        self.assertEqual(data["layouts"], expected)
+
+    def test_partial_fit_not_mergeable(self):
+        a = TestFeature1()
+        with self.assertRaises(NotImplementedError):
+            a.partial_fit([1])
+
 
 class Feature(InputTypeMixin, BaseFeature):
 
@@ -418,6 +660,86 @@ class TestEncodedFeature(unittest.TestCase):
         except AssertionError as e:
             self.fail(e)
 
+    def test_encode_array(self):
+        a = EncodedFeature(segments=5, start=0, end=4)
+        res = a.encode_array([0, 1, 0], [1, 2, 3.5], [1, 2, 1], 2)
+        expected = [
+            5.520948e-88, 3.989423e-1, 5.520948e-88, 7.694599e-23,
+            7.694599e-23,
+            0, 1.104190e-87, 7.978846e-1, 1.104190e-87, 0]
+        try:
+            numpy.testing.assert_allclose(res, expected, rtol=1e-6)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_encode_array_blocks(self):
+        a = EncodedFeature(segments=5, start=0, end=4, smoothing='lerp')
+        old_size = molml.base.ENCODE_BLOCK_SIZE
+        # Only fit one value per block
+        molml.base.ENCODE_BLOCK_SIZE = a.segments
+        try:
+            res = a.encode_array([0, 1, 0, -1], [1, 2, 2.5, 4.1],
+                                 [1, 2, 1, 2], 2)
+        finally:
+            molml.base.ENCODE_BLOCK_SIZE = old_size
+        expected = [
+            0, 1, .5, .5, 0,
+            0, 0, 2, 0, 1.8]
+        try:
+            numpy.testing.assert_array_almost_equal(res, expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_encode_array_empty(self):
+        a = EncodedFeature(segments=5)
+        res = a.encode_array([], [], [], 2)
+        self.assertEqual(res.tolist(), [0.] * 10)
+
+    def test_encode_array_lerp(self):
+        a = EncodedFeature(segments=5, start=0, end=4, smoothing='lerp')
+        res = a.encode_array([0, -1, 1], [3, 1.5, 4.1], [1, 1, 2], 2)
+        expected = [
+            0, 0, 0, 1, 0,
+            0, .5, .5, 0, 1.8]
+        try:
+            numpy.testing.assert_array_almost_equal(res, expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_encode_atom_array(self):
+        a = EncodedFeature(segments=5, start=0, end=4)
+        res = a.encode_atom_array([0, 1, 1], [1, 0, 1], [1, 2, 3.5],
+                                  [1, 2, 1], 2, 2)
+        expected = numpy.array([
+            [0, 0, 0, 0, 0,
+             5.520948e-88, 3.989423e-1, 5.520948e-88, 0, 0],
+            [0, 1.104190e-87, 7.978846e-1, 1.104190e-87, 0,
+             0, 0, 1.473646e-196, 7.694599e-23, 7.694599e-23],
+        ])
+        try:
+            numpy.testing.assert_allclose(res, expected, rtol=1e-6)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_encode_atom_array_blocks(self):
+        a = EncodedFeature(segments=5, start=0, end=4, smoothing='lerp')
+        old_size = molml.base.ENCODE_BLOCK_SIZE
+        # Only fit one value per block
+        molml.base.ENCODE_BLOCK_SIZE = a.segments
+        try:
+            res = a.encode_atom_array([0, 1, 1, 0], [1, 0, 1, 1],
+                                      [1, 2, 2.5, 4.1], [1, 2, 1, 2], 2, 2)
+        finally:
+            molml.base.ENCODE_BLOCK_SIZE = old_size
+        expected = numpy.array([
+            [0, 0, 0, 0, 0, 0, 1, 0, 0, 1.8],
+            [0, 0, 2, 0, 0, 0, 0, .5, .5, 0],
+        ])
+        try:
+            numpy.testing.assert_array_almost_equal(res, expected)
+        except AssertionError as e:
+            self.fail(e)
+
     def test_encode_atom_values(self):
         a = EncodedFeature(segments=5)
         data = [((0, 1), 3, 1), ((1, 0), 3, 2), (None, 1, 1)]
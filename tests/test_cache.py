@@ -0,0 +1,198 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy
+
+from molml.cache import FeatureCache, get_molecule_hash, get_transformer_hash
+from molml.molecule import EncodedBond, Connectivity
+from molml.utils import LazyValues
+
+from .constants import METHANE_ELEMENTS, METHANE_COORDS, METHANE, MID
+from .constants import ALL_DATA
+
+
+class CountingConnectivity(Connectivity):
+    calls = 0
+
+    def _para_transform(self, X, y=None):
+        CountingConnectivity.calls += 1
+        return super(CountingConnectivity, self)._para_transform(X)
+
+
+class FeatureCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_set_get(self):
+        cache = FeatureCache(self.path)
+        cache.set("abcdef", numpy.arange(4.))
+        self.assertEqual(cache.get("abcdef").tolist(), [0., 1., 2., 3.])
+
+    def test_get_missing(self):
+        cache = FeatureCache(self.path)
+        self.assertIsNone(cache.get("abcdef"))
+
+    def test_create_directory(self):
+        path = os.path.join(self.path, "inner", "cache")
+        cache = FeatureCache(path)
+        cache.set("abcdef", numpy.arange(4.))
+        self.assertTrue(os.path.isdir(path))
+
+    def test_overwrite_size(self):
+        cache = FeatureCache(self.path)
+        cache.set("aa", numpy.arange(100.))
+        size = cache.get_size()
+        cache.max_size = 2 * size
+        for _ in range(3):
+            cache.set("aa", numpy.arange(100.))
+            # Overwriting a value does not count its size again
+            self.assertEqual(cache._size, size)
+        cache.set("bb", numpy.arange(100.))
+        self.assertEqual(cache._size, 2 * size)
+        self.assertIsNotNone(cache.get("aa"))
+        self.assertIsNotNone(cache.get("bb"))
+
+    def test_clear(self):
+        cache = FeatureCache(self.path)
+        cache.set("abcdef", numpy.arange(4.))
+        cache.clear()
+        self.assertIsNone(cache.get("abcdef"))
+        self.assertEqual(cache.get_size(), 0)
+
+    def test_evict_least_recently_used(self):
+        cache = FeatureCache(self.path)
+        cache.set("aa", numpy.arange(100.))
+        size = cache.get_size()
+        cache.max_size = 2 * size
+        now = time.time()
+        cache.set("bb", numpy.arange(100.))
+        os.utime(cache._get_path("aa"), (now - 10, now - 10))
+        os.utime(cache._get_path("bb"), (now - 20, now - 20))
+        # Loading updates the last use
+        cache.get("bb")
+        cache.set("cc", numpy.arange(100.))
+        self.assertIsNone(cache.get("aa"))
+        self.assertIsNotNone(cache.get("bb"))
+        self.assertIsNotNone(cache.get("cc"))
+        self.assertEqual(cache.get_size(), 2 * size)
+
+
+class HashTest(unittest.TestCase):
+
+    def test_molecule_hash(self):
+        a = LazyValues(elements=METHANE_ELEMENTS, coords=METHANE_COORDS)
+        b = LazyValues(elements=METHANE_ELEMENTS, coords=METHANE_COORDS)
+        self.assertEqual(get_molecule_hash(a), get_molecule_hash(b))
+
+    def test_molecule_hash_different(self):
+        base = LazyValues(elements=METHANE_ELEMENTS, coords=METHANE_COORDS)
+        others = [
+            LazyValues(elements=METHANE_ELEMENTS, coords=METHANE_COORDS + 1),
+            LazyValues(elements=['N'] + METHANE_ELEMENTS[1:],
+                       coords=METHANE_COORDS),
+            LazyValues(elements=METHANE_ELEMENTS, coords=METHANE_COORDS,
+                       connections={i: {} for i in range(5)}),
+            LazyValues(elements=METHANE_ELEMENTS, coords=METHANE_COORDS,
+                       unit_cell=numpy.eye(3)),
+        ]
+        for other in others:
+            self.assertNotEqual(get_molecule_hash(base),
+                                get_molecule_hash(other))
+
+    def test_transformer_hash(self):
+        a = Connectivity().fit([METHANE, MID])
+        b = Connectivity().fit([MID, METHANE])
+        self.assertEqual(get_transformer_hash(a), get_transformer_hash(b))
+
+    def test_transformer_hash_different(self):
+        base = Connectivity().fit([METHANE])
+        others = [
+            Connectivity().fit([MID]),
+            Connectivity(depth=2).fit([METHANE]),
+            EncodedBond().fit([METHANE]),
+        ]
+        for other in others:
+            self.assertNotEqual(get_transformer_hash(base),
+                                get_transformer_hash(other))
+
+
+class BaseFeatureCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_transform(self):
+        a = CountingConnectivity()
+        a.fit(ALL_DATA)
+        expected = a.transform(ALL_DATA)
+        a.set_cache(FeatureCache(self.path))
+        self.assertIsNotNone(a.get_cache())
+
+        CountingConnectivity.calls = 0
+        res = a.transform(ALL_DATA)
+        self.assertEqual(CountingConnectivity.calls, 3)
+        res2 = a.transform(ALL_DATA)
+        self.assertEqual(CountingConnectivity.calls, 3)
+        try:
+            numpy.testing.assert_array_equal(res, expected)
+            numpy.testing.assert_array_equal(res2, expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_transform_out(self):
+        a = CountingConnectivity()
+        a.fit(ALL_DATA)
+        expected = a.transform(ALL_DATA)
+        a.set_cache(FeatureCache(self.path))
+
+        CountingConnectivity.calls = 0
+        out = numpy.zeros(expected.shape)
+        a.transform(ALL_DATA, out=out)
+        self.assertEqual(CountingConnectivity.calls, 3)
+        path = os.path.join(self.path, "features.mmap")
+        res = a.transform(ALL_DATA, out=path)
+        self.assertEqual(CountingConnectivity.calls, 3)
+        try:
+            numpy.testing.assert_array_equal(out, expected)
+            numpy.testing.assert_array_equal(res, expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_transform_out_parallel(self):
+        a = Connectivity(n_jobs=2).fit(ALL_DATA)
+        a.set_cache(FeatureCache(os.path.join(self.path, "cache")))
+        path = os.path.join(self.path, "features.mmap")
+        expected = Connectivity().fit(ALL_DATA).transform(ALL_DATA)
+        res = a.transform(ALL_DATA, out=path)
+        self.assertGreater(a.get_cache().get_size(), 0)
+        try:
+            numpy.testing.assert_array_equal(res, expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_transform_refit(self):
+        cache = FeatureCache(self.path)
+        a = Connectivity().set_cache(cache)
+        a.fit([METHANE])
+        self.assertEqual(a.transform([MID]).shape, (1, 2))
+        a.fit(ALL_DATA)
+        self.assertEqual(a.transform([MID]).shape, (1, 4))
+
+    def test_transform_before_fit(self):
+        a = Connectivity().set_cache(FeatureCache(self.path))
+        with self.assertRaises(ValueError):
+            a.transform(ALL_DATA)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,7 @@ import numpy
 from molml.molecule import Connectivity
 from molml.crystal import GenerallizedCrystal
 from molml.crystal import EwaldSumMatrix, SineMatrix
+from molml.utils import LazyValues
 
 
 H_ELES = ['H']
@@ -44,6 +45,13 @@ class GenerallizedCrystalTest(unittest.TestCase):
         a.fit([H])
         self.assertEqual(a.transformer._base_chains, {('H', )})
 
+    def test_partial_fit(self):
+        t = Connectivity(input_type=H_INPUT)
+        a = GenerallizedCrystal(transformer=t, radius=2.5)
+        a.partial_fit([H])
+        self.assertEqual(a.transformer._base_chains, {('H', )})
+        self.assertEqual(a._new_labels, (('H', ), ))
+
     def test_transform(self):
         t = Connectivity(input_type=H_INPUT)
         a = GenerallizedCrystal(transformer=t, radius=2.5)
@@ -51,6 +59,22 @@ class GenerallizedCrystalTest(unittest.TestCase):
         res = a.transform([H])
         self.assertEqual(res, numpy.array([[37]]))
 
+    def test_transform_shared_values(self):
+        t = Connectivity(input_type=H_INPUT)
+        a = GenerallizedCrystal(transformer=t, radius=2.5)
+        data = LazyValues(elements=H_ELES, coords=H_COORDS, unit_cell=H_UNIT)
+        a.fit([data])
+        res = a.transform([data])
+        self.assertEqual(res, numpy.array([[37]]))
+        # The shared input is not expanded
+        self.assertEqual(len(data.elements), 1)
+
+    def test_get_labels(self):
+        t = Connectivity(input_type=H_INPUT)
+        a = GenerallizedCrystal(transformer=t, radius=2.5)
+        a.fit([H])
+        self.assertEqual(a.get_labels(), (('H', ), ))
+
     def test_transform_before_fit(self):
         t = Connectivity(input_type=H_INPUT)
         a = GenerallizedCrystal(transformer=t, radius=2.5)
@@ -164,7 +188,7 @@ class EwaldSumMatrixCrystalTest(unittest.TestCase):
     def test_eigen(self):
         a = EwaldSumMatrix(input_type=H_INPUT, eigen=True)
         res = a.fit_transform([H2])
-        expected = numpy.array([[-0.735788, -2.625397]])
+        expected = numpy.array([[-2.625397, -0.735788]])
         try:
             numpy.testing.assert_array_almost_equal(
                 res,
@@ -172,6 +196,14 @@ class EwaldSumMatrixCrystalTest(unittest.TestCase):
         except AssertionError as e:
             self.fail(e)
 
+    def test_n_eigen(self):
+        a = EwaldSumMatrix(input_type=H_INPUT, eigen=True, n_eigen=1)
+        res = a.fit_transform([H2])
+        try:
+            numpy.testing.assert_array_almost_equal(res, [[-2.625397]])
+        except AssertionError as e:
+            self.fail(e)
+
 
 class SineMatrixTest(unittest.TestCase):
     def test_fit(self):
@@ -247,6 +279,14 @@ class SineMatrixTest(unittest.TestCase):
         except AssertionError as e:
             self.fail(e)
 
+    def test_n_eigen(self):
+        a = SineMatrix(input_type=H_INPUT, eigen=True, n_eigen=1)
+        res = a.fit_transform([H2])
+        try:
+            numpy.testing.assert_array_almost_equal(res, [[0.975557]])
+        except AssertionError as e:
+            self.fail(e)
+
 
 if __name__ == '__main__':
     unittest.main()
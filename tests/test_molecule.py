@@ -1,11 +1,19 @@
 import unittest
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 import numpy
+import scipy.sparse
 
 from molml.molecule import BagOfBonds, Connectivity, Autocorrelation
 from molml.molecule import CoulombMatrix, EncodedBond, EncodedAngle
+from molml.utils import load_json, LazyValues
+from molml.base import WorkerPool
 
 from .constants import METHANE, BIG, MID, ALL_DATA
+from .constants import MID_NUMBERS, MID_COORDS
 
 METHANE2 = (METHANE[0], 2 * METHANE[1])
 ALL_ATOM = numpy.array([[1, 4, 0, 0],
@@ -13,6 +21,20 @@ ALL_ATOM = numpy.array([[1, 4, 0, 0],
                         [25, 15, 5, 4]])
 
 
+class CountingPool(WorkerPool):
+    """A pool that records the number of tasks of each map."""
+    def __init__(self, *args, **kwargs):
+        super(CountingPool, self).__init__(*args, **kwargs)
+        self.tasks = []
+
+    def map(self, f, seq, chunksize=None):
+        seq = list(seq)
+        if chunksize is None:
+            chunksize = self.get_chunksize(len(seq))
+        self.tasks.append(len(range(0, len(seq), chunksize)))
+        return super(CountingPool, self).map(f, seq, chunksize=chunksize)
+
+
 def assert_close_statistics(array, expected):
     '''
     Compare float arrays by comparing some statistics.
@@ -148,6 +170,138 @@ class ConnectivityTest(unittest.TestCase):
         except AssertionError as e:
             self.fail(e)
 
+    def test_transform_sparse(self):
+        kwargs = {"depth": 2, "use_bond_order": True, "add_unknown": True}
+        for tfidf in (False, True):
+            a = Connectivity(sparse=True, do_tfidf=tfidf, **kwargs)
+            a.fit([METHANE, MID])
+            res = a.transform(ALL_DATA)
+            self.assertTrue(scipy.sparse.isspmatrix_csr(res))
+            b = Connectivity(do_tfidf=tfidf, **kwargs)
+            b.fit([METHANE, MID])
+            try:
+                numpy.testing.assert_array_almost_equal(
+                    res.toarray(), b.transform(ALL_DATA))
+            except AssertionError as e:
+                self.fail(e)
+
+    def test_transform_sparse_parallel(self):
+        a = Connectivity(sparse=True, n_jobs=2)
+        res = a.fit_transform(ALL_DATA)
+        try:
+            numpy.testing.assert_array_equal(res.toarray(), ALL_ATOM)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_transform_sparse_refit(self):
+        a = Connectivity(sparse=True)
+        a.fit([METHANE])
+        self.assertEqual(a.transform(ALL_DATA).shape, (3, 2))
+        a.fit(ALL_DATA)
+        self.assertEqual(a.transform(ALL_DATA).shape, (3, 4))
+
+    def test_transform_iter_sparse(self):
+        a = Connectivity(sparse=True)
+        a.fit(ALL_DATA)
+        res = list(a.transform_iter(ALL_DATA, batch_size=2))
+        self.assertEqual([x.shape for x in res], [(2, 4), (1, 4)])
+        try:
+            numpy.testing.assert_array_equal(
+                scipy.sparse.vstack(res).toarray(), ALL_ATOM)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_transform_sparse_out(self):
+        a = Connectivity(sparse=True)
+        a.fit(ALL_DATA)
+        with self.assertRaises(ValueError):
+            a.transform(ALL_DATA, out=numpy.zeros((3, 4)))
+
+    def test_transform_other_bond_labels(self):
+        conn = {0: {1: 2, 2: 1, 3: 1, 4: 1},
+                1: {0: 2}, 2: {0: 1}, 3: {0: 1}, 4: {0: 1}}
+        data = [(METHANE[0], METHANE[1], conn)]
+        a = Connectivity(depth=2, use_bond_order=True)
+        a.fit(data)
+        self.assertEqual(a._base_chains,
+                         set([(('C', 'H', 1), ), (('C', 'H', 2), )]))
+        self.assertEqual(a.transform(data).tolist(), [[3, 1]])
+        b = Connectivity(depth=2)
+        self.assertEqual(b.fit_transform(data).tolist(), [[4]])
+
+    def test_transform_connections_list(self):
+        conn = {0: [1, 2, 3, 4], 1: [0], 2: [0], 3: [0], 4: [0]}
+        data = [(METHANE[0], METHANE[1], conn)]
+        a = Connectivity(depth=2)
+        self.assertEqual(a.fit_transform(data).tolist(), [[4]])
+
+    def test_partial_fit(self):
+        a = Connectivity(depth=2)
+        a.partial_fit([METHANE])
+        self.assertEqual(a._new_labels, (('C', 'H'), ))
+        a.partial_fit([MID, BIG])
+        b = Connectivity(depth=2).fit(ALL_DATA)
+        self.assertEqual(a._base_chains, b._base_chains)
+        self.assertEqual(set(a._new_labels), b._base_chains - {('C', 'H')})
+        a.partial_fit([METHANE])
+        self.assertEqual(a._new_labels, tuple())
+
+    def test_load_json_layouts(self):
+        a = Connectivity(depth=2)
+        expected = a.fit_transform(ALL_DATA)
+        f = StringIO()
+        a.save_json(f)
+        f.seek(0)
+        b = load_json(f)
+        layout = b._get_layouts()["_base_chains"]
+        self.assertEqual(layout.keys, tuple(sorted(a._base_chains)))
+        try:
+            numpy.testing.assert_array_almost_equal(b.transform(ALL_DATA),
+                                                    expected)
+        except AssertionError as e:
+            self.fail(e)
+        # The restored layout is used as is
+        self.assertIs(b._get_layouts()["_base_chains"], layout)
+
+    def test_partial_fit_tfidf(self):
+        a = Connectivity(do_tfidf=True)
+        for x in ALL_DATA:
+            a.partial_fit([x])
+        b = Connectivity(do_tfidf=True).fit(ALL_DATA)
+        try:
+            numpy.testing.assert_array_almost_equal(a.transform(ALL_DATA),
+                                                    b.transform(ALL_DATA))
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_fit_tfidf_parallel(self):
+        a = Connectivity(do_tfidf=True).fit(ALL_DATA)
+        b = Connectivity(do_tfidf=True, n_jobs=2).fit(ALL_DATA)
+        self.assertEqual(a._base_chains, b._base_chains)
+        self.assertEqual(a._idf_values, b._idf_values)
+
+    def test_partial_fit_tfidf_load_json(self):
+        a = Connectivity(depth=2, do_tfidf=True).fit(ALL_DATA[:2])
+        f = StringIO()
+        a.save_json(f)
+        f.seek(0)
+        b = load_json(f)
+        b.partial_fit(ALL_DATA[2:])
+        c = Connectivity(depth=2, do_tfidf=True).fit(ALL_DATA)
+        self.assertEqual(b._n_documents, 3)
+        self.assertEqual(set(b.get_labels()), set(c.get_labels()))
+        try:
+            numpy.testing.assert_array_almost_equal(b.transform(ALL_DATA),
+                                                    c.transform(ALL_DATA))
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_partial_fit_tfidf_no_counts(self):
+        a = Connectivity(do_tfidf=True).fit([METHANE])
+        a._idf_counts = None
+        with self.assertRaises(ValueError):
+            a.partial_fit([MID])
+
 
 class AutocorrelationTest(unittest.TestCase):
 
@@ -241,6 +395,77 @@ class AutocorrelationTest(unittest.TestCase):
         ])
         self.assertTrue((a.fit_transform(ALL_DATA) == expected).all())
 
+    def test_transform_batch(self):
+        a = Autocorrelation().fit(ALL_DATA)
+        expected = numpy.array([a._para_transform(x) for x in ALL_DATA])
+        try:
+            numpy.testing.assert_array_almost_equal(a.transform(ALL_DATA),
+                                                    expected)
+            numpy.testing.assert_array_almost_equal(
+                a.transform(ALL_DATA, out=numpy.zeros(expected.shape)),
+                expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_transform_parallel(self):
+        a = Autocorrelation(n_jobs=2).fit(ALL_DATA)
+        expected = Autocorrelation().fit_transform(ALL_DATA)
+        try:
+            numpy.testing.assert_array_almost_equal(a.transform(ALL_DATA),
+                                                    expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_transform_pool_tasks(self):
+        a = Autocorrelation().fit(ALL_DATA)
+        expected = a.transform(ALL_DATA)
+        with CountingPool(n_jobs=2) as pool:
+            a.set_pool(pool)
+            res = a.transform(ALL_DATA * 4)
+        # Each of the processes gets some of the molecules
+        self.assertGreater(pool.tasks[-1], 1)
+        try:
+            numpy.testing.assert_array_almost_equal(res, expected.tolist() * 4)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_user_connections(self):
+        a = Autocorrelation().fit([METHANE])
+        expected = a.transform([METHANE])
+        conns = [
+            {0: {1: 2, 2: 1, 3: 1, 4: 1},
+             1: {0: 2}, 2: {0: 1}, 3: {0: 1}, 4: {0: 1}},
+            {0: [1, 2, 3, 4], 1: [0], 2: [0], 3: [0], 4: [0]},
+        ]
+        for conn in conns:
+            data = [(METHANE[0], METHANE[1], conn)]
+            try:
+                numpy.testing.assert_array_almost_equal(a.transform(data),
+                                                        expected)
+            except AssertionError as e:
+                self.fail(e)
+
+    def test_repeated_depths(self):
+        a = Autocorrelation(depths=[2, 1, 2], properties=['I', 'Z'])
+        a.fit([METHANE])
+        expected = numpy.array([[12, 8, 12, 12, 48, 12]])
+        self.assertTrue((a.transform([METHANE]) == expected).all())
+
+    def test_no_depths(self):
+        a = Autocorrelation(depths=[])
+        a.fit(ALL_DATA)
+        self.assertEqual(a.transform(ALL_DATA).shape, (3, 0))
+
+    def test_transform_numbers(self):
+        a = Autocorrelation(depths=[0, 1])
+        a.fit(ALL_DATA)
+        data = [LazyValues(numbers=MID_NUMBERS, coords=MID_COORDS)]
+        try:
+            numpy.testing.assert_array_almost_equal(a.transform(data),
+                                                    a.transform([MID]))
+        except AssertionError as e:
+            self.fail(e)
+
 
 class EncodedBondTest(unittest.TestCase):
 
@@ -479,6 +704,32 @@ class EncodedBondTest(unittest.TestCase):
         except AssertionError as e:
             self.fail(e)
 
+    def test_user_connections(self):
+        a = EncodedBond(max_depth=1).fit([METHANE])
+        expected = a.transform([METHANE])
+        conns = [
+            {0: {1: 2, 2: 1, 3: 1, 4: 1},
+             1: {0: 2}, 2: {0: 1}, 3: {0: 1}, 4: {0: 1}},
+            {0: [1, 2, 3, 4], 1: [0], 2: [0], 3: [0], 4: [0]},
+        ]
+        for conn in conns:
+            data = [(METHANE[0], METHANE[1], conn)]
+            try:
+                numpy.testing.assert_array_almost_equal(a.transform(data),
+                                                        expected)
+            except AssertionError as e:
+                self.fail(e)
+
+    def test_transform_numbers(self):
+        a = EncodedBond().fit(ALL_DATA)
+        expected = a.transform(ALL_DATA)
+        data = [LazyValues(numbers=MID_NUMBERS, coords=MID_COORDS)]
+        try:
+            numpy.testing.assert_array_almost_equal(a.transform(data),
+                                                    expected[1:2])
+        except AssertionError as e:
+            self.fail(e)
+
 
 class EncodedAngleTest(unittest.TestCase):
 
@@ -648,11 +899,34 @@ class EncodedAngleTest(unittest.TestCase):
 
 class CoulombMatrixTest(unittest.TestCase):
 
+    def test_transform_pool_tasks(self):
+        a = CoulombMatrix().fit(ALL_DATA)
+        expected = a.transform(ALL_DATA)
+        with CountingPool(n_jobs=2) as pool:
+            a.set_pool(pool)
+            res = a.transform(ALL_DATA * 4)
+        self.assertGreater(pool.tasks[-1], 1)
+        try:
+            numpy.testing.assert_array_almost_equal(res, expected.tolist() * 4)
+        except AssertionError as e:
+            self.fail(e)
+
     def test_fit(self):
         a = CoulombMatrix()
         a.fit(ALL_DATA)
         self.assertEqual(a._max_size, 49)
 
+    def test_fit_parallel(self):
+        a = CoulombMatrix(n_jobs=2)
+        a.fit(ALL_DATA)
+        self.assertEqual(a._max_size, 49)
+
+    def test_partial_fit(self):
+        a = CoulombMatrix()
+        a.partial_fit([BIG])
+        a.partial_fit([METHANE, MID])
+        self.assertEqual(a._max_size, 49)
+
     def test_transform(self):
         a = CoulombMatrix()
         a.fit([METHANE])
@@ -671,6 +945,27 @@ class CoulombMatrixTest(unittest.TestCase):
         except AssertionError as e:
             self.fail(e)
 
+    def test_transform_batches(self):
+        for kwargs in [{}, {'sort': True}, {'eigen': True}]:
+            a = CoulombMatrix(**kwargs)
+            a.fit(ALL_DATA)
+            expected = numpy.array([a._para_transform(x) for x in ALL_DATA])
+            a.BATCH_SIZE = 2
+            try:
+                numpy.testing.assert_array_almost_equal(
+                    a.transform(ALL_DATA),
+                    expected)
+            except AssertionError as e:
+                self.fail(e)
+
+    def test_sort_padding(self):
+        a = CoulombMatrix(sort=True)
+        a.fit(ALL_DATA)
+        res = a.transform([METHANE]).reshape(49, 49)
+        self.assertTrue((res[:5, :5] != 0).all())
+        self.assertFalse(res[5:].any())
+        self.assertFalse(res[:, 5:].any())
+
     def test_small_to_large_transform(self):
         a = CoulombMatrix()
         a.fit([METHANE])
@@ -753,9 +1048,9 @@ class CoulombMatrixTest(unittest.TestCase):
         expected_results = numpy.array([
                                         40.04619974,
                                         -1.00605888,
-                                        -0.06059994,
+                                        -0.06071957,
                                         -0.06071616,
-                                        -0.06071957])
+                                        -0.06059994])
         try:
             numpy.testing.assert_array_almost_equal(
                 a.fit_transform([METHANE])[0],
@@ -763,6 +1058,29 @@ class CoulombMatrixTest(unittest.TestCase):
         except AssertionError as e:
             self.fail(e)
 
+    def test_positional_parameters(self):
+        a = CoulombMatrix('list', 1, True, False, True)
+        self.assertTrue(a.drop_values)
+        self.assertIsNone(a.n_eigen)
+
+    def test_n_eigen(self):
+        a = CoulombMatrix(eigen=True, n_eigen=2)
+        res = a.fit_transform([METHANE, BIG])
+        self.assertEqual(res.shape, (2, 2))
+        try:
+            numpy.testing.assert_array_almost_equal(
+                res[0],
+                [40.04619974, -1.00605888])
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_n_eigen_larger_than_molecule(self):
+        a = CoulombMatrix(eigen=True, n_eigen=8)
+        a.fit(ALL_DATA)
+        res = a.transform([METHANE])
+        self.assertEqual(res.shape, (1, 8))
+        self.assertFalse(res[0, 5:].any())
+
 
 class BagOfBondsTest(unittest.TestCase):
 
@@ -792,6 +1110,20 @@ class BagOfBondsTest(unittest.TestCase):
         }
         self.assertEqual(a._bag_sizes, expected_results)
 
+    def test_fit_parallel(self):
+        a = BagOfBonds(n_jobs=2).fit(ALL_DATA)
+        b = BagOfBonds().fit(ALL_DATA)
+        self.assertEqual(a._bag_sizes, b._bag_sizes)
+
+    def test_partial_fit(self):
+        a = BagOfBonds()
+        a.partial_fit([METHANE])
+        self.assertEqual(a._new_labels, (('C', 'H'), ('H', 'H')))
+        a.partial_fit([MID, BIG])
+        b = BagOfBonds().fit(ALL_DATA)
+        self.assertEqual(a._bag_sizes, b._bag_sizes)
+        self.assertNotIn(('C', 'H'), a._new_labels)
+
     def test_transform(self):
         a = BagOfBonds()
         a.fit([METHANE])
@@ -817,6 +1149,29 @@ class BagOfBondsTest(unittest.TestCase):
         a.fit([METHANE])
         self.assertEqual(a.transform(ALL_DATA).shape, (3, 10))
 
+    def test_drop_values_keeps_largest(self):
+        a = BagOfBonds(drop_values=True)
+        a.fit([METHANE])
+        b = BagOfBonds()
+        b.fit([MID])
+        res = a.transform([MID])[0]
+        full = b.transform([MID])[0]
+        start = 0
+        for key in sorted(b._bag_sizes):
+            size = b._bag_sizes[key]
+            if key in a._bag_sizes:
+                n = min(size, a._bag_sizes[key])
+                idx = sorted(a._bag_sizes).index(key)
+                offset = sum(a._bag_sizes[x] for x in
+                             sorted(a._bag_sizes)[:idx])
+                try:
+                    numpy.testing.assert_array_almost_equal(
+                        res[offset:offset + n],
+                        full[start:start + n])
+                except AssertionError as e:
+                    self.fail(e)
+            start += size
+
     def test_large_to_small_transform(self):
         a = BagOfBonds()
         a.fit([BIG])
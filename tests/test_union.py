@@ -0,0 +1,166 @@
+import unittest
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import numpy
+
+from molml.atom import Shell, LocalEncodedBond
+from molml.crystal import GenerallizedCrystal
+from molml.molecule import Connectivity, EncodedBond, CoulombMatrix
+from molml.molecule import Autocorrelation
+from molml.union import FeatureUnion
+from molml.utils import LazyValues, load_json
+
+from .constants import METHANE, ALL_DATA
+from .test_crystal import H, H_INPUT
+
+
+def get_transformers():
+    return [EncodedBond(), Connectivity(depth=2), CoulombMatrix(),
+            Autocorrelation()]
+
+
+class FeatureUnionTest(unittest.TestCase):
+
+    def test_fit(self):
+        a = FeatureUnion(transformers=get_transformers())
+        a.fit(ALL_DATA)
+        for x, y in zip(a.transformers, get_transformers()):
+            y.fit(ALL_DATA)
+            self.assertEqual(x.to_json(), y.to_json())
+
+    def test_partial_fit(self):
+        a = FeatureUnion(transformers=get_transformers())
+        a.partial_fit(ALL_DATA[:1])
+        a.partial_fit(ALL_DATA[1:])
+        for x, y in zip(a.transformers, get_transformers()):
+            y.fit(ALL_DATA)
+            self.assertEqual(x.to_json(), y.to_json())
+        expected = (a.transformers[0]._new_labels +
+                    a.transformers[1]._new_labels)
+        self.assertEqual(a._new_labels, expected)
+
+    def test_transform(self):
+        a = FeatureUnion(transformers=get_transformers())
+        res = a.fit_transform(ALL_DATA)
+        expected = numpy.hstack([x.fit_transform(ALL_DATA)
+                                 for x in get_transformers()])
+        try:
+            numpy.testing.assert_array_almost_equal(res, expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_transform_parallel(self):
+        a = FeatureUnion(transformers=get_transformers())
+        expected = a.fit_transform(ALL_DATA)
+        b = FeatureUnion(n_jobs=2, transformers=get_transformers())
+        try:
+            numpy.testing.assert_array_almost_equal(
+                b.fit_transform(ALL_DATA),
+                expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_transform_atoms(self):
+        a = FeatureUnion(transformers=[Shell(), LocalEncodedBond()])
+        res = a.fit_transform(ALL_DATA)
+        shell = Shell().fit_transform(ALL_DATA)
+        bond = LocalEncodedBond().fit_transform(ALL_DATA)
+        for x, y, z in zip(res, shell, bond):
+            try:
+                numpy.testing.assert_array_almost_equal(x,
+                                                        numpy.hstack([y, z]))
+            except AssertionError as e:
+                self.fail(e)
+
+    def test_transform_rows_mismatch(self):
+        a = FeatureUnion(transformers=[Shell(), CoulombMatrix()])
+        a.fit(ALL_DATA)
+        with self.assertRaises(ValueError):
+            a.transform(ALL_DATA)
+
+    def test_transform_sparse(self):
+        a = FeatureUnion(transformers=[Connectivity(sparse=True)])
+        res = a.fit_transform(ALL_DATA)
+        expected = Connectivity().fit_transform(ALL_DATA)
+        self.assertIsInstance(res, numpy.ndarray)
+        try:
+            numpy.testing.assert_array_almost_equal(res, expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_transform_crystal(self):
+        def get_crystal():
+            t = Connectivity(input_type=H_INPUT)
+            return GenerallizedCrystal(transformer=t, radius=2.5)
+
+        a = FeatureUnion(transformers=[get_crystal(),
+                                       Connectivity(input_type=H_INPUT)])
+        res = a.fit_transform([H])
+        expected = numpy.hstack([get_crystal().fit_transform([H]),
+                                 Connectivity(input_type=H_INPUT)
+                                 .fit_transform([H])])
+        try:
+            numpy.testing.assert_array_almost_equal(res, expected)
+        except AssertionError as e:
+            self.fail(e)
+        self.assertEqual(a.get_labels(), (('H', ), ('H', )))
+
+    def test_convert_once(self):
+        counts = []
+
+        def convert(X):
+            counts.append(1)
+            return LazyValues(elements=X[0], coords=X[1])
+
+        transformers = [EncodedBond(input_type=convert),
+                        Connectivity(input_type=convert)]
+        a = FeatureUnion(transformers=transformers)
+        a.fit(ALL_DATA)
+        self.assertEqual(len(counts), len(ALL_DATA))
+        a.transform(ALL_DATA)
+        self.assertEqual(len(counts), 2 * len(ALL_DATA))
+
+    def test_get_labels(self):
+        transformers = [Connectivity(), Autocorrelation(properties=['Z'])]
+        a = FeatureUnion(transformers=transformers)
+        a.fit([METHANE])
+        expected = (('C', ), ('H', ), 'Z0', 'Z1', 'Z2', 'Z3')
+        self.assertEqual(a.get_labels(), expected)
+
+    def test_input_type(self):
+        a = FeatureUnion(transformers=[Connectivity(input_type='filename')])
+        self.assertEqual(a.input_type, 'filename')
+        a = FeatureUnion()
+        self.assertEqual(a.input_type, 'list')
+
+    def test_input_type_mismatch(self):
+        with self.assertRaises(ValueError):
+            FeatureUnion(transformers=[Connectivity(input_type='filename'),
+                                       Connectivity()])
+
+    def test_transform_before_fit(self):
+        a = FeatureUnion(transformers=get_transformers())
+        with self.assertRaises(ValueError):
+            a.transform(ALL_DATA)
+
+    def test_save_json(self):
+        a = FeatureUnion(transformers=[CoulombMatrix(), Autocorrelation()])
+        expected = a.fit_transform(ALL_DATA)
+        f = StringIO()
+        a.save_json(f)
+        f.seek(0)
+        b = load_json(f)
+        self.assertEqual(len(b.transformers), 2)
+        self.assertEqual(b.transformers[0]._max_size, 49)
+        try:
+            numpy.testing.assert_array_almost_equal(b.transform(ALL_DATA),
+                                                    expected)
+        except AssertionError as e:
+            self.fail(e)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,25 @@
 import unittest
 import os
 import json
+import pickle
 
 import numpy
 
 from molml.utils import get_connections, get_depth_threshold_mask_connections
-from molml.utils import get_graph_distance
+from molml.utils import get_bond_type, get_bond_types
+from molml.utils import get_graph_distance, get_connections_matrix
 from molml.utils import LazyValues, SMOOTHING_FUNCTIONS
 from molml.utils import get_coulomb_matrix, get_element_pairs
+from molml.utils import get_coulomb_matrices
 from molml.utils import deslugify, _get_form_indices, get_index_mapping
-from molml.utils import sort_chain, needs_reversal
-from molml.utils import load_json
+from molml.utils import get_index_table, get_angles, get_triplet_angles
+from molml.utils import get_cutoff_pairs, get_cutoff_triplets
+from molml.utils import get_pair_triplets
+from molml.utils import get_bond_graph, connections_to_bond_graph
+from molml.utils import bond_graph_to_connections, get_chains
+from molml.utils import sort_chain, needs_reversal, get_reversal_mask
+from molml.utils import load_json, FeatureLayout
+from molml.constants import TYPE_ORDER
 
 
 DATA_PATH = os.path.join(os.path.dirname(__file__), "data")
@@ -112,6 +121,21 @@ class UtilsTest(unittest.TestCase):
         except AssertionError as e:
             self.fail(e)
 
+    def test_get_coulomb_matrices(self):
+        nums = [[1, 1, 1], [6, 1, 0]]
+        coords = [[[0.0, 0.0, 0.0], [0.0, 0.0, .5], [0.0, 0.5, 0.0]],
+                  [[0.0, 0.0, 0.0], [0.0, 0.0, 1.], [0.0, 0.0, 0.0]]]
+        res = get_coulomb_matrices(nums, coords)
+        self.assertEqual(res.shape, (2, 3, 3))
+        for i, n in enumerate([3, 2]):
+            expected = numpy.zeros((3, 3))
+            expected[:n, :n] = get_coulomb_matrix(nums[i][:n],
+                                                  coords[i][:n])
+            try:
+                numpy.testing.assert_array_almost_equal(res[i], expected)
+            except AssertionError as e:
+                self.fail(e)
+
     def test_get_coulomb_matrix_use_decay(self):
         nums = [1, 1, 1]
         coords = [[0.0, 0.0, 0.0], [0.0, 0.0, .5], [0.0, 0.5, 0.0]]
@@ -227,6 +251,68 @@ class UtilsTest(unittest.TestCase):
             else:
                 self.assertEqual(f("NEW"), -1)
 
+    def test_get_index_table(self):
+        values = [('H', 'H'), ('H', 'C')]
+        f, length, both = get_index_mapping(values, 2, False)
+        table, valid = get_index_table(f, ['C', 'H', 'O'], 2)
+        self.assertEqual(table.shape, (3, 3))
+        expected_valid = [
+            [False, True, False],
+            [True, True, False],
+            [False, False, False],
+        ]
+        self.assertEqual(valid.tolist(), expected_valid)
+        self.assertEqual(table[0, 1], f(('C', 'H')))
+        self.assertEqual(table[1, 0], f(('H', 'C')))
+        self.assertEqual(table[1, 1], f(('H', 'H')))
+
+    def test_get_index_table_1d(self):
+        f, length, both = get_index_mapping(['C', 'H'], 1, True)
+        table, valid = get_index_table(f, ['C', 'H', 'O'], 1)
+        self.assertEqual(valid.tolist(), [True, True, True])
+        self.assertEqual(table.tolist(), [0, 1, -1])
+
+    def test_get_cutoff_pairs(self):
+        pairs = get_cutoff_pairs(COORDS, 1.2)
+        self.assertEqual(pairs.tolist(), [[0, 1], [0, 2], [0, 3], [0, 4]])
+        pairs = get_cutoff_pairs(COORDS, 0.1)
+        self.assertEqual(pairs.shape, (0, 2))
+
+    def test_get_cutoff_triplets(self):
+        i, j, k = get_cutoff_triplets(COORDS, 1.2)
+        # All triplets centered on the carbon, and the hydrogen round trips
+        expected = [(x, 0, y) for x in range(1, 5) for y in range(1, 5)]
+        expected += [(0, x, 0) for x in range(1, 5)]
+        self.assertEqual(list(zip(i, j, k)), sorted(expected))
+
+    def test_get_cutoff_triplets_all(self):
+        i, j, k = get_cutoff_triplets(COORDS, 10.)
+        n = len(COORDS)
+        expected = [(x, y, z) for x in range(n) for y in range(n)
+                    for z in range(n) if x != y and y != z]
+        self.assertEqual(list(zip(i, j, k)), expected)
+
+    def test_get_pair_triplets(self):
+        i, j, k = get_pair_triplets([[0, 1], [1, 2]], 4)
+        expected = [(0, 1, 0), (0, 1, 2), (1, 0, 1), (1, 2, 1), (2, 1, 0),
+                    (2, 1, 2)]
+        self.assertEqual(list(zip(i, j, k)), expected)
+
+    def test_get_pair_triplets_empty(self):
+        i, j, k = get_pair_triplets([], 3)
+        self.assertEqual((len(i), len(j), len(k)), (0, 0, 0))
+
+    def test_get_triplet_angles(self):
+        coords = numpy.array(COORDS)
+        i, j, k = get_cutoff_triplets(coords, 10.)
+        expected = get_angles(coords)[i, j, k]
+        try:
+            numpy.testing.assert_array_almost_equal(
+                get_triplet_angles(coords, i, j, k),
+                expected)
+        except AssertionError as e:
+            self.fail(e)
+
     def test_sort_chain(self):
         needs_flip = ("O", "H", "C")
         expected = ("C", "H", "O")
@@ -249,6 +335,24 @@ class UtilsTest(unittest.TestCase):
         no_flip = ("O", "C", "H", "O")
         self.assertFalse(needs_reversal(no_flip))
 
+    def test_get_reversal_mask(self):
+        chains = numpy.array([[2, 1, 0],
+                              [0, 1, 2],
+                              [1, 2, 1]])
+        self.assertEqual(get_reversal_mask(chains).tolist(),
+                         [True, False, False])
+
+        chains = numpy.array([[2, 1, 1, 0],
+                              [2, 1, 1, 2],
+                              [2, 0, 1, 2],
+                              [0, 1, 2, 2]])
+        expected = [needs_reversal(tuple(x)) for x in chains]
+        self.assertEqual(get_reversal_mask(chains).tolist(), expected)
+
+    def test_get_reversal_mask_single(self):
+        chains = numpy.array([[1], [0]])
+        self.assertEqual(get_reversal_mask(chains).tolist(), [False, False])
+
     def test_load_json(self):
         data = {'parameters': {'n_jobs': 2,
                                'input_type': 'list'},
@@ -304,6 +408,28 @@ class UtilsTest(unittest.TestCase):
         res = get_connections(ELEMENTS, COORDS)
         self.assertEqual(res, CONNECTIONS)
 
+    def test_get_connections_brute_force(self):
+        elements = ['C', 'H', 'N', 'O', 'F', 'P', 'S', 'Cl'] * 5
+        coords = numpy.random.RandomState(0).rand(len(elements), 3) * 4
+        res = get_connections(elements, coords)
+        expected = {i: {} for i in range(len(elements))}
+        for i, ele1 in enumerate(elements):
+            for j, ele2 in enumerate(elements):
+                dist = numpy.linalg.norm(coords[i] - coords[j])
+                bond_type = get_bond_type(ele1, ele2, dist)
+                if i != j and bond_type:
+                    expected[i][j] = bond_type
+        self.assertEqual(res, expected)
+
+    def test_get_connections_unknown_element(self):
+        res = get_connections(['Xx', 'H'], [[0., 0., 0.], [0., 0., .5]])
+        self.assertEqual(res, {0: {}, 1: {}})
+
+    def test_get_bond_types(self):
+        res = get_bond_types([6, 6, 6, 1, 0], [6, 6, 6, 1, 1],
+                             [1.2, 1.5, 2.0, 0.7, 0.1])
+        self.assertEqual(res.tolist(), [3, 0, -1, 0, -1])
+
     def test_get_graph_distance(self):
         conn = {
             0: {1: '1'},
@@ -328,6 +454,102 @@ class UtilsTest(unittest.TestCase):
         except AssertionError as e:
             self.fail(e)
 
+    def test_get_graph_distance_max_depth(self):
+        conn = {
+            0: {1: '1'},
+            1: {0: '1', 2: '1'},
+            2: {1: '1', 3: '1'},
+            3: {2: '1'},
+        }
+        inf = numpy.inf
+        expected = numpy.array([
+            [0, 1, 2, inf],
+            [1, 0, 1, 2],
+            [2, 1, 0, 1],
+            [inf, 2, 1, 0],
+        ])
+        res = get_graph_distance(conn, max_depth=2)
+        try:
+            numpy.testing.assert_equal(res, expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_get_connections_matrix(self):
+        res = get_connections_matrix(CONNECTIONS)
+        expected = numpy.zeros((5, 5))
+        expected[0, 1:] = 1
+        expected[1:, 0] = 1
+        try:
+            numpy.testing.assert_equal(res.toarray(), expected)
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_get_bond_graph(self):
+        res = get_bond_graph(ELEMENTS, COORDS)
+        self.assertEqual(res.data.dtype, numpy.int8)
+        self.assertEqual(res.indptr.tolist(), [0, 4, 5, 6, 7, 8])
+        self.assertEqual(res.indices.tolist(), [1, 2, 3, 4, 0, 0, 0, 0])
+        self.assertEqual(res.data.tolist(), [1] * 8)
+
+    def test_get_bond_graph_empty(self):
+        res = get_bond_graph([], numpy.zeros((0, 3)))
+        self.assertEqual(res.shape, (0, 0))
+        self.assertEqual(bond_graph_to_connections(res), {})
+
+    def test_bond_graph_round_trip(self):
+        conn = {
+            0: {1: '2', 2: 'Ar'},
+            1: {0: '2'},
+            2: {0: 'Ar', 3: '3'},
+            3: {2: '3'},
+            4: {},
+        }
+        graph = connections_to_bond_graph(conn)
+        self.assertEqual(graph.data.tolist(), [3, 2, 3, 2, 4, 4])
+        self.assertEqual(bond_graph_to_connections(graph), conn)
+
+    def test_connections_to_bond_graph_other_labels(self):
+        conn = {0: {1: 2, 2: '1'}, 1: {0: 2}, 2: {0: '1'}}
+        graph, labels = connections_to_bond_graph(conn, return_labels=True)
+        self.assertEqual(labels, tuple(TYPE_ORDER) + (2, ))
+        self.assertEqual(graph.data.tolist(), [5, 1, 5, 1])
+
+    def test_connections_to_bond_graph_list(self):
+        conn = {0: [1, 2], 1: [0], 2: [0]}
+        graph, labels = connections_to_bond_graph(conn, return_labels=True)
+        self.assertEqual(labels[graph[0, 1] - 1], None)
+        self.assertEqual(graph.indices.tolist(), [1, 2, 0, 0])
+
+    def test_get_chains(self):
+        graph = get_bond_graph(ELEMENTS, COORDS)
+        self.assertEqual(get_chains(graph, 1).tolist(),
+                         [[0], [1], [2], [3], [4]])
+        self.assertEqual(get_chains(graph, 2).tolist(),
+                         [[0, 1], [0, 2], [0, 3], [0, 4]])
+        expected = [[1, 0, 2], [1, 0, 3], [1, 0, 4],
+                    [2, 0, 3], [2, 0, 4], [3, 0, 4]]
+        self.assertEqual(sorted(get_chains(graph, 3).tolist()), expected)
+        self.assertEqual(get_chains(graph, 4).shape, (0, 4))
+
+    def test_get_chains_ring(self):
+        conn = {i: {(i - 1) % 4: '1', (i + 1) % 4: '2'} for i in range(4)}
+        graph = connections_to_bond_graph(conn)
+        chains, bonds = get_chains(graph, 4, return_bonds=True)
+        # Each path around the ring is only included once
+        self.assertEqual(chains.shape, (4, 4))
+        self.assertTrue((chains[:, 0] < chains[:, -1]).all())
+        for chain, bond in zip(chains, bonds):
+            expected = [graph[x, y] for x, y in zip(chain[:-1], chain[1:])]
+            self.assertEqual(bond.tolist(), expected)
+
+    def test_get_graph_distance_bond_graph(self):
+        graph = get_bond_graph(ELEMENTS, COORDS)
+        expected = get_graph_distance(CONNECTIONS)
+        try:
+            numpy.testing.assert_equal(get_graph_distance(graph), expected)
+        except AssertionError as e:
+            self.fail(e)
+
     def test_get_connections_disjoint(self):
         coords2 = numpy.array(COORDS) + 1
         res = get_connections(ELEMENTS, COORDS, ELEMENTS, coords2)
@@ -434,6 +656,90 @@ class UtilsTest(unittest.TestCase):
             self.fail(e)
 
 
+class FeatureLayoutTest(unittest.TestCase):
+
+    def test_columns(self):
+        a = FeatureLayout([('H', 'H'), ('C', 'H'), ['C', 'C']])
+        self.assertEqual(a.keys, (('C', 'C'), ('C', 'H'), ('H', 'H')))
+        self.assertEqual(a.columns[('C', 'H')], 1)
+        self.assertEqual(a.length, 3)
+        self.assertEqual(a.get_index(('H', 'H')), 2)
+
+    def test_mapping(self):
+        pairs = [('C', 'H'), ('H', 'H')]
+        a = FeatureLayout(pairs, form=1, add_unknown=True)
+        get_index, length, both = get_index_mapping(pairs, 1, True)
+        self.assertEqual(a.length, length)
+        self.assertEqual(a.both, both)
+        self.assertEqual(a.get_index(('H', 'H')), get_index(('H', 'H')))
+        self.assertEqual(a.get_index(('O', 'O')), -1)
+
+    def test_get_table(self):
+        a = FeatureLayout([('C', 'H'), ('H', 'H')], form=2)
+        table, valid = a.get_table(['C', 'H'], 2)
+        self.assertEqual(table.tolist(), [[0, 0], [0, 1]])
+        self.assertEqual(valid.tolist(), [[False, True], [True, True]])
+        # The tables are only built once
+        self.assertIs(a.get_table(['C', 'H'], 2)[0], table)
+
+    def test_empty(self):
+        a = FeatureLayout([], form=2)
+        self.assertEqual(a.length, 0)
+        _, valid = a.get_table(['C'], 2)
+        self.assertFalse(valid.any())
+        a = FeatureLayout([], form=2, add_unknown=True)
+        self.assertEqual(a.length, 1)
+        self.assertEqual(a.get_index(('C', 'C')), -1)
+
+    def test_encode(self):
+        a = FeatureLayout([('C', 'H'), ('H', 'H')], form=2)
+        expected = [0, 1, 2, 1]
+        data = LazyValues(elements=['C', 'H', 'O', 'H'])
+        self.assertEqual(a.encode(data).tolist(), expected)
+        data = LazyValues(numbers=[6, 1, 8, 1])
+        self.assertEqual(a.encode(data).tolist(), expected)
+        self.assertEqual(a.encode_elements(['C', 'H', 'O', 'H']).tolist(),
+                         expected)
+
+    def test_encode_not_elements(self):
+        a = FeatureLayout([('C1', 'H'), ('H', 'X')], form=2)
+        data = LazyValues(elements=['X', 'C1', 'H', 'C'])
+        self.assertEqual(a.encode(data).tolist(), [2, 0, 1, 3])
+        # Labels that are not elements in the molecule
+        a = FeatureLayout([('C', 'H')], form=2)
+        self.assertEqual(a.encode(data).tolist(), [2, 2, 1, 0])
+
+    def test_get_code_table(self):
+        pairs = [('C', 'H'), ('H', 'H')]
+        for form, add_unknown in [(0, False), (1, False), (1, True),
+                                  (2, False), (2, True)]:
+            a = FeatureLayout(pairs, form=form, add_unknown=add_unknown)
+            table, valid = a.get_code_table(2)
+            labels = ['C', 'H', 'O']
+            expected = a.get_table(labels, 2)
+            self.assertEqual(table.tolist(), expected[0].tolist())
+            self.assertEqual(valid.tolist(), expected[1].tolist())
+
+    def test_get_code_table_single(self):
+        a = FeatureLayout(['C', 'H'], form=1)
+        table, valid = a.get_code_table(1)
+        self.assertEqual(table[valid].tolist(), [0, 1])
+        self.assertEqual(valid.tolist(), [True, True, False])
+
+    def test_json(self):
+        a = FeatureLayout([('C', 'H'), ('H', 'H')], form=1)
+        data = json.loads(json.dumps(a.to_json()))
+        b = FeatureLayout.from_json(data)
+        self.assertEqual(a.keys, b.keys)
+        self.assertEqual(a.form, b.form)
+        self.assertEqual(b.get_index(('H', 'H')), a.get_index(('H', 'H')))
+
+    def test_pickle(self):
+        a = FeatureLayout([('C', 'H'), ('H', 'H')], form=1)
+        b = pickle.loads(pickle.dumps(a))
+        self.assertEqual(b.get_index(('C', 'H')), a.get_index(('C', 'H')))
+
+
 class LazyValuesTest(unittest.TestCase):
 
     def test_all(self):
@@ -474,6 +780,96 @@ class LazyValuesTest(unittest.TestCase):
         a = LazyValues(elements=ELEMENTS, coords=COORDS, numbers=NUMBERS)
         self.assertEqual(a.connections, CONNECTIONS)
 
+    def test_bond_graph(self):
+        a = LazyValues(elements=ELEMENTS, coords=COORDS)
+        graph = a.bond_graph
+        self.assertIsNone(a._connections)
+        self.assertEqual(graph.indices.tolist(), [1, 2, 3, 4, 0, 0, 0, 0])
+        self.assertEqual(a.connections, CONNECTIONS)
+
+    def test_bond_graph_from_connections(self):
+        a = LazyValues(connections=CONNECTIONS)
+        self.assertEqual(a.bond_graph.indices.tolist(),
+                         [1, 2, 3, 4, 0, 0, 0, 0])
+
+    def test_distances(self):
+        a = LazyValues(elements=ELEMENTS, coords=COORDS)
+        self.assertIs(a.distances, a.distances)
+        try:
+            numpy.testing.assert_array_almost_equal(
+                a.distances,
+                numpy.linalg.norm(numpy.array(COORDS)[:, None] - COORDS,
+                                  axis=2))
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_angles(self):
+        a = LazyValues(elements=ELEMENTS, coords=COORDS)
+        self.assertIs(a.angles, a.angles)
+        try:
+            numpy.testing.assert_array_equal(a.angles,
+                                             get_angles(numpy.array(COORDS)))
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_graph_distance(self):
+        a = LazyValues(elements=ELEMENTS, coords=COORDS)
+        self.assertIs(a.graph_distance, a.graph_distance)
+        try:
+            numpy.testing.assert_array_equal(a.graph_distance,
+                                             get_graph_distance(CONNECTIONS))
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_get_depth_mask(self):
+        a = LazyValues(elements=ELEMENTS, coords=COORDS)
+        for min_depth, max_depth in [(0, 0), (0, 1), (1, 1), (2, 3),
+                                     (0, numpy.inf)]:
+            expected = get_depth_threshold_mask_connections(
+                CONNECTIONS, min_depth=min_depth, max_depth=max_depth)
+            res = a.get_depth_mask(min_depth=min_depth, max_depth=max_depth)
+            try:
+                numpy.testing.assert_array_equal(res, expected)
+            except AssertionError as e:
+                self.fail(e)
+        self.assertIs(a.get_depth_mask(1, 1), a.get_depth_mask(1, 1))
+
+    def test_get_depth_mask_no_limit(self):
+        a = LazyValues(elements=ELEMENTS, coords=COORDS)
+        self.assertTrue(a.get_depth_mask().all())
+        self.assertEqual(a.get_depth_mask().shape, (5, 5))
+        # The distances are not needed to get the size
+        self.assertNotIn("distances", a._cache)
+
+    def test_get_cutoff_triplets(self):
+        a = LazyValues(elements=ELEMENTS, coords=COORDS)
+        coords = numpy.array(COORDS)
+        i, j, k = a.get_cutoff_triplets(1.2)
+        expected = get_cutoff_triplets(coords, 1.2)
+        for x, y in zip((i, j, k), expected):
+            self.assertEqual(x.tolist(), y.tolist())
+        self.assertEqual(a.get_cutoff_pairs(1.2).tolist(),
+                         get_cutoff_pairs(coords, 1.2).tolist())
+        try:
+            numpy.testing.assert_array_almost_equal(
+                a.get_triplet_angles(1.2),
+                get_triplet_angles(coords, i, j, k))
+        except AssertionError as e:
+            self.fail(e)
+
+    def test_fill_in_crystal_clears_cache(self):
+        a = LazyValues(elements=ELEMENTS, coords=COORDS, unit_cell=UNIT_CELL)
+        self.assertEqual(a.distances.shape, (5, 5))
+        a.fill_in_crystal(radius=1.)
+        self.assertEqual(a.distances.shape, (15, 15))
+
+    def test_fill_in_crystal_bond_graph(self):
+        a = LazyValues(elements=ELEMENTS, coords=COORDS, unit_cell=UNIT_CELL)
+        a.bond_graph
+        a.fill_in_crystal(radius=1.)
+        self.assertEqual(a.bond_graph.shape, (15, 15))
+        self.assertEqual(len(a.connections), 15)
+
     def test_fill_in_crystal(self):
         a = LazyValues(elements=ELEMENTS, coords=COORDS, numbers=NUMBERS,
                        connections=CONNECTIONS, unit_cell=UNIT_CELL)